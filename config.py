@@ -100,6 +100,11 @@ class MonitoringConfig:
     MONITOR_ROOT_PATH = os.getenv("MONITOR_ROOT_PATH", "/home/monitor/.log/")
 
 
+class EthCallCacheConfig:
+    ROOT_PATH = os.getenv("ETH_CALL_CACHE_ROOT_PATH", ".data/eth_call_cache/")
+    MAX_ENTRIES = int(os.getenv("ETH_CALL_CACHE_MAX_ENTRIES", 5000000))
+
+
 class MongoDBDexConfig:
     CONNECTION_URL = os.getenv("MONGODB_DEX_CONNECTION_URL")
     DATABASE = os.getenv('MONGODB_DEX_DATABASE', 'dex')
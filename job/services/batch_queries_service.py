@@ -1,3 +1,5 @@
+from typing import Any, Dict, Tuple
+
 from query_state_lib.base.mappers.eth_call_mapper import EthCall
 from query_state_lib.base.utils.encoder import encode_eth_call_data
 from web3 import Web3
@@ -6,9 +8,83 @@ from job.utils.logger_utils import get_logger
 
 logger = get_logger('Batch queries')
 
+# (fn_name, lower case contract address, arguments, block number)
+CallKey = Tuple[str, str, tuple, Any]
+
+
+def _normalize_call_arg(value):
+    if isinstance(value, str):
+        return value.lower()
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize_call_arg(item) for item in value)
+    return value
+
+
+def call_key(fn_name, contract_address, fn_paras=None, block_number='latest') -> CallKey:
+    """Structured id of a call, addresses and other string arguments are compared case insensitively"""
+    if fn_paras is None:
+        args = ()
+    elif isinstance(fn_paras, (list, tuple)):
+        args = _normalize_call_arg(fn_paras)
+    else:
+        args = (_normalize_call_arg(fn_paras),)
+    return fn_name, contract_address.lower(), args, _normalize_call_arg(block_number or 'latest')
+
+
+class CallPlan:
+    """eth_call batch deduplicated by call_key, results are decoded back keyed by call_key"""
+
+    def __init__(self):
+        self.calls: Dict[CallKey, EthCall] = {}
+
+    def __len__(self):
+        return len(self.calls)
+
+    def add(self, abi, fn_name, contract_address, block_number='latest', fn_paras=None) -> CallKey:
+        key = call_key(fn_name, contract_address, fn_paras, block_number)
+        if key in self.calls:
+            return key
+
+        args = []
+        if fn_paras is not None:
+            if type(fn_paras) is list:
+                args = fn_paras
+            else:
+                if Web3.isAddress(fn_paras):
+                    fn_paras = Web3.toChecksumAddress(fn_paras)
+                args = [fn_paras]
+
+        data_call = encode_eth_call_data(abi=abi, fn_name=fn_name, args=args)
+        self.calls[key] = EthCall(to=Web3.toChecksumAddress(contract_address), block_number=block_number or 'latest',
+                                  data=data_call, abi=abi, fn_name=fn_name, id=len(self.calls))
+        return key
+
+    def get_rpc_calls(self):
+        return list(self.calls.values())
+
+    def decode(self, data_responses) -> Dict[CallKey, Any]:
+        """Decode responses of the planned calls, calls without result are skipped"""
+        decoded_datas = {}
+        for key, eth_call in self.calls.items():
+            response_data = data_responses.get(eth_call.id)
+            if response_data is None or not response_data.result:
+                continue
+            try:
+                decoded_data = response_data.decode_result()
+            except Exception as e:
+                logger.error(f"An exception when decode data from provider: {e}")
+                raise
+
+            if len(decoded_data) == 1:
+                decoded_datas[key] = decoded_data[0]
+            else:
+                decoded_datas[key] = decoded_data
+        return decoded_datas
+
 
 def add_rpc_call(abi, fn_name, contract_address, block_number=None, fn_paras=None, list_rpc_call=None,
                  list_call_id=None):
+    """Add a call with a string id to list_rpc_call, CallPlan is preferred for new batches"""
     args = []
     if fn_paras is not None:
         if type(fn_paras) is list:
@@ -1,14 +1,13 @@
 import time
 
 from query_state_lib.client.client_querier import ClientQuerier
-from web3 import Web3
 
 from job.artifacts.abis.pool_v3_abi import UNISWAP_V3_POOL_ABI
 from job.artifacts.abis.uniswap_nft_manager_abi import UNISWAP_V3_NFT_MANAGER_ABI
 from job.constants.network_constants import Networks
 from job.databases.blockchain_etl import BlockchainETL
 from job.databases.mongodb_klg import MongoDB
-from job.services.batch_queries_service import decode_data_response, add_rpc_call
+from job.services.batch_queries_service import CallPlan, call_key
 from job.utils.sqrt_price_math import get_fees
 
 mongo_klg = MongoDB()
@@ -68,39 +67,30 @@ def get_wallets():
 
             collected_fee[token_id]['amount0'] += int(amount0)
             collected_fee[token_id]['amount1'] += int(amount1)
-    list_call_id, list_rpc_call = [], []
+    call_plan = CallPlan()
 
     for pool_address, tokens in token_pools.items():
         if tokens and pool_address:
-            checksum_pool_address = Web3.toChecksumAddress(pool_address)
-            add_rpc_call(abi=UNISWAP_V3_POOL_ABI, contract_address=checksum_pool_address, block_number='latest',
-                         fn_name="feeGrowthGlobal0X128", list_call_id=list_call_id, list_rpc_call=list_rpc_call)
-            add_rpc_call(abi=UNISWAP_V3_POOL_ABI, contract_address=checksum_pool_address, block_number='latest',
-                         fn_name="feeGrowthGlobal1X128", list_call_id=list_call_id, list_rpc_call=list_rpc_call)
-            add_rpc_call(abi=UNISWAP_V3_POOL_ABI, contract_address=checksum_pool_address, block_number='latest',
-                         fn_name="slot0", list_call_id=list_call_id, list_rpc_call=list_rpc_call)
+            call_plan.add(abi=UNISWAP_V3_POOL_ABI, contract_address=pool_address, block_number='latest',
+                          fn_name="feeGrowthGlobal0X128")
+            call_plan.add(abi=UNISWAP_V3_POOL_ABI, contract_address=pool_address, block_number='latest',
+                          fn_name="feeGrowthGlobal1X128")
+            call_plan.add(abi=UNISWAP_V3_POOL_ABI, contract_address=pool_address, block_number='latest',
+                          fn_name="slot0")
 
             for token_id, token_info in tokens.items():
                 tick_lower = token_info['tickLower']
                 tick_upper = token_info['tickUpper']
 
-                add_rpc_call(abi=UNISWAP_V3_POOL_ABI, contract_address=checksum_pool_address,
-                             fn_name="ticks", fn_paras=tick_lower, list_call_id=list_call_id,
-                             list_rpc_call=list_rpc_call, block_number='latest')
-                add_rpc_call(abi=UNISWAP_V3_POOL_ABI, contract_address=checksum_pool_address,
-                             fn_name="ticks", fn_paras=tick_upper, list_call_id=list_call_id, block_number='latest',
-                             list_rpc_call=list_rpc_call)
-                add_rpc_call(abi=UNISWAP_V3_NFT_MANAGER_ABI,
-                             contract_address=Web3.toChecksumAddress(nft_manager_address),
-                             fn_name="positions", fn_paras=int(token_id), list_call_id=list_call_id, block_number='latest',
-                             list_rpc_call=list_rpc_call)
+                call_plan.add(abi=UNISWAP_V3_POOL_ABI, contract_address=pool_address,
+                              fn_name="ticks", fn_paras=tick_lower, block_number='latest')
+                call_plan.add(abi=UNISWAP_V3_POOL_ABI, contract_address=pool_address,
+                              fn_name="ticks", fn_paras=tick_upper, block_number='latest')
+                call_plan.add(abi=UNISWAP_V3_NFT_MANAGER_ABI, contract_address=nft_manager_address,
+                              fn_name="positions", fn_paras=int(token_id), block_number='latest')
 
-    response = client_querier.sent_batch_to_provider(list_rpc_call)
-    filtered_list_call_id = []
-    for call_id in list_call_id:
-        if response[call_id].result:
-            filtered_list_call_id.append(call_id)
-    decoded_data = decode_data_response(response, filtered_list_call_id)
+    response = client_querier.sent_batch_to_provider(call_plan.get_rpc_calls())
+    decoded_data = call_plan.decode(response)
 
     uncollected_fee = {}
     for pool_address, tokens in token_pools.items():
@@ -109,19 +99,20 @@ def get_wallets():
             tick_upper = token_info['tickUpper']
             liquidity = token_info['liquidity']
             block_number = 'latest'
-            tick = decoded_data.get(f"slot0_{pool_address}_{block_number}".lower())[1]
+            tick = decoded_data.get(call_key('slot0', pool_address, block_number=block_number))[1]
             fee_growth_global_0 = decoded_data.get(
-                f'feeGrowthGlobal0X128_{pool_address}_{block_number}'.lower())
+                call_key('feeGrowthGlobal0X128', pool_address, block_number=block_number))
             fee_growth_global_1 = decoded_data.get(
-                f'feeGrowthGlobal1X128_{pool_address}_{block_number}'.lower())
-            fee_growth_0_low_x128 = decoded_data.get(f'ticks_{pool_address}_{tick_lower}_{block_number}'.lower())[2]
-            fee_growth_1_low_x128 = decoded_data.get(f'ticks_{pool_address}_{tick_lower}_{block_number}'.lower())[3]
-            fee_growth_0_hi_x128 = decoded_data.get(f'ticks_{pool_address}_{tick_upper}_{block_number}'.lower())[2]
-            fee_growth_1_hi_x128 = decoded_data.get(f'ticks_{pool_address}_{tick_upper}_{block_number}'.lower())[3]
-            fee_growth_inside_0_x128 = \
-                decoded_data.get(f'positions_{nft_manager_address}_{token_id}_{block_number}'.lower())[8]
-            fee_growth_inside_1_x128 = \
-                decoded_data.get(f'positions_{nft_manager_address}_{token_id}_{block_number}'.lower())[9]
+                call_key('feeGrowthGlobal1X128', pool_address, block_number=block_number))
+            tick_lower_info = decoded_data.get(call_key('ticks', pool_address, tick_lower, block_number))
+            tick_upper_info = decoded_data.get(call_key('ticks', pool_address, tick_upper, block_number))
+            position = decoded_data.get(call_key('positions', nft_manager_address, int(token_id), block_number))
+            fee_growth_0_low_x128 = tick_lower_info[2]
+            fee_growth_1_low_x128 = tick_lower_info[3]
+            fee_growth_0_hi_x128 = tick_upper_info[2]
+            fee_growth_1_hi_x128 = tick_upper_info[3]
+            fee_growth_inside_0_x128 = position[8]
+            fee_growth_inside_1_x128 = position[9]
             token0_reward, token1_reward = get_fees(
                 fee_growth_global_0=fee_growth_global_0,
                 fee_growth_global_1=fee_growth_global_1,
@@ -1,7 +1,11 @@
 import click
 
+from src.cli.backfill_nft import backfill_nft_info
 from src.cli.calculate_optimized_range import calculate_optimized_price_range
 from src.cli.flagged_nft import nft_flagged
+from src.cli.manage_indexes import manage_indexes
+from src.cli.migrate_nft_change_logs import migrate_nft_change_logs
+from src.cli.rpc_stand_in import rpc_stand_in
 from src.cli.update_nft_stream import update_nft_info_stream
 from src.cli.nft_info_enricher import dex_nft_info_enricher
 from src.cli.update_wallet_info import dex_wallet_info_enricher
@@ -20,3 +24,7 @@ cli.add_command(update_nft_info_stream, "update_nft_info_stream")
 cli.add_command(nft_flagged, "nft_flagged")
 cli.add_command(calculate_optimized_price_range, "calculate_optimized_price_range")
 cli.add_command(dex_wallet_info_enricher, "dex_wallet_info_enricher")
+cli.add_command(backfill_nft_info, "backfill")
+cli.add_command(manage_indexes, "manage_indexes")
+cli.add_command(migrate_nft_change_logs, "migrate_nft_change_logs")
+cli.add_command(rpc_stand_in, "rpc_stand_in")
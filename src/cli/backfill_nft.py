@@ -0,0 +1,54 @@
+import click
+
+from src.constants.blockchain_etl_constants import DBPrefix
+from src.constants.network_constants import Chains
+from src.databases.dex_nft_manager_db import NFTMongoDB
+from src.exporters.nft_mongodb_exporter import NFTMongoDBExporter
+from src.jobs.backfill_nft_job import BackfillNftJob
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Backfill NFT')
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-s', '--start-block', required=True, type=int, help='Start block')
+@click.option('-e', '--end-block', required=True, type=int, help='End block')
+@click.option('-c', '--chain', default='bsc', show_default=True, type=str,
+              help='network name example bsc or polygon')
+@click.option('-r', '--range-size', default=10000, show_default=True, type=int,
+              help='How many blocks are compacted by a process at once')
+@click.option('-p', '--max-processes', default=4, show_default=True, type=int, help='The number of processes')
+@click.option('-b', '--nft-batch-size', default=1000, show_default=True, type=int,
+              help='How many nfts are merged and written in a bulk upsert')
+@click.option('-l', '--last-synced-block-file', default='last_synced_block.txt', show_default=True, type=str,
+              help='Checkpoint file of the stream that takes over after the backfill')
+@click.option('--stream-id', default=None, show_default=True, type=str, help='streamer id')
+def backfill_nft_info(start_block, end_block, chain, range_size, max_processes, nft_batch_size,
+                      last_synced_block_file, stream_id):
+    """Backfill NFTs of a block range in parallel, then update_nft_info_stream continues from the end block."""
+    chain = str(chain).lower()
+    if chain not in Chains.mapping:
+        raise click.BadOptionUsage("--chain", f"Chain {chain} is not support")
+    if end_block < start_block:
+        raise click.BadOptionUsage("--end-block", "End block must not be lower than start block")
+    chain_id = Chains.mapping[chain]
+    db_prefix = DBPrefix.mapping.get(chain, '')
+    logger.info(f'Backfill chain {chain} - prefix: {db_prefix} from block {start_block} to {end_block}')
+
+    _db = NFTMongoDB(db_prefix=db_prefix)
+    _exporter = NFTMongoDBExporter(_db)
+
+    job = BackfillNftJob(
+        importer=_db,
+        exporter=_exporter,
+        chain_id=chain_id,
+        db_prefix=db_prefix,
+        start_block=start_block,
+        end_block=end_block,
+        range_size=range_size,
+        max_processes=max_processes,
+        nft_batch_size=nft_batch_size,
+        stream_id=stream_id,
+        last_synced_block_file=last_synced_block_file
+    )
+    job.run()
@@ -0,0 +1,83 @@
+import click
+
+from src.constants.blockchain_etl_constants import DBPrefix
+from src.constants.mongo_constants import DexNFTManagerIndexes
+from src.constants.network_constants import Chains
+from src.databases.blockchain_etl import BlockchainETL
+from src.databases.dex_nft_manager_db import NFTMongoDB
+from src.jobs.update_nft_job import EVENT_TYPES, EVENT_FIELDS
+from src.utils.logger_utils import get_logger
+from src.utils.query_plan_utils import get_winning_plan_stages, is_index_used, create_dex_events_index, \
+    explain_dex_events_in_block_range, get_dex_events_last_block_number
+
+logger = get_logger('Manage Indexes')
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-c', '--chains', default='bsc', show_default=True, type=str,
+              help='Comma separated network names example bsc,ethereum')
+@click.option('--check-only', is_flag=True, default=False, show_default=True,
+              help='Only verify the indexes, do not create the missing ones')
+@click.option('--etl/--no-etl', default=False, show_default=True,
+              help='Also manage the dex_events collection of the blockchain ETL database')
+@click.option('-B', '--block-batch-size', default=180, show_default=True, type=int,
+              help='Size of the block range of the explained query')
+def manage_indexes(chains, check_only, etl, block_batch_size):
+    """Create and verify the dex_events and dex_nft_change_logs indexes the loaders rely on.
+
+    Every chain is checked with the explain plan of a block range read like the stream does, a collection scan or
+    another index than the managed one fails the command.
+    """
+    chain_names = [c.strip().lower() for c in str(chains).split(',') if c.strip()]
+    for chain_name in chain_names:
+        if chain_name not in Chains.mapping:
+            raise click.BadOptionUsage("--chains", f"Chain {chain_name} is not support")
+
+    failed = []
+    for chain_name in chain_names:
+        db_prefix = DBPrefix.mapping.get(chain_name, '')
+        nft_db = NFTMongoDB(db_prefix=db_prefix)
+        databases = [('dex_nft_manager', nft_db)]
+        if etl:
+            databases.append(('blockchain_etl', BlockchainETL(db_prefix=db_prefix)))
+
+        # Change logs are read by NFT ids, there is no query to explain
+        if not check_only and nft_db.create_nft_change_logs_index():
+            logger.info(f'[{chain_name}] Created index {DexNFTManagerIndexes.dex_nft_change_logs_nft_id_start_block}')
+
+        for database_name, db in databases:
+            name = f'{chain_name} {database_name}'
+            if not check_only and create_dex_events_index(db.dex_events_collection):
+                logger.info(f'[{name}] Created index {DexNFTManagerIndexes.dex_events_block_number_event_type}')
+            if not check_dex_events_index(name, db, block_batch_size):
+                failed.append(name)
+
+    if failed:
+        raise click.ClickException(f"Index check failed on: {', '.join(failed)}")
+    logger.info('All indexes are in place')
+
+
+def check_dex_events_index(name, db, block_batch_size):
+    index_name = DexNFTManagerIndexes.dex_events_block_number_event_type
+    if index_name not in db.dex_events_collection.index_information():
+        logger.warning(f'[{name}] Missing index {index_name}')
+        return False
+
+    end_block = get_dex_events_last_block_number(db.dex_events_collection)
+    if end_block is None:
+        logger.info(f'[{name}] No dex events, skip explain')
+        return True
+
+    start_block = max(end_block - block_batch_size + 1, 0)
+    projection = db.get_projection_statement(EVENT_FIELDS)
+    projection['_id'] = False
+    explain = explain_dex_events_in_block_range(db.dex_events_collection, start_block, end_block,
+                                                event_types=EVENT_TYPES, projection=projection)
+    stages = ' <- '.join(stage if not index else f'{stage}({index})'
+                         for stage, index in get_winning_plan_stages(explain))
+    if not is_index_used(explain, index_name):
+        logger.warning(f'[{name}] Block {start_block} - {end_block} does not use {index_name}: {stages}')
+        return False
+
+    logger.info(f'[{name}] Block {start_block} - {end_block} uses {index_name}: {stages}')
+    return True
@@ -0,0 +1,50 @@
+import click
+
+from src.constants.network_constants import Chains
+from src.databases.dex_nft_manager_db import NFTMongoDB
+from src.models.nft_change_logs import get_change_log_statements
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Migrate NFT Change Logs')
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-c', '--chain', default=None, show_default=True, type=str,
+              help='network name example bsc or polygon, all chains by default')
+@click.option('-b', '--batch-size', default=1000, show_default=True, type=int,
+              help='How many nfts are moved in a bulk write')
+@click.option('--keep-legacy', is_flag=True, default=False, show_default=True,
+              help='Do not unset feeChangeLogs and liquidityChangeLogs of dex_nft after they are moved')
+def migrate_nft_change_logs(chain, batch_size, keep_legacy):
+    """Move change logs embedded in dex_nft documents to the dex_nft_change_logs buckets."""
+    chain_id = None
+    if chain:
+        chain = str(chain).lower()
+        if chain not in Chains.mapping:
+            raise click.BadOptionUsage("--chain", f"Chain {chain} is not support")
+        chain_id = Chains.mapping[chain]
+
+    _db = NFTMongoDB()
+    _db.create_nft_change_logs_index()
+
+    number_of_nfts = 0
+    statements, nft_ids = [], []
+    for doc in _db.get_nfts_with_legacy_change_logs(chain_id=chain_id, batch_size=batch_size):
+        statements += get_change_log_statements(
+            doc['_id'], doc.get('chainId'), doc.get('feeChangeLogs'), doc.get('liquidityChangeLogs'))
+        nft_ids.append(doc['_id'])
+        if len(nft_ids) >= batch_size:
+            number_of_nfts += move_change_logs(_db, statements, nft_ids, keep_legacy)
+            statements, nft_ids = [], []
+    if nft_ids:
+        number_of_nfts += move_change_logs(_db, statements, nft_ids, keep_legacy)
+    logger.info(f'Moved change logs of {number_of_nfts} nfts')
+
+
+def move_change_logs(_db: NFTMongoDB, statements, nft_ids, keep_legacy):
+    # Buckets are written before the legacy maps are removed, an interrupted run can be started again
+    _db.update_nft_change_logs(statements)
+    if not keep_legacy:
+        _db.unset_legacy_change_logs(nft_ids)
+    logger.info(f'Moved {len(statements)} buckets of {len(nft_ids)} nfts')
+    return len(nft_ids)
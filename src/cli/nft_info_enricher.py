@@ -5,6 +5,7 @@ import click
 import requests
 from cli_scheduler.scheduler_job import scheduler_format
 
+from config import EthCallCacheConfig
 from src.constants.blockchain_etl_constants import DBPrefix
 from src.constants.network_constants import Chains, Networks
 from src.databases.dex_nft_manager_db import NFTMongoDB
@@ -19,12 +20,17 @@ logger = get_logger('NFT Info Enricher')
 # @click.option("-nc", "--n-cpu", default=1, show_default=True, type=int, help="Number of CPU")
 @click.option('-c', '--chain', default='ethereum', show_default=True, type=str, help='Network name example bsc or polygon')
 @click.option('--scheduler', default='^false@daily', show_default=True, type=str, help=f'Scheduler with format "{scheduler_format}"')
+@click.option('--max-in-flight', default=0, show_default=True, type=int,
+              help='Number of RPC batches sent concurrently by the asyncio client, 0 keeps the ClientQuerier '
+                   'which sends them on 8 worker threads')
+@click.option('--call-cache/--no-call-cache', default=True, show_default=True,
+              help='Keep eth_call results of past blocks in a SQLite file of ETH_CALL_CACHE_ROOT_PATH')
 
 # @click.option("-cpu", default=1, show_default=True, type=int, help="CPU order")
 # @click.option('-b', '--batch-size', default=1, show_default=True, type=int, help='NFT Batch size')
 # @click.option('--scheduler', default='^false@hourly', show_default=True, type=str, help=f'Scheduler with format "{scheduler_format}"')
 # @click.option("-w", "--max-workers", default=1, show_default=True, type=int, help="The number of workers")
-def dex_nft_info_enricher(chain, scheduler):
+def dex_nft_info_enricher(chain, scheduler, max_in_flight, call_cache):
     chain = str(chain).lower()
     if chain not in Chains.mapping:
         raise click.BadOptionUsage("--chain", f"Chain {chain} is not support. Try {list(Chains.mapping.keys())}")
@@ -38,11 +44,16 @@ def dex_nft_info_enricher(chain, scheduler):
 
     provider_uri = Networks.archive_node.get(Chains.names[chain_id])
 
+    call_cache_path = None
+    if call_cache:
+        call_cache_path = os.path.join(EthCallCacheConfig.ROOT_PATH, f'{chain}_eth_calls.sqlite')
+
     flagged_state = _db.get_nft_flagged_state(chain_id=chain_id)
     nfts_batch = flagged_state["batch_idx"]
 
     job = NFTInfoEnricherJob(
         _db=_db, _exporter=_exporter, nfts_batch=nfts_batch, scheduler=scheduler,
-        chain_id=chain_id, provider_uri=provider_uri, db_prefix=db_prefix)
+        chain_id=chain_id, provider_uri=provider_uri, db_prefix=db_prefix, max_in_flight=max_in_flight,
+        call_cache_path=call_cache_path)
 
     job.run()
@@ -0,0 +1,55 @@
+import click
+
+from src.constants.network_constants import Chains, Networks
+from src.services.blockchain.rpc_stand_in import RPCRecordings, RPCStandIn
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('RPC Stand In')
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-r', '--recordings', default='.data/rpc_recordings/recordings.jsonl', show_default=True, type=str,
+              help='JSON lines file of the recorded responses')
+@click.option('--record/--replay', default=False, show_default=True,
+              help='Forward requests missing from the recordings to the upstream node and record them')
+@click.option('-c', '--chain', default='bsc', show_default=True, type=str,
+              help='Record mode: network name whose archive node is the upstream, example bsc or polygon')
+@click.option('-u', '--upstream', default=None, show_default=True, type=str,
+              help='Record mode: upstream node URI, overrides the archive node of --chain')
+@click.option('--host', default='127.0.0.1', show_default=True, type=str, help='Listening host')
+@click.option('-p', '--port', default=8545, show_default=True, type=int, help='Listening port')
+@click.option('--latency', default=0.0, show_default=True, type=float, help='Seconds added to every request')
+@click.option('--jitter', default=0.0, show_default=True, type=float,
+              help='Up to this many random seconds added to every request')
+@click.option('--error-rate', default=0.0, show_default=True, type=float,
+              help='Share of requests failing with --error-status')
+@click.option('--error-status', default=503, show_default=True, type=int, help='HTTP status of injected errors')
+@click.option('--seed', default=None, show_default=True, type=int, help='Seed of the latency and error injection')
+def rpc_stand_in(recordings, record, chain, upstream, host, port, latency, jitter, error_rate, error_status, seed):
+    """Serve a local JSON-RPC node replaying recorded responses, to benchmark RPC heavy jobs offline.
+
+    Run a job once against the stand in with --record, pointing <CHAIN>_PROVIDER_ARCHIVE_URI at it, then run it
+    again with --replay, optionally with injected latency and errors.
+    """
+    if record and not upstream:
+        chain = str(chain).lower()
+        if chain not in Chains.mapping:
+            raise click.BadOptionUsage("--chain", f"Chain {chain} is not support")
+        upstream = Networks.archive_node.get(chain)
+        if not upstream:
+            raise click.BadOptionUsage("--upstream", f"Chain {chain} has no archive node, set --upstream")
+
+    stand_in = RPCStandIn(
+        RPCRecordings(recordings), upstream=upstream if record else None, latency=latency, jitter=jitter,
+        error_rate=error_rate, error_status=error_status, seed=seed
+    )
+    server = stand_in.serve(host, port)
+    mode = f'recording from {upstream}' if record else 'replaying'
+    logger.info(f'Serve JSON-RPC on http://{host}:{server.server_address[1]}, {mode} {recordings}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f'Stand in stats: {stand_in.stats}')
@@ -1,10 +1,18 @@
+import os
+
 import click
+from pymongo import MongoClient
 
 from src.constants.blockchain_etl_constants import DBPrefix
+from config import DexNFTManagerDBConfig
 from src.constants.network_constants import Chains
 from src.databases.dex_nft_manager_db import NFTMongoDB
+from src.databases.mongodb_dex import MongoDBDex
 from src.exporters.nft_mongodb_exporter import NFTMongoDBExporter
+from src.streaming.adaptive_window import AdaptiveBlockWindow
+from src.streaming.multi_chain_streamer import MultiChainStreamer
 from src.streaming.update_nft_adapter import UpdateNftInfoAdapter
+from src.utils import stream_metrics
 from src.streaming.streamer import Streamer
 from src.utils.logger_utils import get_logger
 
@@ -23,43 +31,117 @@ logger = get_logger('Synced Wallet Stream')
 @click.option('--pid-file', default=None, show_default=True, type=str, help='pid file')
 @click.option('-c', '--chain', default='bsc', show_default=True, type=str,
               help='network name example bsc or polygon')
+@click.option('--chains', default=None, show_default=True, type=str,
+              help='Comma separated network names, stream all of them in one process. Example bsc,ethereum,arbitrum')
+@click.option('--max-concurrent-chains', default=None, show_default=True, type=int,
+              help='Multi chain mode: number of chains synced at the same time, default all of them')
 @click.option('--stream-id', default=None, show_default=True, type=str, help='streamer id')
 @click.option('--collector-id', default="streaming_collector", show_default=True, type=str, help='collector id')
+@click.option('--pipeline/--no-pipeline', default=False, show_default=True,
+              help='Prefetch events of the next block window while the current one is enriched')
+@click.option('--adaptive/--no-adaptive', default=False, show_default=True,
+              help='Resize block batch size and batch size from the event density of recent cycles')
+@click.option('--target-cycle-seconds', default=60, show_default=True, type=int,
+              help='Adaptive mode: expected duration of a sync round')
+@click.option('--target-events-per-batch', default=200, show_default=True, type=int,
+              help='Adaptive mode: expected number of events handled by a worker')
+@click.option('--max-block-batch-size', default=2000, show_default=True, type=int,
+              help='Adaptive mode: upper bound of blocks in a sync round')
+@click.option('--partition-by-token/--no-partition-by-token', default=False, show_default=True,
+              help='Group events of a sync round by NFT so workers never share an NFT, '
+                   'batch size is then the number of NFTs in a worker')
+@click.option('--warmup-pairs/--no-warmup-pairs', default=True, show_default=True,
+              help='Load the pairs of NFTs with liquidity in one query before the first sync round')
+@click.option('--metrics-port', default=None, show_default=True, type=int,
+              help='Serve stage, throughput and lag metrics on this port, otherwise they are written to a textfile')
+@click.option('--hedge-after', default=None, show_default=True, type=float,
+              help='Send a batch reading the latest block to a fallback archive node when the archive node has not '
+                   'answered after this many seconds')
 def update_nft_info_stream(
         last_synced_block_file, lag, start_block, end_block, block_batch_size, batch_size, pid_file,
-        chain, collector_id="", stream_id=None
+        chain, chains=None, max_concurrent_chains=None, collector_id="", stream_id=None, pipeline=False,
+        adaptive=False, target_cycle_seconds=60, target_events_per_batch=200, max_block_batch_size=2000,
+        metrics_port=None, partition_by_token=False, warmup_pairs=True, hedge_after=None
 ):
     """Streaming load transactions to graph. """
 
-    chain = str(chain).lower()
-    if chain not in Chains.mapping:
-        raise click.BadOptionUsage("--chain", f"Chain {chain} is not support")
-    chain_id = Chains.mapping[chain]
-    db_prefix = DBPrefix.mapping.get(chain, '')
-    logger.info(f'Streaming with chain {chain} - prefix: {db_prefix}')
+    chain_names = [c.strip().lower() for c in str(chains or chain).split(',') if c.strip()]
+    for chain_name in chain_names:
+        if chain_name not in Chains.mapping:
+            raise click.BadOptionUsage("--chains" if chains else "--chain", f"Chain {chain_name} is not support")
+
+    def build_streamer(chain_name, chain_last_synced_block_file, chain_stream_id, client=None, dex_db=None):
+        chain_id = Chains.mapping[chain_name]
+        db_prefix = DBPrefix.mapping.get(chain_name, '')
+        logger.info(f'Streaming with chain {chain_name} - prefix: {db_prefix}')
+
+        _db = NFTMongoDB(db_prefix=db_prefix, client=client)
+        _exporter = NFTMongoDBExporter(_db)
+        logger.info(f'Connect to graph: {_db.connection_url}')
+
+        dp_collector_id = f"{db_prefix}-{collector_id}"
+        streamer_adapter = UpdateNftInfoAdapter(
+            exporter=_exporter,
+            importer=_db,
+            collector_id=dp_collector_id,
+            chain_id=chain_id,
+            batch_size=batch_size,
+            max_workers=8,
+            dex_db=dex_db,
+            partition_by_token=partition_by_token,
+            hedge_after=hedge_after
+        )
+        if warmup_pairs:
+            streamer_adapter.warmup_pair_cache()
+        adaptive_window = None
+        if adaptive:
+            adaptive_window = AdaptiveBlockWindow(
+                block_batch_size=block_batch_size,
+                batch_size=batch_size,
+                max_block_batch_size=max_block_batch_size,
+                target_cycle_seconds=target_cycle_seconds,
+                target_events_per_batch=target_events_per_batch
+            )
+        return Streamer(
+            blockchain_streamer_adapter=streamer_adapter,
+            exporter=_exporter,
+            last_synced_block_file=chain_last_synced_block_file,
+            lag=lag,
+            start_block=start_block,
+            end_block=end_block,
+            block_batch_size=block_batch_size,
+            pid_file=pid_file,
+            stream_id=chain_stream_id,
+            pipeline=pipeline,
+            adaptive_window=adaptive_window
+        )
+
+    if metrics_port:
+        stream_metrics.setup(port=metrics_port)
+    else:
+        stream_metrics.setup(textfile_name=f"metrics_update_nft_info_stream_{'_'.join(chain_names)}")
+
+    if not chains:
+        streamer = build_streamer(chain_names[0], last_synced_block_file, stream_id)
+        streamer.stream()
+        return
 
-    _db = NFTMongoDB(db_prefix=db_prefix)
-    _exporter = NFTMongoDBExporter(_db)
-    logger.info(f'Connect to graph: {_db.connection_url}')
+    if start_block is not None or end_block is not None:
+        raise click.BadOptionUsage("--chains", "--start-block and --end-block are not supported with several chains")
 
-    dp_collector_id = f"{db_prefix}-{collector_id}"
-    streamer_adapter = UpdateNftInfoAdapter(
-        exporter=_exporter,
-        importer=_db,
-        collector_id=dp_collector_id,
-        chain_id=chain_id,
-        batch_size=batch_size,
-        max_workers=8
-    )
-    streamer = Streamer(
-        blockchain_streamer_adapter=streamer_adapter,
-        exporter=_exporter,
-        last_synced_block_file=last_synced_block_file,
-        lag=lag,
-        start_block=start_block,
-        end_block=end_block,
-        block_batch_size=block_batch_size,
-        pid_file=pid_file,
-        stream_id=stream_id
-    )
+    # One Mongo connection pool for all chains, each chain keeps its own checkpoint file and loader
+    client = MongoClient(DexNFTManagerDBConfig.CONNECTION_URL)
+    dex_db = MongoDBDex()
+    directory, file_name = os.path.split(last_synced_block_file)
+    streamers = {
+        chain_name: build_streamer(
+            chain_name,
+            chain_last_synced_block_file=os.path.join(directory, f'{chain_name}_{file_name}'),
+            chain_stream_id=f'{stream_id}_{chain_name}' if stream_id else chain_name,
+            client=client,
+            dex_db=dex_db
+        )
+        for chain_name in chain_names
+    }
+    streamer = MultiChainStreamer(streamers, max_workers=max_concurrent_chains, pid_file=pid_file)
     streamer.stream()
@@ -18,10 +18,16 @@ class DexNFTManagerCollections:
         configs = 'configs'
         collectors = 'collectors'
         dex_nfts = 'dex_nft'
+        dex_nft_change_logs = 'dex_nft_change_logs'
         dex_events_etl = 'dex_events'
         pairs = "pairs"
 
 
+class DexNFTManagerIndexes:
+    dex_events_block_number_event_type = 'dex_events_block_number_event_type_index'
+    dex_nft_change_logs_nft_id_start_block = 'dex_nft_change_logs_nftId_startBlock_index'
+
+
 class MongoDBKeys:
     project_overview = 'project_overview'
 
@@ -250,6 +250,21 @@ class Networks:
         polkadot: os.getenv('POLKADOT_PROVIDER_ARCHIVE_URI')
     }
 
+    # Comma separated archive nodes used when the archive node is slow or failing
+    archive_node_fallbacks = {
+        bsc: os.getenv('BSC_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        ethereum: os.getenv('ETHEREUM_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        fantom: os.getenv('FANTOM_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        polygon: os.getenv('POLYGON_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        arbitrum: os.getenv('ARBITRUM_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        optimism: os.getenv('OPTIMISM_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        avalanche: os.getenv('AVALANCHE_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        tron: os.getenv('TRON_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        cronos: os.getenv('CRONOS_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        solana: os.getenv('SOLANA_PROVIDER_ARCHIVE_FALLBACK_URIS'),
+        polkadot: os.getenv('POLKADOT_PROVIDER_ARCHIVE_FALLBACK_URIS')
+    }
+
 
 class DefiLlama:
     chains = {
@@ -319,4 +334,30 @@ class MulticallContract:
         return cls.on_chains_v3.get(chain_id, cls.default_address)
 
 
+class PoolInitCode:
+    """Deployer and pool init code hash of Uniswap V3 like factories, pool addresses are derived with CREATE2.
+
+    Keys are the factory returned by the NFT position manager, PancakeSwap V3 pools are deployed by a separate
+    deployer contract. An entry is only used after a getPool call of the factory confirmed it.
+    """
+
+    factories = {
+        # Uniswap V3 on Ethereum
+        '0x1f98431c8ad98523631ae4a59f267346ea31f984': (
+            '0x1f98431c8ad98523631ae4a59f267346ea31f984',
+            '0xe34f199b19b2b4f47f68442619d555527d244f78a3297ea89325f843f87b8b54'
+        ),
+        # Uniswap V3 on BSC
+        '0xdb1d10011ad0ff90774d0c6bb92e5c5c8b4461f7': (
+            '0xdb1d10011ad0ff90774d0c6bb92e5c5c8b4461f7',
+            '0xe34f199b19b2b4f47f68442619d555527d244f78a3297ea89325f843f87b8b54'
+        ),
+        # PancakeSwap V3
+        '0x0bfbcf9fa4f9c56b0f40a671ad40e0805a091865': (
+            '0x41ff9aa7e16b8b1a8a8dc4f0efacd93d02d071c9',
+            '0x6ce8eb472fa82df5469c6ab6d485f17c3ad13c8cd7af59b3d4a8026c5ce0f7e2'
+        ),
+    }
+
+
 EMPTY_TOKEN_IMG = 'https://firebasestorage.googleapis.com/v0/b/token-c515a.appspot.com/o/tokens_v2%2Fempty-token.png?alt=media&token=2f9dfcc1-88a0-472c-a51f-4babc0c583f0'
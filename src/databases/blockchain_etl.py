@@ -6,6 +6,7 @@ from config import BlockchainETLConfig, TestBlockchainETLConfig
 from src.constants.blockchain_etl_constants import BlockchainETLCollections, BlockchainETLIndexes
 from src.constants.time_constants import TimeConstants
 from src.utils.logger_utils import get_logger
+from src.utils.query_plan_utils import get_dex_events_filter
 from src.utils.time_execute_decorator import sync_log_time_exe, TimeExeTag
 
 logger = get_logger('Blockchain ETL')
@@ -319,11 +320,10 @@ class BlockchainETL:
 
     @sync_log_time_exe(tag=TimeExeTag.database)
     def get_dex_events_in_block_range(self, start_block, end_block, event_types=None, projection=None):
-        filter_ = {
-            'block_number': {'$gte': start_block, '$lte': end_block}
-        }
-        if event_types is not None:
-            filter_["event_type"] = {"$in": event_types}
+        filter_ = get_dex_events_filter(start_block, end_block, event_types)
+        if isinstance(projection, list):
+            projection = self.get_projection_statement(projection)
+            projection['_id'] = False
 
         try:
             cursor = self.dex_events_collection.find(filter_, projection=projection)
@@ -1,13 +1,15 @@
 import sys
+import time
 from typing import List
 
 import pymongo
 from pymongo import MongoClient, UpdateOne
 
 from config import DexNFTManagerDBConfig
-from src.constants.mongo_constants import DexNFTManagerCollections
+from src.constants.mongo_constants import DexNFTManagerCollections, DexNFTManagerIndexes
 from src.utils.dict_utils import flatten_dict, delete_none
 from src.utils.logger_utils import get_logger
+from src.utils.query_plan_utils import get_dex_events_filter
 from src.utils.retry_handler import retry_handler
 from src.utils.time_execute_decorator import sync_log_time_exe, TimeExeTag
 
@@ -15,13 +17,15 @@ logger = get_logger('NFTMongoDB')
 
 
 class NFTMongoDB:
-    def __init__(self, connection_url=None, database=DexNFTManagerDBConfig.DATABASE, db_prefix=""):
+    def __init__(self, connection_url=None, database=DexNFTManagerDBConfig.DATABASE, db_prefix="",
+                 client: MongoClient = None):
         if not connection_url:
             connection_url = DexNFTManagerDBConfig.CONNECTION_URL
 
         self.connection_url = connection_url.split('@')[-1]
         try:
-            self.connection = MongoClient(connection_url)
+            # Streamers of several chains in one process share the same client and its connection pool
+            self.connection = client if client is not None else MongoClient(connection_url)
             self.mongo_db = self.connection[database]
         except Exception as e:
             logger.exception(f"Failed to connect to ArangoDB: {connection_url}: {e}")
@@ -29,6 +33,7 @@ class NFTMongoDB:
 
         self._wallets_col = self.mongo_db[DexNFTManagerCollections.wallets]
         self._nft_col = self.mongo_db[DexNFTManagerCollections.dex_nfts]
+        self._nft_change_logs_col = self.mongo_db[DexNFTManagerCollections.dex_nft_change_logs]
         self.collector_collection = self.mongo_db[DexNFTManagerCollections.collectors]
         self._configs_col = self.mongo_db[DexNFTManagerCollections.configs]
         self._pair_col = self.mongo_db[DexNFTManagerCollections.pairs]
@@ -37,6 +42,7 @@ class NFTMongoDB:
         else:
             dex_event_col = DexNFTManagerCollections.dex_events_etl
         self.dex_events_collection = self.mongo_db[dex_event_col]
+        self._supports_transactions = None
         # self._create_index()
 
     #######################
@@ -445,6 +451,92 @@ class NFTMongoDB:
             logger.exception(ex)
         return None
 
+    def supports_transactions(self):
+        """Transactions need a replica set or a sharded cluster"""
+        if self._supports_transactions is None:
+            hello = self.connection.admin.command('hello')
+            self._supports_transactions = bool(hello.get('setName')) or hello.get('msg') == 'isdbgrid'
+        return self._supports_transactions
+
+    def update_nft_statements(self, updates, session=None):
+        """Apply field level updates, every item has an _id and its update operators ($inc, $set, $max...)"""
+        bulk_operations = [
+            UpdateOne({"_id": item["_id"]}, {key: value for key, value in item.items() if key != "_id"}, upsert=True)
+            for item in updates
+        ]
+        if bulk_operations:
+            self._nft_col.bulk_write(bulk_operations, ordered=False, session=session)
+
+    def update_nft_change_logs(self, statements):
+        """Upsert change log buckets, every item has an _id and its update operators"""
+        bulk_operations = [
+            UpdateOne({"_id": item["_id"]}, {key: value for key, value in item.items() if key != "_id"}, upsert=True)
+            for item in statements
+        ]
+        if bulk_operations:
+            self._nft_change_logs_col.bulk_write(bulk_operations, ordered=False)
+
+    def get_nft_change_logs(self, nft_ids, from_block, to_block=None):
+        """Change logs of the NFTs between two blocks, only the buckets overlapping the window are read.
+
+        Return {nft id: {'fee': {block: {token: amount}}, 'liquidity': {block: liquidity}}}
+        """
+        filter_ = {'nftId': {'$in': list(nft_ids)}, 'endBlock': {'$gte': from_block}}
+        if to_block is not None:
+            filter_['startBlock'] = {'$lte': to_block}
+
+        change_logs = {}
+        for doc in self._nft_change_logs_col.find(filter_, projection={'nftId': True, 'fee': True, 'liquidity': True}):
+            logs = change_logs.setdefault(doc['nftId'], {'fee': {}, 'liquidity': {}})
+            for field in ['fee', 'liquidity']:
+                for block_number, value in doc.get(field, {}).items():
+                    block_number = int(block_number)
+                    if block_number >= from_block and (to_block is None or block_number <= to_block):
+                        logs[field][block_number] = value
+        return change_logs
+
+    def create_nft_change_logs_index(self):
+        index_name = DexNFTManagerIndexes.dex_nft_change_logs_nft_id_start_block
+        if index_name not in self._nft_change_logs_col.index_information():
+            self._nft_change_logs_col.create_index(
+                [('nftId', pymongo.ASCENDING), ('startBlock', pymongo.ASCENDING)], name=index_name, background=True)
+            return True
+        return False
+
+    def get_nfts_with_legacy_change_logs(self, chain_id=None, batch_size=1000):
+        filter_ = {'$or': [{'feeChangeLogs': {'$exists': True}}, {'liquidityChangeLogs': {'$exists': True}}]}
+        if chain_id:
+            filter_['chainId'] = chain_id
+        projection = {'chainId': True, 'feeChangeLogs': True, 'liquidityChangeLogs': True}
+        return self._nft_col.find(filter_, projection=projection, batch_size=batch_size)
+
+    def unset_legacy_change_logs(self, nft_ids):
+        self._nft_col.update_many(
+            {'_id': {'$in': list(nft_ids)}}, {'$unset': {'feeChangeLogs': '', 'liquidityChangeLogs': ''}})
+
+    def update_nfts_with_checkpoint(self, nfts, checkpoint, nft_updates=None):
+        """Write NFTs and the stream checkpoint config together.
+
+        They are committed in one transaction when the deployment supports it, otherwise the checkpoint is written
+        after the NFTs, NFTs carry their applied block so a replayed window does not change them twice.
+        """
+        def write(session=None):
+            if nfts:
+                self.update_docs(DexNFTManagerCollections.dex_nfts, data=nfts, session=session)
+            if nft_updates:
+                self.update_nft_statements(nft_updates, session=session)
+            self._configs_col.bulk_write(
+                [UpdateOne({"_id": checkpoint["_id"]}, {"$set": flatten_dict(checkpoint)}, upsert=True)],
+                session=session
+            )
+
+        if not self.supports_transactions():
+            write()
+            return
+
+        with self.connection.start_session() as session:
+            session.with_transaction(write)
+
     def update_config(self, config, merge=True):
         try:
             if merge:
@@ -500,6 +592,19 @@ class NFTMongoDB:
         except:
             return None
 
+    def get_active_pool_addresses(self, chain_id):
+        """Pools of the NFTs that still have liquidity, the most used pools first"""
+        pipeline = [
+            {'$match': {'chainId': chain_id, 'liquidity': {'$gt': 0}}},
+            {'$group': {'_id': '$poolAddress', 'numberOfNfts': {'$sum': 1}}},
+            {'$sort': {'numberOfNfts': pymongo.DESCENDING}}
+        ]
+        try:
+            return [doc['_id'] for doc in self._nft_col.aggregate(pipeline, allowDiskUse=True) if doc['_id']]
+        except Exception as ex:
+            logger.exception(ex)
+        return []
+
     def get_nfts_by_keys(self, keys):
         cursor = self._nft_col.find({"_id": {"$in": keys}})
         return cursor
@@ -590,7 +695,8 @@ class NFTMongoDB:
             filter=filter_statement, projection=projection_statement, batch_size=batch_size)
         return cursor
 
-    def update_docs(self, collection_name, data, keep_none=False, merge=True, shard_key=None, flatten=True):
+    def update_docs(self, collection_name, data, keep_none=False, merge=True, shard_key=None, flatten=True,
+                    session=None):
         """If merge is set to True => sub-dictionaries are merged instead of overwritten"""
         col = self.mongo_db[collection_name]
         # col.insert_many(data, overwrite=True, overwrite_mode='update', keep_none=keep_none, merge=merge)
@@ -600,7 +706,7 @@ class NFTMongoDB:
                 bulk_operations = [UpdateOne({"_id": item["_id"]}, {"$set": item}, upsert=True) for item in data]
             else:
                 bulk_operations = [UpdateOne({"_id": item["_id"], shard_key: item[shard_key]}, {"$set": item}, upsert=True) for item in data]
-            col.bulk_write(bulk_operations)
+            col.bulk_write(bulk_operations, session=session)
             return
 
         for document in data:
@@ -635,7 +741,7 @@ class NFTMongoDB:
                               {"$addToSet": {key: value for key, value in item.items() if key not in keys}},
                               upsert=True)
                     for item in add_to_set]
-        col.bulk_write(bulk_operations)
+        col.bulk_write(bulk_operations, session=session)
 
     def remove_out_date_docs(self, collection_name, timestamp, filter_: dict = None):  # change filter to dict
         filter_statement = {
@@ -734,7 +840,10 @@ class NFTMongoDB:
     def get_all_nfts(self, _filter):
         return self._nft_col.find(_filter).batch_size(10000)
 
-    def get_nft_info(self, nfts):
+    def get_nft_info(self, nfts, projection=None):
+        projection_statement = self.get_projection_statement(projection)
+        if projection_statement:
+            return self._nft_col.find({"_id": {"$in": nfts}}, projection=projection_statement).batch_size(1000)
         return self._nft_col.find({"_id": {"$in": nfts}}).batch_size(1000)
 
     def get_last_block_number(self, collector_id="streaming_collector"):
@@ -742,17 +851,38 @@ class NFTMongoDB:
         last_block_number = self.collector_collection.find_one({"_id": collector_id})
         return last_block_number["last_updated_at_block_number"]
 
+    def watch_last_block_number(self, collector_id, last_block_number, timeout):
+        """Wait on a change stream until the collector passes last_block_number or timeout.
+
+        Change streams need a replica set, a standalone server raises OperationFailure.
+        Return the last block number collected by collector.
+        """
+        pipeline = [{'$match': {
+            'documentKey._id': collector_id,
+            'operationType': {'$in': ['insert', 'update', 'replace']}
+        }}]
+        deadline = time.time() + timeout
+        with self.collector_collection.watch(pipeline, full_document='updateLookup', max_await_time_ms=1000) as stream:
+            # Read after the stream is opened so an update between both calls is not missed
+            current_block_number = self.get_last_block_number(collector_id)
+            while current_block_number <= last_block_number and time.time() < deadline and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    continue
+                collector = change.get('fullDocument') or {}
+                current_block_number = collector.get('last_updated_at_block_number', current_block_number)
+        return current_block_number
+
     #######################
     #       Events        #
     #######################
 
     @sync_log_time_exe(tag=TimeExeTag.database)
     def get_dex_events_in_block_range(self, start_block, end_block, event_types=None, projection=None):
-        filter_ = {
-            'block_number': {'$gte': start_block, '$lte': end_block}
-        }
-        if event_types is not None:
-            filter_["event_type"] = {"$in": event_types}
+        filter_ = get_dex_events_filter(start_block, end_block, event_types)
+        if isinstance(projection, list):
+            projection = self.get_projection_statement(projection)
+            projection['_id'] = False
 
         try:
             cursor = self.dex_events_collection.find(filter_, projection=projection)
@@ -798,6 +928,21 @@ class NFTMongoDB:
         for item in data:
             self._pair_col.replace_one({"_id": item["_id"]}, item, upsert=True)
 
+    def add_wallet_nfts(self, chain_id, wallet_nfts: dict):
+        """Link NFT ids to their wallets without reading them, {address: [nft id]}, ids already linked are kept once"""
+        bulk_operations = [
+            UpdateOne(
+                {"_id": f"{chain_id}_{address}"},
+                {
+                    "$addToSet": {"nfts": {"$each": list(nft_ids)}},
+                    "$setOnInsert": {"address": address, "chainId": chain_id}
+                },
+                upsert=True
+            )
+            for address, nft_ids in wallet_nfts.items()
+        ]
+        if bulk_operations:
+            self._wallets_col.bulk_write(bulk_operations, ordered=False)
 
     def replace_wallets(self, data):
         for item in data:
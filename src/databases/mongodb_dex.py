@@ -12,12 +12,12 @@ logger = get_logger('MongoDB DEX')
 
 
 class MongoDBDex:
-    def __init__(self, connection_url=None, database=MongoDBDexConfig.DATABASE):
+    def __init__(self, connection_url=None, database=MongoDBDexConfig.DATABASE, client: MongoClient = None):
         if not connection_url:
             connection_url = MongoDBDexConfig.CONNECTION_URL
 
         self.connection_url = connection_url.split('@')[-1]
-        self.client = MongoClient(connection_url)
+        self.client = client if client is not None else MongoClient(connection_url)
         self.db = self.client[database]
 
         self._dexes_col = self.db[MongoDBDexCollections.dexes]
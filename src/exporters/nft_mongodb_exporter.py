@@ -41,6 +41,10 @@ class NFTMongoDBExporter:
 
         self._db.replace_wallets(data=data)
 
+    def export_wallet_nfts(self, chain_id, wallet_nfts: dict):
+        """Add NFT ids to the nfts of their wallets, {address: [nft id]}"""
+        self._db.add_wallet_nfts(chain_id, wallet_nfts)
+
     def export_updated_wallets(self, data: List[dict]):
         """Update existed wallets. Mainly for flagging wallets as 'newElite' or 'elite'"""
         for wallet in data:
@@ -52,6 +56,25 @@ class NFTMongoDBExporter:
             nft['_id'] = f"{nft['chainId']}_{nft['nftManagerAddress']}_{nft['tokenId']}"
         self._db.update_docs(collection_name=DexNFTManagerCollections.dex_nfts, data=data)
 
+    def export_dex_nft_updates(self, updates: List[dict]):
+        """Export field level updates of existed NFTs, items are {'_id': ..., '$inc': ..., '$set': ...}"""
+        self._db.update_nft_statements(updates)
+
+    def export_nft_change_logs(self, statements: List[dict]):
+        """Export change log buckets of NFTs, see get_change_log_statements"""
+        self._db.update_nft_change_logs(statements)
+
+    def get_nft_change_logs(self, nft_ids, from_block, to_block=None):
+        return self._db.get_nft_change_logs(nft_ids, from_block, to_block=to_block)
+
+    def export_dex_nfts_with_loader(self, data: List[dict], loader: Loader, updates: List[dict] = None):
+        """Export NFTs and move the loader checkpoint in the same write"""
+        for nft in data:
+            nft['_id'] = f"{nft['chainId']}_{nft['nftManagerAddress']}_{nft['tokenId']}"
+        checkpoint = loader.to_dict()
+        checkpoint['_id'] = checkpoint['id']
+        self._db.update_nfts_with_checkpoint(nfts=data, checkpoint=checkpoint, nft_updates=updates)
+
     def export_pairs(self, data: List[dict]):
         self._db.replace_pairs(data=data)
 
@@ -84,8 +107,8 @@ class NFTMongoDBExporter:
             keys = [f'{chain_id}_{address}' for address in addresses]
         return self._db.get_wallets_by_keys(keys, projection=projection)
 
-    def get_nfts(self, nfts):
-        return self._db.get_nft_info(nfts)
+    def get_nfts(self, nfts, projection=None):
+        return self._db.get_nft_info(nfts, projection=projection)
 
     ######################
     #   Relationships    #
@@ -12,8 +12,11 @@ from src.constants.network_constants import MulticallContract
 from src.databases.blockchain_etl import BlockchainETL
 from src.databases.mongodb_dex import MongoDBDex
 from src.models.arbitrum_nfts import NFT
+from src.services.blockchain.batch_queries_service import call_key
+from src.services.blockchain.eth_call_cache import EthCallCache
 from src.services.blockchain.multicall import W3Multicall
 from src.services.blockchain.state_query_service import StateQueryService
+from src.services.pair_cache import get_pair_cache
 
 from src.utils.logger_utils import get_logger
 
@@ -23,14 +26,16 @@ logger = get_logger('NFT Info Enricher Job')
 class NFTInfoEnricherJob(SchedulerJob):
     def __init__(
             self, _db, _exporter, nfts_batch,
-            chain_id, provider_uri, db_prefix, scheduler=None):
+            chain_id, provider_uri, db_prefix, scheduler=None, max_in_flight=0, call_cache_path=None):
         self.dex_nft_db = _db
         self._exporter = _exporter
         self.db_prefix = db_prefix
         self.number_of_nfts_batch = nfts_batch
 
         self.chain_id = chain_id
-        self.state_querier = StateQueryService(provider_uri)
+        # Results at the before block are kept on disk so reruns do not query the archive node again
+        self.call_cache = EthCallCache(call_cache_path, chain_id) if call_cache_path else None
+        self.state_querier = StateQueryService(provider_uri, max_in_flight=max_in_flight, call_cache=self.call_cache)
         self._w3 = Web3(Web3.HTTPProvider(provider_uri))
 
         super().__init__(scheduler)
@@ -38,9 +43,12 @@ class NFTInfoEnricherJob(SchedulerJob):
     def _start(self):
         self.dex_db = MongoDBDex()
         self._etl_db = BlockchainETL(db_prefix=self.db_prefix)
-        self.pools = {}
+        # Shared with the other jobs of the process, pools of NFTs with liquidity are loaded at once
+        self.pools = get_pair_cache(self.chain_id, self.dex_db)
+        self.pools.warmup(self.dex_nft_db.get_active_pool_addresses(self.chain_id))
         self.pools_fee = {}
         self.cnt = 0
+        # Current state is read at this block for the whole run so every call sees the same chain state
         self.end_block = self._etl_db.get_last_block_number()
         current_day_timestamp = int(time.time())
         self.wrong_apr = []
@@ -80,15 +88,21 @@ class NFTInfoEnricherJob(SchedulerJob):
                 # new_batch_cursor = list(batch_cursor)
                 self.get_information_of_batch_cursor(batch_cursor)
                 logger.info(f'Time to execute of batch [{batch_idx}] is {time.time() - start_time} seconds')
+                if self.call_cache is not None:
+                    logger.info(f'[{batch_idx}] Eth call cache: {self.call_cache.get_stats()}')
             except Exception as e:
                 logger.exception(f"[{batch_idx}] has exception-{e}")
                 continue
 
     def get_information_of_batch_cursor(self, nfts):
-        current_data_response, before_data_response, pools_in_batch, new_nfts = self.prepare_enrich(nfts)
-        cursor = self.dex_db.get_pairs_with_addresses(chain_id=self.chain_id, addresses=list(pools_in_batch))
-        self.pools.update({doc['address']: doc for doc in cursor})
-        updated_nfts, deleted_tokens = self.enrich_data(new_nfts, current_data_response, before_data_response)
+        current_data_response, before_data_response, _, new_nfts = self.prepare_enrich(nfts)
+        # Pools of every NFT of the batch, NFTs without liquidity are enriched too
+        pools = self.pools.get_many(doc['poolAddress'] for doc in new_nfts)
+        # Only the fee logs of the APR window are read, not the whole history of the NFTs
+        nft_ids = [doc['_id'] for doc in new_nfts if '_id' in doc]
+        change_logs = self.dex_nft_db.get_nft_change_logs(nft_ids, from_block=self.before_timestamp)
+        updated_nfts, deleted_tokens = self.enrich_data(
+            new_nfts, current_data_response, before_data_response, pools, change_logs=change_logs)
         self._export(updated_nfts, deleted_tokens)
 
     def prepare_enrich(self, cursor_batch):
@@ -97,7 +111,7 @@ class NFTInfoEnricherJob(SchedulerJob):
         w3_multicall = W3Multicall(self._w3, address=MulticallContract.get_multicall_contract(self.chain_id))
 
         current_decoded_data, nfts, important_nfts, pools_in_batch = self.state_querier.get_batch_nft_fee_with_current_block(
-            nfts=cursor_batch, pools=self.pools_fee, w3_multicall=w3_multicall)
+            nfts=cursor_batch, pools=self.pools_fee, w3_multicall=w3_multicall, block_number=self.end_block)
 
         before_decoded_data = {}
         w3_multicall.calls = {}
@@ -110,21 +124,23 @@ class NFTInfoEnricherJob(SchedulerJob):
 
         return current_decoded_data, before_decoded_data, pools_in_batch, nfts
 
-    def enrich_data(self, batch_cursor, current_data_response, before_data_response):
+    def enrich_data(self, batch_cursor, current_data_response, before_data_response, pools, change_logs=None):
         deleted_tokens = []
         updated_nfts: Dict[str, NFT] = {}
         for doc in batch_cursor:
             try:
                 token_id = doc['tokenId']
-                positions = current_data_response.get(f'positions_{doc["nftManagerAddress"]}_{token_id}_latest'.lower())
+                positions = current_data_response.get(
+                    call_key('positions', doc['nftManagerAddress'], int(token_id), self.end_block))
                 if not positions:
                     deleted_tokens.append(doc["_id"])
                     continue
                 nft = NFT(id=token_id, chain=self.chain_id)
                 nft.from_dict(doc)
                 idx = doc['_id']
+                nft.fee_change_logs = (change_logs or {}).get(idx, {}).get('fee', {})
                 pool_address = nft.pool_address
-                pool_info = self.pools.get(pool_address)
+                pool_info = pools.get(pool_address)
                 nft_manager_contract = nft.nft_manager_address
 
                 if not pool_info or not pool_info.get('tick'):
@@ -134,13 +150,13 @@ class NFTInfoEnricherJob(SchedulerJob):
                 if int(doc['tokenId']) in self.tcv_token and doc["lastInteractAt"] > self.before_timestamp:
 
                     positions_before = before_data_response.get(
-                        f'positions_{nft_manager_contract}_{token_id}_{doc["lastInteractAt"]}'.lower())
+                        call_key('positions', nft_manager_contract, int(token_id), doc["lastInteractAt"]))
                 else:
                     positions_before = before_data_response.get(
-                        f'positions_{nft_manager_contract}_{token_id}_{self.before_timestamp}'.lower())
+                        call_key('positions', nft_manager_contract, int(token_id), self.before_timestamp))
 
                 if nft.liquidity > 0 and positions_before and abs(positions_before[7] - float(positions[7])) < 0.01:
-                    self.calculate_apr(nft, current_data_response, before_data_response)
+                    self.calculate_apr(nft, current_data_response, before_data_response, pools)
                 else:
                     nft.apr_in_month = 0
                 updated_nfts[idx] = nft
@@ -150,25 +166,27 @@ class NFTInfoEnricherJob(SchedulerJob):
 
         return updated_nfts, deleted_tokens
 
-    def calculate_apr(self, nft: NFT, current_data_response, before_data_response):
+    def calculate_apr(self, nft: NFT, current_data_response, before_data_response, pools):
         token_id = nft.token_id
         pool_address = nft.pool_address
         nft_manager_contract = nft.nft_manager_address
         tick_lower = nft.tick_lower
         tick_upper = nft.tick_upper
-        pool_info = self.pools.get(pool_address)
+        pool_info = pools.get(pool_address)
         if int(nft.token_id) in self.tcv_token and nft.last_interact_at > self.before_timestamp:
             before_block_number = nft.last_interact_at
         else:
             before_block_number = self.before_timestamp
         if not self.pools_fee.get(pool_address, {}):
-            fee_growth_global_0 = current_data_response.get(f'feeGrowthGlobal0X128_{pool_address}_latest'.lower())
-            fee_growth_global_1 = current_data_response.get(f'feeGrowthGlobal1X128_{pool_address}_latest'.lower())
+            fee_growth_global_0 = current_data_response.get(
+                call_key('feeGrowthGlobal0X128', pool_address, block_number=self.end_block))
+            fee_growth_global_1 = current_data_response.get(
+                call_key('feeGrowthGlobal1X128', pool_address, block_number=self.end_block))
             fee_growth_global_0_before = before_data_response.get(
-                f'feeGrowthGlobal0X128_{pool_address}_{before_block_number}'.lower())
+                call_key('feeGrowthGlobal0X128', pool_address, block_number=before_block_number))
             fee_growth_global_1_before = before_data_response.get(
-                f'feeGrowthGlobal1X128_{pool_address}_{before_block_number}'.lower())
-            slot0 = before_data_response.get(f'slot0_{pool_address}_{before_block_number}'.lower())
+                call_key('feeGrowthGlobal1X128', pool_address, block_number=before_block_number))
+            slot0 = before_data_response.get(call_key('slot0', pool_address, block_number=before_block_number))
 
             self.pools_fee[pool_address] = {
                 "feeGrowthGlobal0X128": fee_growth_global_0,
@@ -184,15 +202,16 @@ class NFTInfoEnricherJob(SchedulerJob):
         tick_before = self.pools_fee[pool_address]['tick']
 
         fee_growth_low_x128_before = before_data_response.get(
-            f'ticks_{pool_address}_{tick_lower}_{before_block_number}'.lower())
+            call_key('ticks', pool_address, tick_lower, before_block_number))
         fee_growth_hi_x128_before = before_data_response.get(
-            f'ticks_{pool_address}_{tick_upper}_{before_block_number}'.lower())
+            call_key('ticks', pool_address, tick_upper, before_block_number))
         positions_before = before_data_response.get(
-            f'positions_{nft_manager_contract}_{token_id}_{before_block_number}'.lower())
+            call_key('positions', nft_manager_contract, int(token_id), before_block_number))
 
-        positions = current_data_response.get(f'positions_{nft_manager_contract}_{token_id}_latest'.lower())
-        fee_growth_low_x128 = current_data_response.get(f'ticks_{pool_address}_{tick_lower}_latest'.lower())
-        fee_growth_hi_x128 = current_data_response.get(f'ticks_{pool_address}_{tick_upper}_latest'.lower())
+        positions = current_data_response.get(
+            call_key('positions', nft_manager_contract, int(token_id), self.end_block))
+        fee_growth_low_x128 = current_data_response.get(call_key('ticks', pool_address, tick_lower, self.end_block))
+        fee_growth_hi_x128 = current_data_response.get(call_key('ticks', pool_address, tick_upper, self.end_block))
 
         tick = pool_info['tick']
         tokens = pool_info['tokens']
@@ -0,0 +1,207 @@
+import time
+from multiprocessing import Pool
+from typing import Dict
+
+from src.constants.network_constants import Networks, Chains
+from src.databases.dex_nft_manager_db import NFTMongoDB
+from src.databases.mongodb_dex import MongoDBDex
+from src.exporters.nft_mongodb_exporter import NFTMongoDBExporter
+from src.jobs.update_nft_job import EVENT_TYPES, EVENT_FIELDS, NFT_STREAM_FIELDS, EventIndex, get_nft_key
+from src.models.nfts import NFT
+from src.services.blockchain.state_query_service import StateQueryService
+from src.services.pair_cache import get_pair_cache
+from src.utils.file_utils import write_last_synced_file
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Backfill NFT Job')
+
+_importer: NFTMongoDB = None
+
+
+def init_range_worker(db_prefix):
+    global _importer
+    _importer = NFTMongoDB(db_prefix=db_prefix)
+
+
+def collect_range_deltas(block_range):
+    """Compact the events of a block range into per NFT, per block deltas.
+
+    Return {nft key: {'tokenId', 'contractAddress', 'blocks': {block: {'liquidity', 'amounts'}}}}, amounts are the
+    raw collected fee of token0 and token1, or None when the NFT collected nothing in the block.
+    """
+    start_block, end_block, chain_id = block_range
+    events = list(_importer.get_dex_events_in_block_range(
+        start_block, end_block, event_types=EVENT_TYPES, projection=EVENT_FIELDS))
+    event_index = EventIndex(events, chain_id)
+
+    deltas = {}
+    for event in events:
+        key = get_nft_key(chain_id, event)
+        if key not in deltas:
+            deltas[key] = {'tokenId': event['tokenId'], 'contractAddress': event['contract_address'], 'blocks': {}}
+        block_delta = deltas[key]['blocks'].setdefault(event['block_number'], {'liquidity': 0, 'amounts': None})
+
+        event_type = event['event_type']
+        if event_type == 'INCREASELIQUIDITY':
+            block_delta['liquidity'] += float(event['liquidity'])
+        elif event_type == 'DECREASELIQUIDITY':
+            block_delta['liquidity'] -= float(event['liquidity'])
+        elif event_type == 'COLLECT':
+            # Collected amounts include the withdrawn liquidity of a decrease in the same transaction
+            decrease_event = event_index.get_transaction_event(event['transaction_hash'], 'DECREASELIQUIDITY')
+            amounts = block_delta['amounts'] or [0, 0]
+            for idx in range(2):
+                amount = float(event[f'amount{idx}'])
+                if decrease_event:
+                    amount -= float(decrease_event[f'amount{idx}'])
+                amounts[idx] += amount
+            block_delta['amounts'] = amounts
+
+    logger.info(f'Collect deltas of {len(deltas)} nfts in block {start_block} - {end_block}')
+    return deltas
+
+
+class BackfillNftJob:
+    """Rebuild NFTs of a block range in parallel then hand over the checkpoint to the stream.
+
+    Block ranges are compacted in a process pool, the deltas are merged in block order and every NFT is written
+    once with a single bulk upsert per batch of NFTs.
+    """
+
+    def __init__(self, importer: NFTMongoDB, exporter: NFTMongoDBExporter, chain_id, db_prefix,
+                 start_block, end_block, range_size=10000, max_processes=4, nft_batch_size=1000,
+                 stream_id=None, last_synced_block_file=None):
+        self.importer = importer
+        self.exporter = exporter
+        self.chain_id = chain_id
+        self.db_prefix = db_prefix
+        self.start_block = start_block
+        self.end_block = end_block
+        self.range_size = range_size
+        self.max_processes = max_processes
+        self.nft_batch_size = nft_batch_size
+        self.stream_id = stream_id
+        self.last_synced_block_file = last_synced_block_file
+
+        self.state_querier = StateQueryService(Networks.archive_node.get(Chains.names[self.chain_id]))
+        self.pair_cache = get_pair_cache(self.chain_id, MongoDBDex())
+
+    def run(self):
+        start_time = time.time()
+        deltas = self.collect_deltas()
+        logger.info(f'Collected deltas of {len(deltas)} nfts in {time.time() - start_time} seconds')
+
+        cursor = self.exporter.get_config(f"{self.chain_id}_factory_nft_contract")
+        factory_nft_contracts = cursor['addresses'] if cursor else {}
+
+        keys = list(deltas.keys())
+        for idx in range(0, len(keys), self.nft_batch_size):
+            batch = {key: deltas[key] for key in keys[idx:idx + self.nft_batch_size]}
+            self.merge_batch(batch, factory_nft_contracts)
+            logger.info(f'Merged {min(idx + self.nft_batch_size, len(keys))} / {len(keys)} nfts')
+
+        self.exporter.export_config({
+            "id": f"{self.chain_id}_factory_nft_contract",
+            "addresses": factory_nft_contracts,
+            "chainId": self.chain_id
+        })
+        self.hand_over()
+        logger.info(f'Backfill block {self.start_block} - {self.end_block} take {time.time() - start_time} seconds')
+
+    def collect_deltas(self):
+        block_ranges = [
+            (block, min(block + self.range_size - 1, self.end_block), self.chain_id)
+            for block in range(self.start_block, self.end_block + 1, self.range_size)
+        ]
+        deltas = {}
+        with Pool(self.max_processes, initializer=init_range_worker, initargs=(self.db_prefix,)) as pool:
+            # imap keeps the order of ranges so blocks of an NFT are merged in order
+            for range_deltas in pool.imap(collect_range_deltas, block_ranges):
+                for key, delta in range_deltas.items():
+                    if key not in deltas:
+                        deltas[key] = delta
+                    else:
+                        deltas[key]['blocks'].update(delta['blocks'])
+        return deltas
+
+    def merge_batch(self, deltas: Dict[str, dict], factory_nft_contracts):
+        nfts: Dict[str, NFT] = {}
+        for doc in self.exporter.get_nfts(list(deltas.keys()), projection=NFT_STREAM_FIELDS):
+            nfts[doc['_id']] = NFT(doc['tokenId'], chain=self.chain_id)
+            nfts[doc['_id']].from_dict(doc)
+
+        missing_nfts = [
+            {
+                'nft_key': key,
+                'token_id': delta['tokenId'],
+                'block_number': min(delta['blocks']),
+                'contract_address': delta['contractAddress']
+            }
+            for key, delta in deltas.items() if key not in nfts
+        ]
+        missing_nfts_info = {}
+        if missing_nfts:
+            # Positions at the end block already hold every delta of the range, none is applied on top of them
+            missing_nfts_info = self.state_querier.get_batch_nft_info_with_block_number(
+                missing_nfts, factory_nft_contracts=factory_nft_contracts, new_pools=set(),
+                block_number=self.end_block)
+
+        for key, delta in deltas.items():
+            query_info = missing_nfts_info.get(key)
+            if key in nfts or not query_info:
+                continue
+            nft = NFT(delta['tokenId'], chain=self.chain_id)
+            nft.liquidity = query_info.get('liquidity')
+            nft.tick_upper = query_info.get('tick_upper')
+            nft.tick_lower = query_info.get('tick_lower')
+            nft.last_called_at = self.end_block
+            nft.pool_address = query_info.get('pool_address')
+            nft.nft_manager_address = delta['contractAddress']
+            nft.wallet = query_info.get('wallet')
+            nfts[key] = nft
+
+        pools = self.pair_cache.get_many({nft.pool_address for nft in nfts.values()})
+
+        data, updates, change_logs = [], [], []
+        for key, nft in nfts.items():
+            self.apply_deltas(nft, deltas[key]['blocks'], pools.get(nft.pool_address))
+            change_logs += nft.get_change_log_statements(key)
+            statement = nft.get_update_statement()
+            if statement is None:
+                data.append({field: value for field, value in nft.to_dict().items() if field in NFT_STREAM_FIELDS})
+            else:
+                statement['_id'] = key
+                updates.append(statement)
+        if change_logs:
+            self.exporter.export_nft_change_logs(change_logs)
+        if data:
+            self.exporter.export_dex_nfts(data)
+        if updates:
+            self.exporter.export_dex_nft_updates(updates)
+
+    def apply_deltas(self, nft: NFT, blocks, pool_info):
+        tokens = pool_info.get('tokens') if pool_info else None
+        for block_number in sorted(blocks):
+            if block_number <= nft.last_applied_block:
+                continue
+            block_delta = blocks[block_number]
+            if block_delta['liquidity'] and block_number > nft.last_called_at:
+                nft.add_liquidity(block_delta['liquidity'])
+
+            if block_delta['amounts'] is not None and tokens:
+                for idx, token in enumerate(tokens):
+                    fee_amount = block_delta['amounts'][idx] / 10 ** token.get('decimals')
+                    nft.add_collected_fee(block_number, token.get('address'), fee_amount)
+            nft.last_interact_at = max(nft.last_interact_at, block_number)
+        nft.last_applied_block = max(nft.last_applied_block, self.end_block)
+
+    def hand_over(self):
+        """Move the stream checkpoint to the end block so the Streamer continues from there"""
+        loader = self.exporter.get_loader(self.stream_id)
+        if loader.start_extracting_block_number is None:
+            loader.start_extracting_block_number = self.start_block - 1
+        loader.last_updated_at_block_number = max(loader.last_updated_at_block_number or 0, self.end_block)
+        self.exporter.update_loader(loader)
+        if self.last_synced_block_file:
+            write_last_synced_file(self.last_synced_block_file, loader.last_updated_at_block_number)
+        logger.info(f'Stream {self.stream_id} takes over at block {loader.last_updated_at_block_number}')
@@ -9,6 +9,7 @@ from src.databases.mongodb_dex import MongoDBDex
 from src.models.nfts import NFT
 from src.services.blockchain.batch_queries_service import decode_data_response_ignore_error
 from src.services.blockchain.state_query_service import StateQueryService
+from src.services.pair_cache import get_pair_cache
 
 from src.utils.logger_utils import get_logger
 logger = get_logger('NFT Info Enricher Job')
@@ -43,7 +44,9 @@ class NFTInfoEnricherJob(BaseJob):
         self.dex_db = MongoDBDex()
         self._etl_db = BlockchainETL(db_prefix=self.db_prefix)
         self.deleted_tokens = []
-        self.pools = {}
+        # Shared with the other jobs of the process, pools of NFTs with liquidity are loaded at once
+        self.pools = get_pair_cache(self.chain_id, self.dex_db)
+        self.pools.warmup(self._klg_db.get_active_pool_addresses(self.chain_id))
         self.pools_fee = {}
         self.cnt = 0
         # self.invalid_pool = []
@@ -61,12 +64,13 @@ class NFTInfoEnricherJob(BaseJob):
                 start_time = time.time()
                 batch_cursor = self._klg_db.get_nfts_by_filter(_filter={"liquidity": {"$gt": 0}, "flagged": batch_idx})
                 batch_cursor = list(batch_cursor)
-                data_response, pools_in_batch = self.prepare_enrich(batch_cursor)
+                # Liquidity logs since the APR window start decide whether an NFT changed
+                change_logs = self._klg_db.get_nft_change_logs(
+                    [doc['_id'] for doc in batch_cursor], from_block=self.before_timestamp + 1)
+                data_response, pools_in_batch = self.prepare_enrich(batch_cursor, change_logs)
 
-                cursor = self.dex_db.get_pairs_with_addresses(chain_id=self.chain_id, addresses=list(pools_in_batch))
-
-                self.pools.update({doc['address']: doc for doc in cursor})
-                updated_nfts = self.enrich_data(batch_cursor, data_response)
+                pools = self.pools.get_many(pools_in_batch)
+                updated_nfts = self.enrich_data(batch_cursor, data_response, pools, change_logs)
                 self._export(updated_nfts)
 
                 logger.info(f'Time to execute of batch [{batch_idx}] is {time.time() - start_time} seconds')
@@ -74,7 +78,7 @@ class NFTInfoEnricherJob(BaseJob):
                 # logger.error(e)
                 raise e
 
-    def prepare_enrich(self, cursor_batch):
+    def prepare_enrich(self, cursor_batch, change_logs=None):
         list_rpc_call = []
         list_call_id = []
         pools_in_batch = []
@@ -86,7 +90,7 @@ class NFTInfoEnricherJob(BaseJob):
             pool_address = doc['poolAddress']
             pools_in_batch.append(pool_address)
 
-            liquidity_change_logs = doc.get('liquidityChangeLogs', {})
+            liquidity_change_logs = (change_logs or {}).get(doc['_id'], {}).get('liquidity', {})
             unchanged_nft = True
             blocks = []
             for block_number in liquidity_change_logs:
@@ -137,7 +141,7 @@ class NFTInfoEnricherJob(BaseJob):
         logger.info(f"Query process toke {time.time() - start_time}")
         return decoded_data, pools_in_batch
 
-    def enrich_data(self, batch_cursor, data_response) -> Dict[str, NFT]:
+    def enrich_data(self, batch_cursor, data_response, pools, change_logs=None) -> Dict[str, NFT]:
         updated_nfts: Dict[str, NFT] = {}
         for doc in batch_cursor:
             try:
@@ -146,13 +150,13 @@ class NFTInfoEnricherJob(BaseJob):
                 nft.from_dict(doc)
                 idx = doc['_id']
                 pool_address = nft.pool_address
-                pool_info = self.pools.get(pool_address)
+                pool_info = pools.get(pool_address)
                 if not pool_info or not pool_info.get('tick'):
                     #     self.invalid_pool.append(pool_address)
                     continue
 
                 unchanged_nft = True
-                liquidity_change_logs = nft.liquidity_change_logs
+                liquidity_change_logs = (change_logs or {}).get(idx, {}).get('liquidity', {})
                 blocks = []
                 for block_number in liquidity_change_logs:
                     blocks.append(int(block_number))
@@ -160,7 +164,7 @@ class NFTInfoEnricherJob(BaseJob):
                         unchanged_nft = False
 
                 if unchanged_nft:
-                    data = self.calculate_apr(doc, data_response, start_block=self.before_timestamp)
+                    data = self.calculate_apr(doc, data_response, pools, start_block=self.before_timestamp)
                     nft.apr_in_month = data.get('apr', 0)
 
                 # if blocks:
@@ -172,7 +176,7 @@ class NFTInfoEnricherJob(BaseJob):
                 continue
         return updated_nfts
 
-    def calculate_apr(self, doc, data_response, start_block):
+    def calculate_apr(self, doc, data_response, pools, start_block):
         token_id = doc['tokenId']
         nft = NFT(id=token_id, chain=self.chain_id)
         nft.from_dict(doc)
@@ -181,7 +185,7 @@ class NFTInfoEnricherJob(BaseJob):
         nft_manager_contract = nft.nft_manager_address
         tick_lower = nft.tick_lower
         tick_upper = nft.tick_upper
-        pool_info = self.pools.get(pool_address)
+        pool_info = pools.get(pool_address)
         if not self.pools_fee.get(pool_address, {}):
             fee_growth_global_0 = data_response.get(f'feeGrowthGlobal0X128_{pool_address}_{self.end_block}'.lower())
             fee_growth_global_1 = data_response.get(f'feeGrowthGlobal1X128_{pool_address}_{self.end_block}'.lower())
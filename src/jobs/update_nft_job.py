@@ -1,3 +1,4 @@
+import threading
 from typing import Dict
 
 from multithread_processing.base_job import BaseJob
@@ -5,33 +6,98 @@ from multithread_processing.base_job import BaseJob
 from src.constants.network_constants import Networks, Chains
 from src.databases.mongodb_dex import MongoDBDex
 from src.exporters.nft_mongodb_exporter import NFTMongoDBExporter
+from src.models.loader import Loader
 from src.models.nfts import NFT
-from src.models.wallet import Wallet
 from src.services.blockchain.state_query_service import StateQueryService
+from src.services.pair_cache import PairCache, get_pair_cache
 from src.utils.logger_utils import get_logger
+from src.utils.lru_cache import LRUCache
+from src.utils.stream_metrics import stage_timer
 
 logger = get_logger('Liquidity Pools Sync Job')
 
+EVENT_TYPES = ['INCREASELIQUIDITY', 'DECREASELIQUIDITY', 'COLLECT']
+
+# Fields of dex_events read by the aggregators, log_index only orders events of a block
+EVENT_FIELDS = [
+    'tokenId', 'contract_address', 'block_number', 'log_index', 'event_type', 'liquidity', 'amount0', 'amount1',
+    'transaction_hash'
+]
+
+# Fields of dex_nft owned by the stream, other fields are written by the enricher jobs and are left untouched
+NFT_STREAM_FIELDS = [
+    'tokenId', 'chainId', 'nftManagerAddress', 'poolAddress', 'wallet', 'liquidity', 'tickLower', 'tickUpper',
+    'collectedFee', 'lastCalledAt', 'lastInteractAt', 'lastAppliedBlock'
+]
+
+
+class EventIndex:
+    """Events of a batch indexed once by NFT and by (transaction hash, event type)"""
+    def __init__(self, events, chain_id):
+        self.events = events
+        # First event of every NFT, enough to locate the NFT and the block to query it at
+        self.by_nft = {}
+        self.by_transaction = {}
+        for event in events:
+            self.by_nft.setdefault(get_nft_key(chain_id, event), event)
+            self.by_transaction.setdefault((event['transaction_hash'], event['event_type']), event)
+
+    def get_transaction_event(self, transaction_hash, event_type):
+        return self.by_transaction.get((transaction_hash, event_type))
+
+
+def get_nft_key(chain_id, event):
+    return f"{chain_id}_{event['contract_address']}_{event['tokenId']}"
+
 
 class UpdateNftInfoJob(BaseJob):
+    """Apply liquidity and collect events of a block window on the NFTs.
+
+    By default workers get sub ranges of blocks and share the NFT state. With partition_by_token the events of the
+    window are read once and grouped by NFT, every worker owns the NFTs of its groups and applies their events in
+    block order, the state of all workers is merged before the single export.
+    """
     def __init__(
             self, start_block, end_block,
             batch_size=4, max_workers=8,
             importer=None, exporter: NFTMongoDBExporter = None,
-            chain_id=None, query_batch_size=100
+            chain_id=None, query_batch_size=100, state_querier: StateQueryService = None, prefetched=None,
+            dex_db: MongoDBDex = None, loader: Loader = None,
+            nft_cache: LRUCache = None, pair_cache: PairCache = None, factory_nft_contracts: dict = None,
+            partition_by_token=False
     ):
         self.chain_id = chain_id
 
         self.importer = importer
         self.exporter = exporter
 
-        self.state_querier = StateQueryService(Networks.archive_node.get(Chains.names[self.chain_id]))
+        if state_querier is None:
+            state_querier = StateQueryService(Networks.archive_node.get(Chains.names[self.chain_id]))
+        self.state_querier = state_querier
+        self.prefetched = prefetched
         self.query_batch_size = query_batch_size
 
         self.end_block = end_block
         self.start_block = start_block
-        self.dex_db = MongoDBDex()
-        self.updated_wallet: Dict[str, Wallet] = {}
+        self.dex_db = dex_db if dex_db is not None else MongoDBDex()
+        self.updated_wallet_nfts: Dict[str, set] = {}
+        self.number_of_events = 0
+        self.number_of_exported_nfts = 0
+        self._events_lock = threading.Lock()
+        self._nfts_lock = threading.Lock()
+        self._pools_lock = threading.Lock()
+
+        # Checkpoint committed together with the NFTs, only when every batch is done
+        self.loader = loader
+        self.completed = False
+
+        # Caches shared between cycles, the NFT cache is written through with what is exported
+        self.nft_cache = nft_cache
+        self.pair_cache = pair_cache if pair_cache is not None else get_pair_cache(self.chain_id, self.dex_db)
+        self.factory_nft_contracts = factory_nft_contracts
+
+        self.partition_by_token = partition_by_token
+        self.partitions = {}
 
         work_iterable = range(start_block, end_block + 1)
         super().__init__(work_iterable, batch_size, max_workers)
@@ -39,76 +105,179 @@ class UpdateNftInfoJob(BaseJob):
     def _start(self):
         self.updated_nfts: Dict[str, NFT] = {}
         self.updated_factory_nft = {}
-        cursor = self.exporter.get_config(f"{self.chain_id}_factory_nft_contract")
-        if cursor:
-            self.updated_factory_nft = cursor['addresses']
+        if self.factory_nft_contracts is not None:
+            self.updated_factory_nft = dict(self.factory_nft_contracts)
+        else:
+            cursor = self.exporter.get_config(f"{self.chain_id}_factory_nft_contract")
+            if cursor:
+                self.updated_factory_nft = cursor['addresses']
+        if self.prefetched is not None:
+            # Factories resolved by the prefetch are saved with the window so they are not queried again
+            for address, factory in self.prefetched.factory_nft_contracts.items():
+                if factory:
+                    self.updated_factory_nft.setdefault(address, factory)
         self.pools = {}
 
+        self.prefetched_events = {}
+        if self.prefetched is not None and not self.partition_by_token:
+            for event in self.prefetched.events:
+                self.prefetched_events.setdefault(event['block_number'], []).append(event)
+
+        if self.partition_by_token:
+            self._partition_events()
+
+    def _partition_events(self):
+        with stage_timer(self.chain_id, 'event_read'):
+            if self.prefetched is not None:
+                events = list(self.prefetched.events)
+            else:
+                events = list(self.importer.get_dex_events_in_block_range(
+                    self.start_block, self.end_block, event_types=EVENT_TYPES, projection=EVENT_FIELDS))
+        self.number_of_events = len(events)
+
+        # Stable sort, events of a block keep the order of the database
+        events.sort(key=lambda event: (event['block_number'], event.get('log_index', 0)))
+        for event in events:
+            self.partitions.setdefault(get_nft_key(self.chain_id, event), []).append(event)
+        self.work_iterable = list(self.partitions.keys())
+        logger.info(f'Partition {len(events)} events of block {self.start_block} - {self.end_block} '
+                    f'into {len(self.partitions)} nfts')
+
+    def _execute(self):
+        super()._execute()
+        self.completed = True
+
     def _end(self):
         self.batch_executor.shutdown()
 
-        self._export()
+        if self.loader is not None and not self.completed:
+            logger.warning(f'Block {self.start_block} - {self.end_block} is not completed. Skip exporting')
+            return
+        with stage_timer(self.chain_id, 'export'):
+            self._export()
 
     def _execute_batch(self, works):
+        if self.partition_by_token:
+            self._execute_partitions(works)
+            return
+
         start_block = works[0]
         end_block = works[-1]
 
-        events_cursor = self.importer.get_dex_events_in_block_range(start_block, end_block,
-                                                                    event_types=['INCREASELIQUIDITY',
-                                                                                 "DECREASELIQUIDITY", "COLLECT"])
-        events = list(events_cursor)
-        new_pools = set()
+        with stage_timer(self.chain_id, 'event_read'):
+            if self.prefetched is not None:
+                events = []
+                for block_number in works:
+                    events += self.prefetched_events.get(block_number, [])
+            else:
+                events_cursor = self.importer.get_dex_events_in_block_range(
+                    start_block, end_block, event_types=EVENT_TYPES, projection=EVENT_FIELDS)
+                events = list(events_cursor)
+        with self._events_lock:
+            self.number_of_events += len(events)
         if events:
-            token_keys = [f"{self.chain_id}_{event['contract_address']}_{event['tokenId']}" for event in events]
-            cursor = self.exporter.get_nfts(token_keys)
-            for nft in cursor:
-                token_id = nft['tokenId']
-                new_pools.add(nft.get('poolAddress'))
-                if token_id not in self.updated_nfts:
-                    self.updated_nfts[token_id] = NFT(token_id, chain=self.chain_id)
-                    self.updated_nfts[token_id].from_dict(nft)
+            self.process_events(events, self.updated_nfts)
+
+    def _execute_partitions(self, nft_keys):
+        # The worker owns these NFTs, their events are already in block order
+        events = []
+        for nft_key in nft_keys:
+            events += self.partitions[nft_key]
 
-            missing_nfts_info = self.collecting_missing_nft(events, new_pools)
+        nfts: Dict[str, NFT] = {}
+        self.process_events(events, nfts)
+        with self._nfts_lock:
+            self.updated_nfts.update(nfts)
 
+    def process_events(self, events, nfts: Dict[str, NFT]):
+        new_pools = set()
+        event_index = EventIndex(events, self.chain_id)
+        with stage_timer(self.chain_id, 'nft_read'):
+            for nft_key, doc in self.get_nfts(event_index, nfts).items():
+                if nft_key not in nfts:
+                    nfts[nft_key] = NFT(doc['tokenId'], chain=self.chain_id)
+                    nfts[nft_key].from_dict(doc)
+            # NFTs loaded by another batch of the window still need their pool in this batch
+            for nft_key in event_index.by_nft:
+                nft_info = nfts.get(nft_key)
+                if nft_info is not None and nft_info.pool_address:
+                    new_pools.add(nft_info.pool_address)
+
+        with stage_timer(self.chain_id, 'missing_nft_rpc'):
+            missing_nfts_info = self.collecting_missing_nft(event_index, new_pools, nfts)
+
+        with stage_timer(self.chain_id, 'pool_lookup'):
+            self.get_pools(new_pools)
+        with stage_timer(self.chain_id, 'aggregation'):
+            self.process_event(event_index, missing_nfts_info, nfts)
+
+    def get_nfts(self, event_index: EventIndex, nfts: Dict[str, NFT]):
+        """Return the stored NFTs of the batch that are not loaded yet, keyed by NFT key"""
+        nft_keys = [nft_key for nft_key in event_index.by_nft if nft_key not in nfts]
+        if self.nft_cache is None:
+            return {doc['_id']: doc for doc in self.exporter.get_nfts(nft_keys, projection=NFT_STREAM_FIELDS)}
+
+        cached_nfts = self.nft_cache.get_many(nft_keys)
+        missing_keys = [key for key in nft_keys if key not in cached_nfts]
+        if missing_keys:
+            stored_nfts = {
+                doc['_id']: doc for doc in self.exporter.get_nfts(missing_keys, projection=NFT_STREAM_FIELDS)}
+            self.nft_cache.put_many(stored_nfts)
+            cached_nfts.update(stored_nfts)
+        return cached_nfts
+
+    def get_pools(self, new_pools):
+        with self._pools_lock:
             pool_keys = [pool for pool in new_pools if pool not in self.pools]
-            cursor = self.dex_db.get_pairs_with_addresses(chain_id=self.chain_id, addresses=pool_keys)
-            self.pools.update({doc['address']: doc for doc in cursor})
-            self.process_event(events, missing_nfts_info)
+        if not pool_keys:
+            return
+        pools = self.pair_cache.get_many(pool_keys)
+        with self._pools_lock:
+            self.pools.update(pools)
 
-    def collecting_missing_nft(self, events, new_pools):
+    def collecting_missing_nft(self, event_index: EventIndex, new_pools, nfts: Dict[str, NFT]):
+        data = {}
         missing_nfts = []
-        for event in events:
-            token_id = event['tokenId']
-            contract_address = event['contract_address']
-            if token_id not in self.updated_nfts:
-                missing_nfts.append({
-                    'token_id': token_id,
-                    'block_number': event['block_number'],
-                    'contract_address': contract_address
-                })
+        for nft_key, event in event_index.by_nft.items():
+            if nft_key in nfts:
+                continue
+            # Missing NFTs of a prefetched window were already queried while the previous window was exported
+            prefetched_info = self.prefetched.missing_nfts_info.get(nft_key) if self.prefetched else None
+            if prefetched_info:
+                data[nft_key] = prefetched_info
+                new_pools.add(prefetched_info.get('pool_address'))
+                continue
+
+            missing_nfts.append({
+                'nft_key': nft_key,
+                'token_id': event['tokenId'],
+                'block_number': event['block_number'],
+                'contract_address': event['contract_address']
+            })
         if missing_nfts:
-            data = self.state_querier.get_batch_nft_info_with_block_number(
-                missing_nfts, factory_nft_contracts=self.updated_factory_nft, new_pools=new_pools)
-            return data
-        return {}
+            # Read at the end of the window so every NFT of a cycle sees the same chain state
+            queried_info = self.state_querier.get_batch_nft_info_with_block_number(
+                missing_nfts, factory_nft_contracts=self.updated_factory_nft, new_pools=new_pools,
+                block_number=self.end_block)
+            data.update(queried_info)
+            new_pools.update(info.get('pool_address') for info in queried_info.values() if info.get('pool_address'))
+        return data
 
-    def process_event(self, events, data):
-        for event in events:
+    def process_event(self, event_index: EventIndex, data, nfts: Dict[str, NFT]):
+        for event in event_index.events:
             if event['event_type'] == 'INCREASELIQUIDITY' or event['event_type'] == 'DECREASELIQUIDITY':
-                self.aggregate_change_liquidity_event(event, data)
+                self.aggregate_change_liquidity_event(event, data, nfts)
 
             if event['event_type'] == 'COLLECT':
-                self.aggregate_collect_event(event, events, data)
+                self.aggregate_collect_event(event, event_index, data, nfts)
 
-    def aggregate_change_liquidity_event(self, event, data):
+    def get_or_create_nft(self, event, data, nfts: Dict[str, NFT]):
+        nft_key = get_nft_key(self.chain_id, event)
         token_id = event['tokenId']
-        liquidity = float(event['liquidity'])
-        nft_info = self.updated_nfts.get(token_id)
-        block_number = event['block_number']
-        if nft_info is None and data and data.get(token_id):
-            query_info = data[token_id]
-            self.updated_nfts[token_id] = NFT(token_id, self.chain_id)
-            nft_info = self.updated_nfts.get(token_id)
+        nft_info = nfts.get(nft_key)
+        if nft_info is None and data and data.get(nft_key):
+            query_info = data[nft_key]
+            nft_info = NFT(token_id, self.chain_id)
             nft_info.liquidity = query_info.get('liquidity')
             nft_info.tick_upper = query_info.get('tick_upper')
             nft_info.tick_lower = query_info.get('tick_lower')
@@ -116,73 +285,48 @@ class UpdateNftInfoJob(BaseJob):
             nft_info.pool_address = query_info.get('pool_address')
             nft_info.nft_manager_address = event['contract_address']
             nft_info.wallet = query_info.get('wallet')
-            # nft_info.last_interact_at = query_info.get('last_called_at')
+            nfts[nft_key] = nft_info
+        return nft_info
 
-        if not nft_info:
+    def aggregate_change_liquidity_event(self, event, data, nfts: Dict[str, NFT]):
+        liquidity = float(event['liquidity'])
+        block_number = event['block_number']
+        nft_info = self.get_or_create_nft(event, data, nfts)
+
+        if not nft_info or block_number <= nft_info.last_applied_block:
             return
         if block_number > nft_info.last_called_at:
             if event['event_type'] == "INCREASELIQUIDITY":
-                nft_info.liquidity += liquidity
+                nft_info.add_liquidity(liquidity)
             if event['event_type'] == "DECREASELIQUIDITY":
-                nft_info.liquidity -= liquidity
+                nft_info.add_liquidity(-liquidity)
 
         # nft_info.liquidity_change_logs[str(block_number)] = nft_info.liquidity
         nft_info.last_interact_at = max(nft_info.last_interact_at, block_number)
 
-    def aggregate_collect_event(self, event, events, data):
-        token_id = event['tokenId']
-        nft_info = self.updated_nfts.get(token_id)
+    def aggregate_collect_event(self, event, event_index: EventIndex, data, nfts: Dict[str, NFT]):
         block_number = event['block_number']
-
-        if data and data.get(token_id) and not nft_info:
-            query_info = data[token_id]
-            self.updated_nfts[token_id] = NFT(token_id, self.chain_id)
-            pool_address = query_info.get('pool_address')
-            nft_info = self.updated_nfts.get(token_id)
-            nft_info.liquidity = query_info.get('liquidity')
-            nft_info.tick_upper = query_info.get('tick_upper')
-            nft_info.tick_lower = query_info.get('tick_lower')
-            nft_info.last_called_at = query_info.get('last_called_at')
-            nft_info.pool_address = pool_address
-            nft_info.nft_manager_address = event['contract_address']
-            nft_info.wallet = query_info.get('wallet')
-        if not nft_info:
+        nft_info = self.get_or_create_nft(event, data, nfts)
+        if not nft_info or block_number <= nft_info.last_applied_block:
             return
 
-        decrease_event = None
-        for e in events:
-            if e['transaction_hash'] == event['transaction_hash'] and e['event_type'] == 'DECREASELIQUIDITY':
-                decrease_event = e
-                break
+        decrease_event = event_index.get_transaction_event(event['transaction_hash'], 'DECREASELIQUIDITY')
 
         # nft_info.last_interact_at = block_number
         pool_info = self.pools.get(nft_info.pool_address)
         if pool_info and pool_info.get("tokens"):
             tokens = pool_info['tokens']
-            nft_info.fee_change_logs[str(block_number)] = {}
             for idx, token in enumerate(tokens):
                 address = token.get('address')
                 collect_amount = float(event[f'amount{idx}'])
                 fee_amount = collect_amount if not decrease_event else collect_amount - float(decrease_event[f'amount{idx}'])
                 decimals = token.get('decimals')
-                if address not in nft_info.collected_fee:
-                    nft_info.collected_fee[address] = 0
-                nft_info.collected_fee[address] += fee_amount / 10 ** decimals
-                nft_info.fee_change_logs[str(block_number)][address] = fee_amount / 10 ** decimals
+                nft_info.add_collected_fee(block_number, address, fee_amount / 10 ** decimals)
 
     def update_wallet_info(self):
-        addresses = [nft_info.wallet for _, nft_info in self.updated_nfts.items()]
-        cursor = self.exporter.get_wallets(addresses=addresses, chain_id=self.chain_id)
-        for doc in cursor:
-            address = doc['address']
-            self.updated_wallet[address] = Wallet(address, chain_id=self.chain_id)
-            self.updated_wallet[address].from_dict(doc)
-        for token_id, nft_info in self.updated_nfts.items():
-            address = nft_info.wallet
-            if address not in self.updated_wallet:
-                self.updated_wallet[address] = Wallet(address, chain_id=self.chain_id)
-            wallet = self.updated_wallet[address]
-            wallet.nfts.append(f"{self.chain_id}_{nft_info.nft_manager_address}_{token_id}")
+        for nft_key, nft_info in self.updated_nfts.items():
+            if nft_info.wallet:
+                self.updated_wallet_nfts.setdefault(nft_info.wallet, set()).add(nft_key)
 
     def _export(self):
         self.update_wallet_info()
@@ -192,13 +336,44 @@ class UpdateNftInfoJob(BaseJob):
             "chainId": self.chain_id
         }
         self.exporter.export_config(config)
-        # wallet_data = [w.to_dict() for _, w in self.updated_wallet.items()]
-        # if wallet_data:
-        #     self.exporter.export_wallets(wallet_data)
-        #     logger.info(f'Exported {len(wallet_data)} wallets')
+        # Wallet links and change logs are idempotent, written before the checkpoint so a replayed window writes
+        # the same values again
+        if self.updated_wallet_nfts:
+            self.exporter.export_wallet_nfts(self.chain_id, self.updated_wallet_nfts)
+            logger.info(f'Linked nfts of {len(self.updated_wallet_nfts)} wallets')
+        change_logs = []
+        for nft_key, nft in self.updated_nfts.items():
+            change_logs += nft.get_change_log_statements(nft_key)
+        if change_logs:
+            self.exporter.export_nft_change_logs(change_logs)
+            logger.info(f'Exported {len(change_logs)} change log buckets')
+
 
+        for nft in self.updated_nfts.values():
+            nft.last_applied_block = max(nft.last_applied_block, self.end_block)
+        # New NFTs are written whole, existed NFTs only with what changed
+        data, updates = [], []
+        for nft_key, nft in self.updated_nfts.items():
+            statement = nft.get_update_statement()
+            if statement is None:
+                data.append({key: value for key, value in nft.to_dict().items() if key in NFT_STREAM_FIELDS})
+            else:
+                statement['_id'] = nft_key
+                updates.append(statement)
+        self.number_of_exported_nfts = len(data) + len(updates)
+        if self.loader is not None:
+            self.exporter.export_dex_nfts_with_loader(data, self.loader, updates=updates)
+            logger.info(f'Exported {len(data)} new and {len(updates)} updated nfts with checkpoint '
+                        f'{self.loader.last_updated_at_block_number}')
+        else:
+            if data:
+                self.exporter.export_dex_nfts(data)
+            if updates:
+                self.exporter.export_dex_nft_updates(updates)
+            logger.info(f'Exported {len(data)} new and {len(updates)} updated nfts')
 
-        data = [p.to_dict() for pool_address, p in self.updated_nfts.items()]
-        if data:
-            self.exporter.export_dex_nfts(data)
-            logger.info(f'Exported {len(data)} nfts')
+        if self.nft_cache is not None:
+            self.nft_cache.put_many({
+                nft_key: {key: value for key, value in nft.to_dict().items() if key in NFT_STREAM_FIELDS}
+                for nft_key, nft in self.updated_nfts.items()
+            })
@@ -15,8 +15,10 @@ class NFT:
         self.uncollected_fee = {}
         self.last_interact_at = 0
         self.last_called_at = 0
+        # Change logs are stored by bucket in dex_nft_change_logs, here only the window loaded by the enricher
         self.liquidity_change_logs = {}
         self.fee_change_logs = {}
+        self.collected_fee_in_month = {}
         self.nft_manager_address = None
         self.apr_in_month = 0
         # self.apr = 0
@@ -40,8 +42,7 @@ class NFT:
             'tickUpper': self.tick_upper,
             'collectedFee': self.collected_fee,
             'lastCalledAt': self.last_called_at,
-            'liquidityChangeLogs': self.liquidity_change_logs,
-            'feeChangeLogs': self.fee_change_logs,
+            'collectedFeeInMonth': self.collected_fee_in_month,
             'nftManagerAddress': self.nft_manager_address,
             "uncollectedFee": self.uncollected_fee,
             "wallet": self.wallet,
@@ -63,8 +64,7 @@ class NFT:
         self.collected_fee = json_dict.get('collectedFee', {})
         self.uncollected_fee = json_dict.get('uncollectedFee', {})
         self.last_interact_at = json_dict.get('lastInteractAt', 0)
-        self.liquidity_change_logs = json_dict.get('liquidityChangeLogs', {})
-        self.fee_change_logs = json_dict.get('feeChangeLogs', {})
+        self.collected_fee_in_month = json_dict.get('collectedFeeInMonth', {})
         self.last_called_at = json_dict.get('lastCalledAt', 0)
         self.nft_manager_address = json_dict.get('nftManagerAddress', "")
         self.pool_address = json_dict.get('poolAddress', "")
@@ -86,8 +86,9 @@ class NFT:
             return True
         for block_number, amount in self.fee_change_logs.items():
             if int(block_number) >= start_block:
-                collected_amount0 += amount[token0_address]
-                collected_amount1 += amount[token1_address]
+                collected_amount0 += amount.get(token0_address, 0)
+                collected_amount1 += amount.get(token1_address, 0)
+        self.collected_fee_in_month = {token0_address: collected_amount0, token1_address: collected_amount1}
 
         token0_change = self.uncollected_fee[token0_address] - fee0_before + collected_amount0
         token1_change = self.uncollected_fee[token1_address] - fee1_before + collected_amount1
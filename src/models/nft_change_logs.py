@@ -0,0 +1,49 @@
+from src.constants.network_constants import Chains
+from src.constants.time_constants import TimeConstants
+
+# A bucket holds about a week of change logs of an NFT whatever the block time of the chain
+BUCKET_SECONDS = TimeConstants.DAYS_7
+DEFAULT_BUCKET_BLOCKS = 100000
+
+
+def get_bucket_blocks(chain_id):
+    block_time = Chains.block_time.get(chain_id)
+    if not block_time:
+        return DEFAULT_BUCKET_BLOCKS
+    return int(BUCKET_SECONDS / block_time)
+
+
+def get_bucket_start_block(chain_id, block_number):
+    bucket_blocks = get_bucket_blocks(chain_id)
+    return int(block_number) // bucket_blocks * bucket_blocks
+
+
+def get_change_log_statements(nft_id, chain_id, fee_change_logs: dict = None, liquidity_change_logs: dict = None):
+    """Bucket updates of the change logs of an NFT, every item has an _id and its update operators.
+
+    Logs are set at their block so writing the same logs twice leaves the bucket unchanged.
+    """
+    buckets = {}
+
+    def get_bucket(block_number):
+        start_block = get_bucket_start_block(chain_id, block_number)
+        if start_block not in buckets:
+            buckets[start_block] = {
+                '_id': f'{nft_id}_{start_block}',
+                '$set': {},
+                '$setOnInsert': {
+                    'nftId': nft_id,
+                    'chainId': chain_id,
+                    'startBlock': start_block,
+                    'endBlock': start_block + get_bucket_blocks(chain_id) - 1
+                }
+            }
+        return buckets[start_block]
+
+    for block_number, amounts in (fee_change_logs or {}).items():
+        bucket = get_bucket(block_number)
+        for token_address, amount in amounts.items():
+            bucket['$set'][f'fee.{block_number}.{token_address}'] = amount
+    for block_number, liquidity in (liquidity_change_logs or {}).items():
+        get_bucket(block_number)['$set'][f'liquidity.{block_number}'] = liquidity
+    return list(buckets.values())
@@ -2,6 +2,8 @@ import math
 
 from defi_services.utils.sqrt_price_math import get_token_amount_of_user
 
+from src.models.nft_change_logs import get_change_log_statements
+
 
 class NFT:
     def __init__(self, id="", chain=None) -> None:
@@ -15,8 +17,12 @@ class NFT:
         self.uncollected_fee = {}
         self.last_interact_at = 0
         self.last_called_at = 0
+        # Change logs are stored by bucket in dex_nft_change_logs, here only the logs added since the NFT was loaded
+        # or the window loaded by the enrichers
         self.liquidity_change_logs = {}
         self.fee_change_logs = {}
+        # Rolling aggregate of the collected fee per token over the APR window, written by the enrichers
+        self.collected_fee_in_month = {}
         self.nft_manager_address = None
         self.apr_in_month = 0
         # self.apr = 0
@@ -28,6 +34,12 @@ class NFT:
         self.ref_tokens = {}
         self.fee = 0
         self.invested_asset_in_usd = 0
+        # Last block whose events are already applied on liquidity and collected fee
+        self.last_applied_block = 0
+
+        # Increments since the NFT was loaded, exported as a field level update instead of the whole document
+        self.is_new = True
+        self._increments = {}
 
     def to_dict(self):
         return {
@@ -40,8 +52,7 @@ class NFT:
             'tickUpper': self.tick_upper,
             'collectedFee': self.collected_fee,
             'lastCalledAt': self.last_called_at,
-            'liquidityChangeLogs': self.liquidity_change_logs,
-            'feeChangeLogs': self.fee_change_logs,
+            'collectedFeeInMonth': self.collected_fee_in_month,
             'nftManagerAddress': self.nft_manager_address,
             "uncollectedFee": self.uncollected_fee,
             "wallet": self.wallet,
@@ -53,7 +64,8 @@ class NFT:
             'assetsInUSD': self.current_invest_in_usd,
             'investedAssetInUSD': self.invested_asset_in_usd,
             'refTokens': self.ref_tokens,
-            'feeEarn': self.fee
+            'feeEarn': self.fee,
+            'lastAppliedBlock': self.last_applied_block
         }
 
     def from_dict(self, json_dict):
@@ -63,14 +75,47 @@ class NFT:
         self.collected_fee = json_dict.get('collectedFee', {})
         self.uncollected_fee = json_dict.get('uncollectedFee', {})
         self.last_interact_at = json_dict.get('lastInteractAt', 0)
-        self.liquidity_change_logs = json_dict.get('liquidityChangeLogs', {})
-        self.fee_change_logs = json_dict.get('feeChangeLogs', {})
+        self.collected_fee_in_month = json_dict.get('collectedFeeInMonth', {})
         self.last_called_at = json_dict.get('lastCalledAt', 0)
         self.nft_manager_address = json_dict.get('nftManagerAddress', "")
         self.pool_address = json_dict.get('poolAddress', "")
         self.wallet = json_dict.get("wallet")
         self.last_updated_fee_at = json_dict.get('lastUpdatedFeeAt', 0)
+        self.last_applied_block = json_dict.get('lastAppliedBlock', 0)
+        self.is_new = False
+        self._increments = {}
+
+    def add_liquidity(self, amount):
+        self.liquidity += amount
+        self._increments['liquidity'] = self._increments.get('liquidity', 0) + amount
+
+    def add_collected_fee(self, block_number, token_address, amount):
+        self.collected_fee[token_address] = self.collected_fee.get(token_address, 0) + amount
+        key = f'collectedFee.{token_address}'
+        self._increments[key] = self._increments.get(key, 0) + amount
 
+        self.fee_change_logs.setdefault(block_number, {})[token_address] = amount
+
+    def get_change_log_statements(self, nft_id):
+        return get_change_log_statements(nft_id, self.chain, self.fee_change_logs, self.liquidity_change_logs)
+
+    def get_update_statement(self):
+        """Mongo update of the changes since the NFT was loaded, None for a new NFT that needs the whole document.
+
+        The stream only changes an existing NFT through add_liquidity, add_collected_fee ($inc) and its interaction
+        blocks ($max), its scalar fields are only set when the NFT is created from on-chain queries.
+        """
+        if self.is_new:
+            return None
+        statement = {
+            '$max': {
+                'lastInteractAt': self.last_interact_at,
+                'lastAppliedBlock': self.last_applied_block
+            }
+        }
+        if self._increments:
+            statement['$inc'] = dict(self._increments)
+        return statement
 
     def cal_apr_in_month(self, start_block, fee0_before, fee1_before, pool_info, tick_before, tick):
         token0_info = pool_info['tokens'][0]
@@ -87,8 +132,9 @@ class NFT:
             return True
         for block_number, amount in self.fee_change_logs.items():
             if int(block_number) >= start_block:
-                collected_amount0 += amount[token0_address]
-                collected_amount1 += amount[token1_address]
+                collected_amount0 += amount.get(token0_address, 0)
+                collected_amount1 += amount.get(token1_address, 0)
+        self.collected_fee_in_month = {token0_address: collected_amount0, token1_address: collected_amount1}
 
         token0_change = self.uncollected_fee[token0_address] - fee0_before + collected_amount0
         token1_change = self.uncollected_fee[token1_address] - fee1_before + collected_amount1
@@ -0,0 +1,156 @@
+import threading
+
+from query_state_lib.base.utils.decoder import decode_eth_call_data
+
+from src.services.blockchain.abi_encoder import get_fn_abi
+
+_function_decoders = {}
+_function_decoders_lock = threading.Lock()
+
+
+def _decode_uint256(word):
+    return int.from_bytes(word, 'big')
+
+
+def _uint_decoder(bits):
+    if bits == 256:
+        return _decode_uint256
+
+    def decode(word):
+        value = int.from_bytes(word, 'big')
+        if value >> bits:
+            raise ValueError(f'Value out of uint{bits} bounds')
+        return value
+
+    return decode
+
+
+def _int_decoder(bits):
+    lower, upper = -(1 << (bits - 1)), 1 << (bits - 1)
+
+    def decode(word):
+        value = int.from_bytes(word, 'big', signed=True)
+        if not lower <= value < upper:
+            raise ValueError(f'Value out of int{bits} bounds')
+        return value
+
+    return decode
+
+
+def _bytes_decoder(size):
+    def decode(word):
+        if any(word[size:]):
+            raise ValueError(f'Padding of bytes{size} is not empty')
+        return bytes(word[:size])
+
+    return decode
+
+
+def _decode_address(word):
+    if any(word[:12]):
+        raise ValueError('Padding of address is not empty')
+    return '0x' + word[12:].hex()
+
+
+def _decode_bool(word):
+    value = int.from_bytes(word, 'big')
+    if value > 1:
+        raise ValueError('Boolean must be either 0 or 1')
+    return value == 1
+
+
+def _decode_results(output: bytes):
+    """(bool success, bytes returnData)[] of Multicall3 read from its head offsets"""
+    from_bytes = int.from_bytes
+    size = len(output)
+    if size < 64:
+        raise ValueError('Output is shorter than its offsets')
+    array_start = from_bytes(output[:32], 'big')
+    base = array_start + 32
+    length = from_bytes(output[array_start:base], 'big')
+    if base + 32 * length > size:
+        raise ValueError('Output is shorter than its offsets')
+
+    results = []
+    for head in range(base, base + 32 * length, 32):
+        element = base + from_bytes(output[head:head + 32], 'big')
+        if element + 64 > size:
+            raise ValueError('Output is shorter than its offsets')
+        success = from_bytes(output[element:element + 32], 'big')
+        data_start = element + from_bytes(output[element + 32:element + 64], 'big') + 32
+        if success > 1 or data_start > size:
+            raise ValueError('Output is not a list of (bool, bytes)')
+        data_end = data_start + from_bytes(output[data_start - 32:data_start], 'big')
+        if data_end > size:
+            raise ValueError('Output is shorter than its offsets')
+        results.append((success == 1, output[data_start:data_end]))
+    return (tuple(results),)
+
+
+def _is_results_output(outputs):
+    if len(outputs) != 1 or outputs[0].get('type') != 'tuple[]':
+        return False
+    return [component.get('type') for component in outputs[0].get('components', [])] == ['bool', 'bytes']
+
+
+def get_word_decoder(abi_type):
+    """Decoder of a value held in a single 32 bytes word, None for dynamic and tuple types"""
+    if abi_type == 'address':
+        return _decode_address
+    if abi_type == 'bool':
+        return _decode_bool
+    if abi_type.startswith('uint') and (abi_type[4:].isdigit() or abi_type == 'uint'):
+        return _uint_decoder(int(abi_type[4:] or 256))
+    if abi_type.startswith('int') and (abi_type[3:].isdigit() or abi_type == 'int'):
+        return _int_decoder(int(abi_type[3:] or 256))
+    if abi_type.startswith('bytes') and abi_type[5:].isdigit():
+        return _bytes_decoder(int(abi_type[5:]))
+    return None
+
+
+class FunctionDecoder:
+    """Output decoder of an ABI function, built once and reused for every call.
+
+    Outputs made only of static word types, like positions, ticks, slot0 or feeGrowthGlobal, are read word by word
+    from the returned bytes, as are the (bool, bytes)[] results of a multicall. Other outputs, and values the fast
+    path rejects, go through decode_eth_call_data so errors are the same as before.
+    """
+
+    def __init__(self, fn_abi):
+        self.fn_abi = fn_abi
+        self.fn_name = fn_abi['name']
+        outputs = fn_abi.get('outputs', [])
+        word_decoders = [get_word_decoder(output['type']) for output in outputs]
+        self.word_decoders = None
+        if all(word_decoders):
+            self.word_decoders = [(32 * idx, decode_word) for idx, decode_word in enumerate(word_decoders)]
+        self.is_results = _is_results_output(outputs)
+
+    def decode(self, output: bytes) -> tuple:
+        word_decoders = self.word_decoders
+        try:
+            if word_decoders is not None and len(output) >= 32 * len(word_decoders):
+                # Copying a 32 bytes word is cheaper than a memoryview slice
+                return tuple([decode_word(output[idx:idx + 32]) for idx, decode_word in word_decoders])
+            if self.is_results:
+                return _decode_results(output)
+        except ValueError:
+            pass
+        return decode_eth_call_data([self.fn_abi], self.fn_name, '0x' + output.hex())
+
+    def decode_hex(self, result: str) -> tuple:
+        return self.decode(bytes.fromhex(result[2:] if result.startswith('0x') else result))
+
+
+def get_function_decoder(abi, fn_name) -> FunctionDecoder:
+    """Return the decoder of fn_name, ABIs are module constants so they are keyed by identity"""
+    key = (id(abi), fn_name)
+    item = _function_decoders.get(key)
+    if item is None:
+        fn_abi = get_fn_abi(abi, fn_name)
+        if fn_abi is None:
+            raise ValueError(f'Function {fn_name} is not in the ABI')
+        with _function_decoders_lock:
+            # The ABI is kept with its decoder so its id is never reused by another list
+            item = _function_decoders.setdefault(key, (abi, FunctionDecoder(fn_abi)))
+    return item[1]
@@ -0,0 +1,64 @@
+import threading
+from functools import lru_cache
+
+from eth_abi.abi import default_codec
+from eth_utils import function_abi_to_4byte_selector, get_abi_input_types
+from web3 import Web3
+
+_function_encoders = {}
+_function_encoders_lock = threading.Lock()
+
+
+@lru_cache(maxsize=100000)
+def to_checksum_address(address):
+    return Web3.to_checksum_address(address)
+
+
+def get_fn_abi(abi, fn_name):
+    for abi_ in abi:
+        if abi_.get('type') == 'function' and abi_.get('name') == fn_name:
+            return abi_
+
+    return None
+
+
+class FunctionEncoder:
+    """Selector and argument encoder of an ABI function, built once and reused for every call"""
+
+    def __init__(self, fn_abi):
+        self.fn_abi = fn_abi
+        self.fn_name = fn_abi['name']
+        self.selector = function_abi_to_4byte_selector(fn_abi)
+        self.input_types = get_abi_input_types(fn_abi)
+        self._encode_args = default_codec._registry.get_tuple_encoder(*self.input_types)
+
+    def encode(self, args=()) -> bytes:
+        return self.selector + self._encode_args(args)
+
+    def encode_hex(self, args=()) -> str:
+        return '0x' + self.encode(args).hex()
+
+
+def get_function_encoder(abi, fn_name) -> FunctionEncoder:
+    """Return the encoder of fn_name, ABIs are module constants so they are keyed by identity"""
+    key = (id(abi), fn_name)
+    item = _function_encoders.get(key)
+    if item is None:
+        fn_abi = get_fn_abi(abi, fn_name)
+        if fn_abi is None:
+            raise ValueError(f'Function {fn_name} is not in the ABI')
+        with _function_encoders_lock:
+            # The ABI is kept with its encoder so its id is never reused by another list
+            item = _function_encoders.setdefault(key, (abi, FunctionEncoder(fn_abi)))
+    return item[1]
+
+
+def get_call_args(fn_paras):
+    """Arguments of a call from the fn_paras of add_rpc_call, a single address is checksummed"""
+    if fn_paras is None:
+        return []
+    if type(fn_paras) is list:
+        return fn_paras
+    if isinstance(fn_paras, str) and Web3.is_address(fn_paras):
+        return [to_checksum_address(fn_paras)]
+    return [fn_paras]
@@ -0,0 +1,132 @@
+import asyncio
+import atexit
+import threading
+from typing import List
+
+import aiohttp
+from query_state_lib.base.mappers.eth_json_rpc_mapper import EthJsonRpc
+from query_state_lib.client.client_querier import check_response, generate_json_rpc_from_type
+
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Async RPC Client')
+
+RETRY_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AsyncRPCClient:
+    """JSON-RPC client sending batches concurrently over keep-alive connections.
+
+    At most max_in_flight requests are on the wire at once. The event loop and its session live in a daemon thread,
+    so sent_batch_to_provider can be called from any worker thread and keeps the interface of ClientQuerier.
+    """
+
+    def __init__(self, provider_uri, max_in_flight=8, timeout=120, max_retries=3, sleep_time_retries=1):
+        self.provider_url = provider_uri
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.sleep_time_retries = sleep_time_retries
+        self.recent_err = []
+
+        self._loop = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def sent_batch_to_provider(self, list_json_rpc: List[EthJsonRpc], batch_size=2000, **kwargs):
+        """Send the calls in batches of batch_size and return {request id: call with its result set}"""
+        if not list_json_rpc:
+            return {}
+
+        dict_eth_json_rpc = {}
+        type_dict_list = {}
+        for json_rpc in list_json_rpc:
+            type_dict_list.setdefault(json_rpc.type, []).append(json_rpc)
+            dict_eth_json_rpc[json_rpc.id] = json_rpc
+        request = []
+        for _type, json_rpcs in type_dict_list.items():
+            request += generate_json_rpc_from_type(_type, json_rpcs)
+
+        response = self.run(self.send_batches(request, batch_size=batch_size))
+        check_response(response)
+
+        self.recent_err = []
+        for response_item in response:
+            json_rpc = dict_eth_json_rpc[response_item.get('id')]
+            result = response_item.get('result')
+            json_rpc.set_result(result)
+            if not result:
+                json_rpc.error = response_item.get('error')
+                self.recent_err.append(json_rpc)
+        return dict_eth_json_rpc
+
+    def run(self, coro):
+        """Run a coroutine on the loop of the client and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    async def send_batches(self, request: List[dict], batch_size=2000):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def send(batch):
+            async with semaphore:
+                return await self.post(batch)
+
+        batches = [request[idx:idx + batch_size] for idx in range(0, len(request), batch_size)]
+        responses = await asyncio.gather(*[send(batch) for batch in batches])
+
+        response = []
+        for batch_response in responses:
+            if isinstance(batch_response, dict):
+                # The whole batch is rejected with a single error object
+                raise Exception(f"Response data err {batch_response.get('error')}")
+            response += batch_response
+        return response
+
+    async def post(self, payload):
+        return await self.post_to(self.provider_url, payload)
+
+    async def post_to(self, provider_url, payload):
+        session = await self._get_session()
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with session.post(provider_url, json=payload) as response:
+                    if response.status in RETRY_STATUSES:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status,
+                            message=f'Provider responded {response.status}')
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            except RETRY_EXCEPTIONS as ex:
+                if isinstance(ex, aiohttp.ClientResponseError) and ex.status not in RETRY_STATUSES:
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f'Retry request to {provider_url} after {type(ex).__name__}: {ex}')
+                await asyncio.sleep(self.sleep_time_retries * 2 ** attempt)
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result()
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='async-rpc-client', daemon=True).start()
+                atexit.register(self.close)
+            return self._loop
+
+    async def _get_session(self):
+        # Only called on the loop thread
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.max_in_flight, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
@@ -1,25 +1,114 @@
+from typing import Any, Dict, Tuple
+
 from query_state_lib.base.mappers.eth_call_mapper import EthCall
-from query_state_lib.base.utils.encoder import encode_eth_call_data
-from web3 import Web3, contract
 
+from src.services.blockchain.abi_decoder import get_function_decoder
+from src.services.blockchain.abi_encoder import get_function_encoder, get_call_args, to_checksum_address
 from src.utils.logger_utils import get_logger
 
 logger = get_logger('Batch queries')
-w3 = Web3()
 
+# (fn_name, lower case contract address, arguments, block number)
+CallKey = Tuple[str, str, tuple, Any]
+
+
+def _normalize_call_arg(value):
+    if isinstance(value, str):
+        return value.lower()
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize_call_arg(item) for item in value)
+    return value
+
+
+def call_key(fn_name, contract_address, fn_paras=None, block_number='latest') -> CallKey:
+    """Structured id of a call, addresses and other string arguments are compared case insensitively"""
+    if fn_paras is None:
+        args = ()
+    elif isinstance(fn_paras, (list, tuple)):
+        args = _normalize_call_arg(fn_paras)
+    else:
+        args = (_normalize_call_arg(fn_paras),)
+    return fn_name, contract_address.lower(), args, _normalize_call_arg(block_number or 'latest')
+
+
+def _decode_result(eth_call: EthCall):
+    """EthCall.decode_result through the decoder of its function"""
+    if not eth_call.decoded:
+        eth_call.result = get_function_decoder(eth_call.abi, eth_call.fn_name).decode_hex(eth_call.result)
+        eth_call.decoded = True
+    return eth_call.result
+
+
+def _decode_response(response_data, ignore_error=True):
+    try:
+        decoded_data = _decode_result(response_data)
+    except OverflowError:
+        if not ignore_error:
+            raise
+        result = response_data.result
+        if result.startswith('0x'):
+            result = result[2:]
+        bytes32 = bytearray.fromhex(result).hex().rstrip("0")
+        if len(bytes32) % 2 != 0:
+            bytes32 = bytes32 + '0'
+        decoded_data = bytes.fromhex(bytes32).decode('utf8')
+
+    if len(decoded_data) == 1:
+        return decoded_data[0]
+    return decoded_data
+
+
+class CallPlan:
+    """eth_call batch deduplicated by call_key.
+
+    Calls get integer request ids in the order they are added and decode returns the results keyed by call_key, so
+    neither building nor reading a batch formats string ids.
+    """
+
+    def __init__(self):
+        self.calls: Dict[CallKey, EthCall] = {}
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __contains__(self, key):
+        return key in self.calls
+
+    def add(self, abi, fn_name, contract_address, block_number='latest', fn_paras=None, key: CallKey = None) -> CallKey:
+        """Add the call unless it is already planned and return its key"""
+        if key is None:
+            key = call_key(fn_name, contract_address, fn_paras, block_number)
+        if key in self.calls:
+            return key
+
+        data_call = get_function_encoder(abi, fn_name).encode_hex(get_call_args(fn_paras))
+        self.calls[key] = EthCall(to=to_checksum_address(contract_address), block_number=block_number or 'latest',
+                                  data=data_call, abi=abi, fn_name=fn_name, id=len(self.calls))
+        return key
+
+    def get_rpc_calls(self):
+        return list(self.calls.values())
+
+    def decode(self, data_responses, ignore_error=True) -> Dict[CallKey, Any]:
+        """Decode responses of the planned calls, failed calls are skipped unless ignore_error is False"""
+        decoded_datas = {}
+        for key, eth_call in self.calls.items():
+            response_data = data_responses.get(eth_call.id)
+            if ignore_error and (response_data is None or not response_data.result):
+                continue
+            try:
+                decoded_datas[key] = _decode_response(response_data, ignore_error=ignore_error)
+            except Exception as e:
+                logger.error(f"An exception when decode data from provider: {e}")
+                if not ignore_error:
+                    raise
+        return decoded_datas
 
 
 def add_rpc_call(abi, fn_name, contract_address, block_number=None, fn_paras=None, list_rpc_call=None,
                  list_call_id=None, call_id=None):
-    args = []
+    """Add a call with a string id to list_rpc_call, CallPlan is preferred for new batches"""
     if fn_paras is not None:
-        if type(fn_paras) is list:
-            args = fn_paras
-        else:
-            if Web3.is_address(fn_paras):
-                fn_paras = Web3.to_checksum_address(fn_paras)
-            args = [fn_paras]
-
         if call_id is None:
             call_id = f"{fn_name}_{contract_address}_{fn_paras}_{block_number}".lower()
     else:
@@ -29,23 +118,18 @@ def add_rpc_call(abi, fn_name, contract_address, block_number=None, fn_paras=Non
     if call_id in list_call_id:
         return
 
-    c = contract.Contract
-    c.w3 = w3
-    c.abi = abi
-    data_call = c.encodeABI(fn_name=fn_name, args=args)
-
+    data_call = get_function_encoder(abi, fn_name).encode_hex(get_call_args(fn_paras))
     if block_number:
-        eth_call = EthCall(to=Web3.to_checksum_address(contract_address), block_number=block_number, data=data_call,
+        eth_call = EthCall(to=to_checksum_address(contract_address), block_number=block_number, data=data_call,
                            abi=abi, fn_name=fn_name, id=call_id)
     else:
-        eth_call = EthCall(to=Web3.to_checksum_address(contract_address), data=data_call,
+        eth_call = EthCall(to=to_checksum_address(contract_address), data=data_call,
                            abi=abi, fn_name=fn_name, id=call_id)
 
     list_rpc_call.append(eth_call)
     list_call_id.append(call_id)
 
 
-
 def decode_data_response(data_responses, list_call_id):
     decoded_datas = {}
     for call_id in list_call_id:
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import List
+
+from query_state_lib.base.mappers.eth_json_rpc_mapper import EthJsonRpc
+
+from config import EthCallCacheConfig
+from src.utils import stream_metrics
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Eth Call Cache')
+
+
+def get_block_number(block_number):
+    """Block of a call as an int, None for tags like 'latest' whose result changes"""
+    if isinstance(block_number, int):
+        return block_number
+    if isinstance(block_number, str) and block_number.startswith('0x'):
+        return int(block_number, 16)
+    return None
+
+
+class EthCallCache:
+    """SQLite cache of eth_call results pinned to a block number.
+
+    A result at a given block never changes, so it is kept until the cache holds more than max_entries results
+    and the oldest blocks are dropped. Keys are the hash of (chain, to, block, calldata).
+    """
+
+    def __init__(self, path, chain_id, max_entries=EthCallCacheConfig.MAX_ENTRIES):
+        self.path = path
+        self.chain_id = chain_id
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS eth_calls '
+            '(key BLOB PRIMARY KEY, chain_id INTEGER, block_number INTEGER, result BLOB) WITHOUT ROWID')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS eth_calls_block_number ON eth_calls (block_number)')
+        self._size = self._connection.execute('SELECT COUNT(*) FROM eth_calls').fetchone()[0]
+
+    def __len__(self):
+        return self._size
+
+    def get_key(self, json_rpc: EthJsonRpc):
+        """Key of an eth_call at a block number, None if the call can not be cached"""
+        if json_rpc.type != 'eth_call':
+            return None
+        block_number = get_block_number(json_rpc.block_number)
+        if block_number is None:
+            return None
+        data = json_rpc.data if isinstance(json_rpc.data, str) else '0x' + bytes(json_rpc.data).hex()
+        content = f'{self.chain_id}:{json_rpc.to.lower()}:{block_number}:{data.lower()}'
+        return hashlib.sha256(content.encode()).digest(), block_number
+
+    def get_many(self, keys):
+        """Return a dict of the cached results of the keys, missing keys are left out"""
+        keys = list(keys)
+        result = {}
+        with self._lock:
+            # Stay under the SQLite limit of bound parameters
+            for idx in range(0, len(keys), 500):
+                hashes = {key[0]: key for key in keys[idx:idx + 500]}
+                rows = self._connection.execute(
+                    f"SELECT key, result FROM eth_calls WHERE key IN ({','.join('?' * len(hashes))})",
+                    list(hashes)
+                )
+                for key_hash, value in rows:
+                    result[hashes[key_hash]] = '0x' + value.hex()
+            self.hits += len(result)
+            self.misses += len(keys) - len(result)
+        stream_metrics.observe_eth_call_cache(self.chain_id, hits=len(result), misses=len(keys) - len(result))
+        return result
+
+    def put_many(self, items: dict):
+        """Store {key: hex result}"""
+        rows = [
+            (key_hash, self.chain_id, block_number, bytes.fromhex(value[2:]))
+            for (key_hash, block_number), value in items.items()
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._connection.execute('BEGIN')
+            inserted = 0
+            for row in rows:
+                inserted += self._connection.execute(
+                    'INSERT OR IGNORE INTO eth_calls (key, chain_id, block_number, result) VALUES (?, ?, ?, ?)', row
+                ).rowcount
+            self._connection.execute('COMMIT')
+            self._size += inserted
+            if self._size > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        # Drop a tenth more than needed so the next inserts do not evict again
+        number_of_rows = self._size - int(self.max_entries * 0.9)
+        self._connection.execute(
+            'DELETE FROM eth_calls WHERE key IN (SELECT key FROM eth_calls ORDER BY block_number LIMIT ?)',
+            (number_of_rows,)
+        )
+        self._size = self._connection.execute('SELECT COUNT(*) FROM eth_calls').fetchone()[0]
+        logger.info(f'Evicted {number_of_rows} results of the oldest blocks from {self.path}')
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': self._size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class CachedClientQuerier:
+    """Client querier answering eth_calls at a block number from an EthCallCache.
+
+    Only the calls missing from the cache are sent by the wrapped ClientQuerier or AsyncRPCClient, calls on
+    'latest' always are.
+    """
+
+    def __init__(self, client_querier, cache: EthCallCache):
+        self.client_querier = client_querier
+        self.cache = cache
+        self.recent_err = []
+
+    def __getattr__(self, item):
+        # switch_provider, get_stats and provider_url of the wrapped client
+        return getattr(self.client_querier, item)
+
+    def sent_batch_to_provider(self, list_json_rpc: List[EthJsonRpc], batch_size=2000, **kwargs):
+        keys = {}
+        for json_rpc in list_json_rpc:
+            key = self.cache.get_key(json_rpc)
+            if key is not None:
+                keys[json_rpc.id] = key
+        cached = self.cache.get_many(set(keys.values())) if keys else {}
+
+        dict_eth_json_rpc = {}
+        missing_json_rpcs = []
+        for json_rpc in list_json_rpc:
+            result = cached.get(keys.get(json_rpc.id))
+            if result is None:
+                missing_json_rpcs.append(json_rpc)
+                continue
+            json_rpc.set_result(result)
+            dict_eth_json_rpc[json_rpc.id] = json_rpc
+
+        self.recent_err = []
+        if missing_json_rpcs:
+            responses = self.client_querier.sent_batch_to_provider(missing_json_rpcs, batch_size=batch_size, **kwargs)
+            self.recent_err = self.client_querier.recent_err
+            # Reverted or failed calls are asked again next time
+            self.cache.put_many({
+                keys[request_id]: json_rpc.result for request_id, json_rpc in responses.items()
+                if request_id in keys and isinstance(json_rpc.result, str) and not json_rpc.error
+            })
+            dict_eth_json_rpc.update(responses)
+        return dict_eth_json_rpc
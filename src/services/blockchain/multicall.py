@@ -1,31 +1,22 @@
 import csv
 import json
+import threading
 import time
 from collections import defaultdict
 from typing import Tuple, List, Union, Any, Optional, Dict
 
 from defi_services.abis.dex.pancakeswap.pancakeswap_lp_token_abi import LP_TOKEN_ABI
 from query_state_lib.base.utils.decoder import decode_eth_call_data
-from web3 import Web3, contract
 
 from artifacts.abis.multicall_v3_abi import MULTICALL_V3_ABI
-from src.services.blockchain.batch_queries_service import add_rpc_call, decode_data_response_ignore_error, \
-    decode_data_response
+from src.services.blockchain.abi_decoder import get_function_decoder
+from src.services.blockchain.abi_encoder import get_function_encoder, get_call_args, to_checksum_address
+from src.services.blockchain.batch_queries_service import CallPlan, CallKey, call_key
 from src.utils.dict_utils import all_equal
 from src.utils.logger_utils import get_logger
 
 logger = get_logger('Multicall V2')
 
-w3 = Web3()
-
-
-def get_fn_abi(abi, fn_name):
-    for abi_ in abi:
-        if abi_.get('type') == 'function' and abi_.get('name') == fn_name:
-            return abi_
-
-    return None
-
 
 def _unpack_aggregate_outputs(outputs: Any) -> Tuple[Tuple[Union[None, bool], bytes], ...]:
     return tuple((success, output) for success, output in outputs)
@@ -39,32 +30,17 @@ class W3Multicall:
     class Call:
 
         def __init__(self, address, abi, fn_name, fn_paras=None, block_number: Union[int, str] = 'latest'):
-            if fn_paras is not None:
-                self.id = f"{fn_name}_{address}_{fn_paras}_{block_number}".lower()
-            else:
-                self.id = f"{fn_name}_{address}_{block_number}".lower()
-
-            self.address = Web3.to_checksum_address(address)
+            self.key = call_key(fn_name, address, fn_paras, block_number)
+            self.address = to_checksum_address(address)
             self.fn_name = fn_name
-            self.fn_abi = get_fn_abi(abi=abi, fn_name=fn_name)
             self.block_number = block_number
 
-            args = []
-            if fn_paras is not None:
-                if type(fn_paras) is list:
-                    args = fn_paras
-                else:
-                    if Web3.is_address(fn_paras):
-                        fn_paras = Web3.to_checksum_address(fn_paras)
-                    args = [fn_paras]
-
-            c = contract.Contract
-            c.w3 = w3
-            c.abi = abi
+            encoder = get_function_encoder(abi, fn_name)
+            self.fn_abi = encoder.fn_abi
+            self.data = encoder.encode(get_call_args(fn_paras))
+            self.decoder = get_function_decoder(abi, fn_name)
 
-            self.data = c.encodeABI(fn_name=fn_name, args=args)
-
-    def __init__(self, web3, address='0xcA11bde05977b3631167028862bE2a173976CA11', calls: Dict[str, 'W3Multicall.Call'] = None, require_success: bool = False):
+    def __init__(self, web3, address='0xcA11bde05977b3631167028862bE2a173976CA11', calls: Dict[CallKey, 'W3Multicall.Call'] = None, require_success: bool = False):
         """
         :param web3: Web3 instance
         :param address: (optional) address of the multicall3.sol contract
@@ -72,32 +48,31 @@ class W3Multicall:
         """
         self.web3 = web3
         self.address = address
-        self.calls: Dict[str, 'W3Multicall.Call'] = {} if calls is None else calls.copy()
+        self.calls: Dict[CallKey, 'W3Multicall.Call'] = {} if calls is None else calls.copy()
 
         self.require_success = require_success
 
     def add(self, call: 'W3Multicall.Call'):
-        self.calls[call.id] = call
+        self.calls[call.key] = call
 
-    def get_params(self, calls: Optional[Dict[str, Call]] = None) -> List[Union[bool, List[List[Any]]]]:
+    def get_params(self, calls: Optional[Dict[CallKey, Call]] = None) -> List[Union[bool, List[List[Any]]]]:
         args = self._get_args(calls=calls)
         return args
 
-    def decode(self, aggregated, calls: Optional[Dict[str, Call]] = None, ignore_error=True):
+    def decode(self, aggregated, calls: Optional[Dict[CallKey, Call]] = None, ignore_error=True):
         if calls is None:
             calls = self.calls
 
         unpacked = _unpack_aggregate_outputs(aggregated)
 
         outputs = {}
-        for (call_id, call), (success, output) in zip(calls.items(), unpacked):
+        for (key, call), (success, output) in zip(calls.items(), unpacked):
             if not success:
-                logger.warning(f'Fail to query {call_id}')
+                logger.warning(f'Fail to query {key}')
                 continue
 
             try:
-                call_output = '0x' + output.hex()
-                decoded_data = decode_eth_call_data([call.fn_abi], call.fn_name, call_output)
+                decoded_data = call.decoder.decode(output)
             except OverflowError:
                 bytes_array = bytearray.fromhex(output.hex())
                 bytes32 = '0x' + bytes_array.hex().rstrip("0")
@@ -114,11 +89,11 @@ class W3Multicall:
             if len(decoded_data) == 1:
                 decoded_data = decoded_data[0]
 
-            outputs[call_id] = decoded_data
+            outputs[key] = decoded_data
 
         return outputs
 
-    def _get_args(self, calls: Optional[Dict[str, Call]] = None) -> List[Union[bool, List[List[Any]]]]:
+    def _get_args(self, calls: Optional[Dict[CallKey, Call]] = None) -> List[Union[bool, List[List[Any]]]]:
         if calls is None:
             calls = self.calls
 
@@ -130,15 +105,15 @@ class W3Multicall:
 
     def batch_calls_iterator(self, batch_size=2000):
         calls_by_block_number = defaultdict(lambda: {})
-        for call_id, call in self.calls.items():
+        for key, call in self.calls.items():
             block_number = call.block_number
-            calls_by_block_number[block_number][call_id] = call
+            calls_by_block_number[block_number][key] = call
 
         for block_number, calls in calls_by_block_number.items():
             batch = {}
 
-            for call_id, call in calls.items():
-                batch[call_id] = call
+            for key, call in calls.items():
+                batch[key] = call
                 if len(batch) >= batch_size:
                     yield block_number, batch
                     batch = {}
@@ -147,33 +122,138 @@ class W3Multicall:
                 yield block_number, batch
 
 
-def add_rpc_multicall(w3_multicall: W3Multicall, list_rpc_call=None, list_call_id=None, batch_size=2000):
-    batch_idx = 0
-    for block_number, batch_calls in w3_multicall.batch_calls_iterator(batch_size=batch_size):
+def get_multicall_key(w3_multicall: W3Multicall, batch_idx, block_number) -> CallKey:
+    return call_key('tryAggregate', w3_multicall.address, batch_idx, block_number)
+
+
+class MulticallBatchSizes:
+    """Largest tryAggregate batch size that succeeded, per provider and called functions.
+
+    The size drops to the largest batch that went through when a batch fails, and grows back by a quarter after
+    each query without failure until it reaches the requested batch size again.
+    """
+
+    def __init__(self):
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, batch_size):
+        with self._lock:
+            return min(batch_size, self._sizes.get(key, batch_size))
+
+    def update(self, key, batch_size, largest_success, failed):
+        with self._lock:
+            size = self._sizes.get(key, batch_size)
+            if failed:
+                if largest_success and largest_success < batch_size:
+                    self._sizes[key] = largest_success
+                    logger.info(f'Limit multicall batches of {key} to {largest_success} calls')
+            elif key in self._sizes and largest_success >= size:
+                size = size + max(size // 4, 1)
+                if size >= batch_size:
+                    self._sizes.pop(key)
+                else:
+                    self._sizes[key] = size
+
+
+multicall_batch_sizes = MulticallBatchSizes()
+
+
+def add_rpc_multicall(w3_multicall: W3Multicall, call_plan: CallPlan, batch_size=2000, batches=None):
+    if batches is None:
+        batches = w3_multicall.batch_calls_iterator(batch_size=batch_size)
+    for batch_idx, (block_number, batch_calls) in enumerate(batches):
         inputs = w3_multicall.get_params(calls=batch_calls)
-        add_rpc_call(
+        call_plan.add(
             fn_name="tryAggregate", fn_paras=inputs, block_number=block_number,
             abi=MULTICALL_V3_ABI, contract_address=w3_multicall.address,
-            list_call_id=list_call_id, list_rpc_call=list_rpc_call, call_id=f'{batch_idx}_{block_number}'
+            key=get_multicall_key(w3_multicall, batch_idx, block_number)
         )
-        batch_idx += 1
 
 
-def decode_multical_response(w3_multicall: W3Multicall, data_responses, list_call_id, ignore_error=True, batch_size=2000):
-    if ignore_error:
-        decoded_data = decode_data_response_ignore_error(data_responses=data_responses, list_call_id=list_call_id)
-    else:
-        decoded_data = decode_data_response(data_responses=data_responses, list_call_id=list_call_id)
+def decode_multical_response(w3_multicall: W3Multicall, data_responses, call_plan: CallPlan, ignore_error=True,
+                             batch_size=2000, batches=None):
+    if batches is None:
+        batches = w3_multicall.batch_calls_iterator(batch_size=batch_size)
+    results, failed_batches = _decode_multicall_batches(
+        w3_multicall, call_plan.decode(data_responses=data_responses, ignore_error=ignore_error), batches,
+        ignore_error=ignore_error
+    )
+    for batch_idx, block_number, _ in failed_batches:
+        logger.warning(f'Missing multicall batch {batch_idx} at block {block_number}')
 
-    batch_idx = 0
-    results = {}
-    for block_number, batch_calls in w3_multicall.batch_calls_iterator(batch_size=batch_size):
-        multicall_data = decoded_data.get(f'{batch_idx}_{block_number}')
-        decode_multicall_data = w3_multicall.decode(multicall_data, calls=batch_calls, ignore_error=ignore_error)
-        results.update(decode_multicall_data)
+    return results
 
-        batch_idx += 1
 
+def _decode_multicall_batches(w3_multicall: W3Multicall, decoded_data, batches, ignore_error=True):
+    """Decoded calls of the answered batches, and (batch index, block number, calls) of the missing ones"""
+    results = {}
+    failed_batches = []
+    for batch_idx, (block_number, batch_calls) in enumerate(batches):
+        multicall_data = decoded_data.get(get_multicall_key(w3_multicall, batch_idx, block_number))
+        if multicall_data is None:
+            failed_batches.append((batch_idx, block_number, batch_calls))
+        else:
+            results.update(w3_multicall.decode(multicall_data, calls=batch_calls, ignore_error=ignore_error))
+    return results, failed_batches
+
+
+def query_multicall(client_querier, w3_multicall: W3Multicall, batch_size=2000, min_batch_size=1,
+                    max_failed_rounds=3, ignore_error=True):
+    """Send the calls of w3_multicall in tryAggregate batches and return the decoded calls.
+
+    A batch the provider fails to answer, on a timeout, a gas or a response size limit, is split in halves and sent
+    again until it is min_batch_size calls. Calls still failing then raise an exception instead of being left out
+    of the results, as do max_failed_rounds rounds in a row where the provider could not be reached at all.
+    """
+    fn_names = tuple(sorted({call.fn_name for call in w3_multicall.calls.values()}))
+    size_key = (getattr(client_querier, 'provider_url', None), fn_names)
+    start_batch_size = multicall_batch_sizes.get(size_key, batch_size)
+
+    results = {}
+    batches = list(w3_multicall.batch_calls_iterator(batch_size=start_batch_size))
+    largest_success = 0
+    failed = False
+    failed_rounds = 0
+    while batches:
+        call_plan = CallPlan()
+        add_rpc_multicall(w3_multicall, call_plan, batches=batches)
+        try:
+            responses = client_querier.sent_batch_to_provider(call_plan.get_rpc_calls(), batch_size=1)
+            decoded_data = call_plan.decode(data_responses=responses, ignore_error=True)
+            failed_rounds = 0
+        except Exception as ex:
+            # One timed out batch fails the whole round, every batch of it is split
+            logger.warning(f'Multicall round of {len(batches)} batches failed: {ex}')
+            decoded_data = {}
+            failed_rounds += 1
+        batch_results, failed_batches = _decode_multicall_batches(
+            w3_multicall, decoded_data, batches, ignore_error=ignore_error)
+        results.update(batch_results)
+
+        failed_idxs = {batch_idx for batch_idx, _, _ in failed_batches}
+        answered_sizes = [len(calls) for batch_idx, (_, calls) in enumerate(batches) if batch_idx not in failed_idxs]
+        largest_success = max([largest_success] + answered_sizes)
+        if not failed_batches:
+            break
+
+        failed = True
+        unsplittable = [calls for _, _, calls in failed_batches if len(calls) <= min_batch_size]
+        if unsplittable or failed_rounds >= max_failed_rounds:
+            multicall_batch_sizes.update(size_key, batch_size, largest_success, failed)
+            number_of_calls = sum(len(calls) for _, _, calls in failed_batches)
+            raise Exception(f'Multicall of {fn_names} failed for {number_of_calls} calls '
+                            f'after splitting batches down to {min(len(calls) for _, _, calls in failed_batches)}')
+
+        batches = []
+        for _, block_number, calls in failed_batches:
+            items = list(calls.items())
+            half = (len(items) + 1) // 2
+            batches += [(block_number, dict(items[:half])), (block_number, dict(items[half:]))]
+        logger.info(f'Retry {len(failed_batches)} failed multicall batches of {fn_names} '
+                    f'as {len(batches)} batches of at most {half} calls')
+
+    multicall_batch_sizes.update(size_key, batch_size, largest_success, failed)
     return results
 
 
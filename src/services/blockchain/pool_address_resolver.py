@@ -0,0 +1,75 @@
+import threading
+
+from eth_abi import encode
+from web3 import Web3
+
+from src.constants.network_constants import PoolInitCode
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Pool Address Resolver')
+
+
+class PoolAddressResolver:
+    """Derive Uniswap V3 like pool addresses locally with CREATE2 instead of calling getPool of the factory.
+
+    A registered factory is trusted once the first derived address matches getPool, until then and for factories
+    without a known init code hash the caller keeps asking the factory.
+    """
+
+    def __init__(self, init_codes: dict = None):
+        self.init_codes = {
+            factory.lower(): (deployer.lower(), init_code_hash)
+            for factory, (deployer, init_code_hash) in (init_codes or PoolInitCode.factories).items()
+        }
+        self._verified = {}
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def is_verified(self, factory):
+        return factory is not None and self._verified.get(factory.lower(), False)
+
+    def verify(self, factory, token0, token1, fee, pool_address):
+        """Compare a getPool result with the derived address, a mismatch disables the factory"""
+        if factory is None or pool_address is None or factory.lower() not in self.init_codes:
+            return
+        factory = factory.lower()
+        if factory in self._verified:
+            return
+
+        derived_address = self._get_pool_address(factory, token0, token1, fee)
+        verified = derived_address == pool_address.lower()
+        with self._lock:
+            self._verified[factory] = verified
+        if verified:
+            logger.info(f'Derive pools of factory {factory} locally')
+        else:
+            logger.warning(f'Pool {pool_address} of factory {factory} does not match the derived address '
+                           f'{derived_address}, keep calling getPool')
+
+    def get_pool_address(self, factory, token0, token1, fee):
+        """Return the derived pool address, None if the factory is not verified"""
+        if not self.is_verified(factory):
+            return None
+        return self._get_pool_address(factory.lower(), token0, token1, fee)
+
+    def _get_pool_address(self, factory, token0, token1, fee):
+        token0, token1 = sorted([token0.lower(), token1.lower()])
+        key = (factory, token0, token1, int(fee))
+        with self._lock:
+            pool_address = self._pools.get(key)
+        if pool_address is None:
+            deployer, init_code_hash = self.init_codes[factory]
+            pool_address = self.compute_pool_address(deployer, init_code_hash, token0, token1, int(fee))
+            with self._lock:
+                self._pools[key] = pool_address
+        return pool_address
+
+    @staticmethod
+    def compute_pool_address(deployer, init_code_hash, token0, token1, fee):
+        salt = Web3.keccak(encode(
+            ['address', 'address', 'uint24'],
+            [Web3.to_checksum_address(token0), Web3.to_checksum_address(token1), fee]
+        ))
+        address = Web3.keccak(
+            b'\xff' + Web3.to_bytes(hexstr=deployer) + salt + Web3.to_bytes(hexstr=init_code_hash))[12:]
+        return Web3.to_hex(address)
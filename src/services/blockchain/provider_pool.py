@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from typing import List
+
+from src.constants.network_constants import Chains, Networks
+from src.services.blockchain.async_rpc_client import AsyncRPCClient
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Provider Pool')
+
+
+def get_archive_node_uris(chain_id):
+    """Archive node of the chain followed by its comma separated fallbacks"""
+    network = Chains.names[chain_id]
+    uris = [Networks.archive_node.get(network)]
+    uris += (Networks.archive_node_fallbacks.get(network) or '').split(',')
+    uris = [uri.strip() for uri in uris if uri and uri.strip()]
+    return list(dict.fromkeys(uris))
+
+
+def is_latest_request(payload):
+    """Every call of the payload reads the chain head"""
+    items = payload if isinstance(payload, list) else [payload]
+    return all(
+        item.get('method') == 'eth_blockNumber' or (item.get('params') and item['params'][-1] == 'latest')
+        for item in items
+    )
+
+
+class ProviderHealth:
+    """Moving averages of the latency and error rate of an endpoint"""
+
+    def __init__(self, uri, alpha=0.2):
+        self.uri = uri
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.penalized_until = 0
+
+    def record_latency(self, latency):
+        self.latency = latency if self.latency is None else (1 - self.alpha) * self.latency + self.alpha * latency
+
+    def record_success(self, latency):
+        self.requests += 1
+        self.record_latency(latency)
+        self.error_rate = (1 - self.alpha) * self.error_rate
+
+    def record_failure(self):
+        self.requests += 1
+        self.errors += 1
+        self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha
+
+    def penalize(self, seconds):
+        self.penalized_until = time.time() + seconds
+
+    @property
+    def score(self):
+        """Lower is healthier, an endpoint failing every request scores 11 times its latency.
+
+        Endpoints never used score last so fallbacks only take traffic once the known ones fail.
+        """
+        if self.latency is None:
+            return float('inf')
+        return self.latency * (1 + 10 * self.error_rate)
+
+    def to_dict(self):
+        return {
+            'uri': self.uri,
+            'latency': self.latency,
+            'errorRate': self.error_rate,
+            'requests': self.requests,
+            'errors': self.errors,
+            'penalized': self.penalized_until > time.time()
+        }
+
+
+class ProviderPool(AsyncRPCClient):
+    """AsyncRPCClient over several endpoints of a chain.
+
+    Every batch goes to the healthiest endpoint and fails over to the next ones in order of health. Endpoints that
+    fail error_threshold of their requests, or are switched away from, sit out for cooldown_seconds. With
+    hedge_after, a batch reading only 'latest' is sent to a second endpoint when the first one has not answered
+    after hedge_after seconds and the first response wins.
+    """
+
+    def __init__(self, provider_uris: List[str], max_in_flight=8, timeout=120, hedge_after=None,
+                 cooldown_seconds=60, error_threshold=0.5):
+        if not provider_uris:
+            raise ValueError('A provider pool needs at least one provider')
+        super().__init__(provider_uris[0], max_in_flight=max_in_flight, timeout=timeout, max_retries=0)
+        self.providers = [ProviderHealth(uri) for uri in provider_uris]
+        self.hedge_after = hedge_after
+        self.cooldown_seconds = cooldown_seconds
+        self.error_threshold = error_threshold
+        self._health_lock = threading.Lock()
+
+    def get_ranked_providers(self) -> List[ProviderHealth]:
+        now = time.time()
+        with self._health_lock:
+            # Configured order breaks ties so the first endpoint stays the primary one while healthy
+            ranked = sorted(
+                enumerate(self.providers),
+                key=lambda item: (item[1].penalized_until > now, item[1].score, item[0])
+            )
+        return [provider for _, provider in ranked]
+
+    def switch_provider(self):
+        """Put the current best endpoint aside for cooldown_seconds"""
+        provider = self.get_ranked_providers()[0]
+        with self._health_lock:
+            provider.penalize(self.cooldown_seconds)
+        self.provider_url = self.get_ranked_providers()[0].uri
+        logger.warning(f'Switch provider from {provider.uri} to {self.provider_url}')
+
+    def get_stats(self):
+        with self._health_lock:
+            return [provider.to_dict() for provider in self.providers]
+
+    async def post(self, payload):
+        providers = self.get_ranked_providers()
+        self.provider_url = providers[0].uri
+        hedge = self.hedge_after is not None and is_latest_request(payload)
+
+        last_error = None
+        while providers:
+            tasks = {asyncio.ensure_future(self._post_to_provider(providers.pop(0), payload))}
+            if hedge and providers:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                if not done:
+                    tasks.add(asyncio.ensure_future(self._post_to_provider(providers.pop(0), payload)))
+
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        for pending_task in tasks:
+                            pending_task.cancel()
+                        return task.result()
+                    last_error = task.exception()
+        raise last_error
+
+    async def _post_to_provider(self, provider: ProviderHealth, payload):
+        start_time = time.time()
+        try:
+            response = await self.post_to(provider.uri, payload)
+            if isinstance(response, dict) and response.get('error'):
+                raise Exception(f"Response data err {response.get('error')}")
+        except asyncio.CancelledError:
+            # Lost a hedged race, it took at least that long
+            with self._health_lock:
+                provider.record_latency(time.time() - start_time)
+            raise
+        except Exception as ex:
+            with self._health_lock:
+                provider.record_failure()
+                if provider.error_rate >= self.error_threshold:
+                    provider.penalize(self.cooldown_seconds)
+            logger.warning(f'Request to {provider.uri} failed: {type(ex).__name__} {ex}')
+            raise
+
+        with self._health_lock:
+            provider.record_success(time.time() - start_time)
+        return response
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('RPC Stand In')
+
+
+def get_request_key(item):
+    """Key of a JSON-RPC request without its id, hex strings are compared case insensitively"""
+    content = json.dumps([item.get('method'), item.get('params')], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.lower().encode()).hexdigest()
+
+
+class RPCRecordings:
+    """Responses of JSON-RPC requests keyed by method and params, appended to a JSON lines file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._responses = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._responses[record['key']] = record['response']
+            logger.info(f'Loaded {len(self._responses)} recorded responses from {path}')
+
+    def __len__(self):
+        return len(self._responses)
+
+    def get(self, item):
+        """Recorded response of the request with the id of the request, None if it was not recorded"""
+        response = self._responses.get(get_request_key(item))
+        if response is None:
+            return None
+        return {'jsonrpc': '2.0', 'id': item.get('id'), **response}
+
+    def add_many(self, items, responses):
+        """Record the responses of the requests, matched by id"""
+        responses_by_id = {response.get('id'): response for response in responses}
+        lines = []
+        with self._lock:
+            for item in items:
+                response = responses_by_id.get(item.get('id'))
+                if response is None or ('result' not in response and 'error' not in response):
+                    continue
+                key = get_request_key(item)
+                if key in self._responses:
+                    continue
+                recorded = {field: response[field] for field in ('result', 'error') if field in response}
+                self._responses[key] = recorded
+                lines.append(json.dumps({
+                    'key': key, 'method': item.get('method'), 'params': item.get('params'), 'response': recorded
+                }))
+            if lines:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, 'a') as f:
+                    f.write('\n'.join(lines) + '\n')
+
+
+class StandInHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients drop the connection of injected errors and lost hedged requests, it is not an error of the stand in
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class RPCStandIn:
+    """Local JSON-RPC endpoint answering from recordings, with injected latency and errors.
+
+    With an upstream URI, requests missing from the recordings are forwarded to it and their responses recorded,
+    so a run against the stand-in in record mode can be replayed later without network. Every request waits
+    latency seconds plus up to jitter seconds, and error_rate of them fail with the error_status HTTP status.
+    """
+
+    def __init__(self, recordings: RPCRecordings, upstream=None, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, seed=None, timeout=120):
+        self.recordings = recordings
+        self.upstream = upstream
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout = timeout
+
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'calls': 0, 'replayed': 0, 'forwarded': 0, 'missing': 0, 'injectedErrors': 0}
+        self._server = None
+
+    def handle(self, payload):
+        """Return the HTTP status and the body answering a JSON-RPC payload"""
+        with self._random_lock:
+            failed = self._random.random() < self.error_rate
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        self._count(requests=1)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            self._count(injectedErrors=1)
+            return self.error_status, {'error': {'code': -32603, 'message': 'Injected error'}}
+
+        items = payload if isinstance(payload, list) else [payload]
+        responses = {}
+        missing_items = []
+        for item in items:
+            response = self.recordings.get(item)
+            if response is None:
+                missing_items.append(item)
+            else:
+                responses[id(item)] = response
+
+        if missing_items and self.upstream:
+            status, upstream_responses = self._forward(missing_items)
+            if status != 200:
+                return status, upstream_responses
+            self.recordings.add_many(missing_items, upstream_responses)
+            upstream_responses = {response.get('id'): response for response in upstream_responses}
+            for item in missing_items:
+                # A node may leave items out of its batch answer, they fail without being recorded
+                responses[id(item)] = upstream_responses.get(item.get('id')) or {
+                    'jsonrpc': '2.0', 'id': item.get('id'),
+                    'error': {'code': -32603, 'message': 'Upstream response has no item with this id'}
+                }
+            self._count(forwarded=len(missing_items))
+        elif missing_items:
+            for item in missing_items:
+                responses[id(item)] = {
+                    'jsonrpc': '2.0', 'id': item.get('id'),
+                    'error': {'code': -32001, 'message': 'Request was not recorded'}
+                }
+            self._count(missing=len(missing_items))
+
+        self._count(calls=len(items), replayed=len(items) - len(missing_items))
+        body = [responses[id(item)] for item in items]
+        return 200, body if isinstance(payload, list) else body[0]
+
+    def _forward(self, items):
+        response = requests.post(self.upstream, json=items, timeout=self.timeout)
+        try:
+            data = response.json()
+        except ValueError:
+            data = {'error': {'code': -32603, 'message': response.text[:200]}}
+        if response.status_code == 200 and isinstance(data, dict):
+            # The node rejected the whole batch, answer it as is without recording it
+            return 502, data
+        return response.status_code, data
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+
+    def serve(self, host='127.0.0.1', port=8545):
+        """Create the HTTP server of the stand in, port 0 picks a free port"""
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                try:
+                    payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                    status, body = stand_in.handle(payload)
+                except Exception as ex:
+                    logger.exception(ex)
+                    status, body = 500, {'error': {'code': -32603, 'message': str(ex)}}
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = StandInHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        return self._server
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a daemon thread and return the URI of the stand in"""
+        server = self.serve(host, port)
+        threading.Thread(target=server.serve_forever, name='rpc-stand-in', daemon=True).start()
+        return f'http://{server.server_address[0]}:{server.server_address[1]}'
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -1,5 +1,5 @@
 import itertools
-import time
+import threading
 
 from query_state_lib.base.mappers.eth_call_balance_of_mapper import EthCallBalanceOf
 from query_state_lib.base.mappers.get_balance_mapper import GetBalance
@@ -12,20 +12,46 @@ from artifacts.abis.dexes.uniswap_v3_pool_abi import UNISWAP_V3_POOL_ABI
 from artifacts.abis.erc20_abi import ERC20_ABI
 from artifacts.abis.dexes.uniswap_v3_factory_abi import UNISWAP_V3_FACTORY_ABI
 from src.constants.network_constants import NATIVE_TOKEN, MulticallContract, Networks, Chains
-from src.services.blockchain.batch_queries_service import add_rpc_call, decode_data_response_ignore_error, \
-    decode_data_response
-from src.services.blockchain.multicall import W3Multicall, add_rpc_multicall, decode_multical_response
+from src.services.blockchain.async_rpc_client import AsyncRPCClient
+from src.services.blockchain.batch_queries_service import CallPlan, call_key
+from src.services.blockchain.eth_call_cache import CachedClientQuerier, EthCallCache
+from src.services.blockchain.multicall import W3Multicall, query_multicall
+from src.services.blockchain.pool_address_resolver import PoolAddressResolver
+from src.services.blockchain.provider_pool import ProviderPool
 from src.utils.logger_utils import get_logger
 
 logger = get_logger('State Query Service')
 
+_state_queriers = {}
+_state_queriers_lock = threading.Lock()
+
+
+def get_state_query_service(provider_uri, max_in_flight=0, fallback_uris=None, hedge_after=None):
+    """Return the StateQueryService of the provider, created once per process"""
+    with _state_queriers_lock:
+        if provider_uri not in _state_queriers:
+            _state_queriers[provider_uri] = StateQueryService(
+                provider_uri, max_in_flight=max_in_flight, fallback_uris=fallback_uris, hedge_after=hedge_after)
+        return _state_queriers[provider_uri]
+
 
 class StateQueryService:
-    def __init__(self, provider_uri):
+    def __init__(self, provider_uri, max_in_flight=0, fallback_uris=None, hedge_after=None,
+                 call_cache: EthCallCache = None):
         self._w3 = Web3(HTTPProvider(provider_uri))
         self._w3.middleware_onion.inject(geth_poa_middleware, layer=0)
 
-        self.client_querier = ClientQuerier(provider_url=provider_uri)
+        # Up to max_in_flight batches are sent at once by the async client, the ClientQuerier uses 8 worker threads
+        if fallback_uris:
+            self.client_querier = ProviderPool(
+                [provider_uri] + list(fallback_uris), max_in_flight=max_in_flight or 8, hedge_after=hedge_after)
+        elif max_in_flight:
+            self.client_querier = AsyncRPCClient(provider_uri, max_in_flight=max_in_flight)
+        else:
+            self.client_querier = ClientQuerier(provider_url=provider_uri)
+        if call_cache is not None:
+            self.client_querier = CachedClientQuerier(self.client_querier, call_cache)
+        self.pool_address_resolver = PoolAddressResolver()
 
     def to_checksum(self, address):
         return self._w3.to_checksum_address(address)
@@ -306,32 +332,26 @@ class StateQueryService:
         return data
 
     def batch_liquidity_pools_info(self, liquidity_pools, batch_size=100):
-        list_rpc_call = []
-        list_call_id = []
+        call_plan = CallPlan()
         for liquidity_pool in liquidity_pools:
             address = liquidity_pool['address']
             block_number = liquidity_pool['block_number']
 
             for token in liquidity_pool.get('tokens', []):
-                add_rpc_call(
-                    abi=ERC20_ABI, contract_address=Web3.to_checksum_address(token['address']),
-                    fn_name="decimals", block_number=block_number,
-                    list_call_id=list_call_id, list_rpc_call=list_rpc_call
+                call_plan.add(
+                    abi=ERC20_ABI, contract_address=token['address'], fn_name="decimals", block_number=block_number
                 )
-                add_rpc_call(
-                    abi=ERC20_ABI, contract_address=Web3.to_checksum_address(token['address']),
-                    fn_name="symbol", block_number=block_number,
-                    list_call_id=list_call_id, list_rpc_call=list_rpc_call
+                call_plan.add(
+                    abi=ERC20_ABI, contract_address=token['address'], fn_name="symbol", block_number=block_number
                 )
-                add_rpc_call(
-                    abi=ERC20_ABI, contract_address=Web3.to_checksum_address(token['address']),
-                    fn_name="balanceOf", fn_paras=address, block_number=block_number,
-                    list_call_id=list_call_id, list_rpc_call=list_rpc_call
+                call_plan.add(
+                    abi=ERC20_ABI, contract_address=token['address'],
+                    fn_name="balanceOf", fn_paras=address, block_number=block_number
                 )
 
         try:
-            responses = self.client_querier.sent_batch_to_provider(list_rpc_call, batch_size=batch_size)
-            decoded_data = decode_data_response_ignore_error(data_responses=responses, list_call_id=list_call_id)
+            responses = self.client_querier.sent_batch_to_provider(call_plan.get_rpc_calls(), batch_size=batch_size)
+            decoded_data = call_plan.decode(data_responses=responses)
         except Exception as ex:
             err_detail = str(ex)
             if err_detail.strip().startswith('Response data err'):
@@ -344,12 +364,12 @@ class StateQueryService:
 
             try:
                 for token in liquidity_pool.get('tokens', []):
-                    symbol = decoded_data.get(f'symbol_{token["address"]}_{block_number}'.lower())
+                    symbol = decoded_data.get(call_key('symbol', token['address'], block_number=block_number))
                     symbol = symbol.upper()
-                    decimals = decoded_data.get(f'decimals_{token["address"]}_{block_number}'.lower())
+                    decimals = decoded_data.get(call_key('decimals', token['address'], block_number=block_number))
 
                     liquidity_amount = decoded_data.get(
-                        f'balanceOf_{token["address"]}_{address}_{block_number}'.lower())
+                        call_key('balanceOf', token['address'], address, block_number))
                     token['liquidityAmount'] = liquidity_amount / 10 ** decimals
                     token['symbol'] = symbol
                     token['decimals'] = decimals
@@ -363,61 +383,51 @@ class StateQueryService:
 
         return liquidity_pools
 
-    def get_batch_nft_info_with_block_number(self, missing_nfts, factory_nft_contracts, new_pools, batch_size=100):
+    def get_batch_nft_info_with_block_number(self, missing_nfts, factory_nft_contracts, new_pools, block_number='latest',
+                                            batch_size=100):
+        """Positions, owners and pools of the NFTs at block_number, keyed by the nft_key of the missing NFTs.
+
+        NFT managers of a chain number their tokens independently, so the same token id may be in missing_nfts
+        once per manager.
+        """
         result = {}
         decoded_data = {}
-        list_rpc_call = []
-        list_call_id = []
+        call_plan = CallPlan()
         for nft in missing_nfts:
             token_id = nft['token_id']
             # block_number = nft['block_number']
             address = nft['contract_address']
-            add_rpc_call(
-                abi=UNISWAP_V3_NFT_MANAGER_ABI, contract_address=Web3.to_checksum_address(address),
-                fn_name="positions", block_number='latest', fn_paras=int(token_id),
-                list_call_id=list_call_id, list_rpc_call=list_rpc_call
+            call_plan.add(
+                abi=UNISWAP_V3_NFT_MANAGER_ABI, contract_address=address,
+                fn_name="positions", block_number=block_number, fn_paras=int(token_id)
             )
-            add_rpc_call(
-                abi=UNISWAP_V3_NFT_MANAGER_ABI, contract_address=Web3.to_checksum_address(address),
-                fn_name="ownerOf", block_number='latest', fn_paras=int(token_id),
-                list_call_id=list_call_id, list_rpc_call=list_rpc_call
+            call_plan.add(
+                abi=UNISWAP_V3_NFT_MANAGER_ABI, contract_address=address,
+                fn_name="ownerOf", block_number=block_number, fn_paras=int(token_id)
             )
             factory = factory_nft_contracts.get(address)
             if factory is None:
-                add_rpc_call(
-                    abi=UNISWAP_V3_NFT_MANAGER_ABI, contract_address=Web3.to_checksum_address(address),
-                    fn_name="factory", block_number="latest",
-                    list_call_id=list_call_id, list_rpc_call=list_rpc_call
+                call_plan.add(
+                    abi=UNISWAP_V3_NFT_MANAGER_ABI, contract_address=address,
+                    fn_name="factory", block_number=block_number
                 )
 
         try:
-            responses = self.client_querier.sent_batch_to_provider(list_rpc_call, batch_size=batch_size)
-            filtered_call_id = []
-            for call_id in list_call_id:
-                if responses[call_id].result:
-                    filtered_call_id.append(call_id)
-                # else:
-                #     if responses[call_id].error.get('message') == 'execution reverted: revert: Invalid token ID':
-                #         token_id = call_id.split("_")[2]
-                #         contract = call_id.split("_")[1]
-                #         invalid_tokens.append(f"{contract}_{token_id}")
-            if filtered_call_id:
-                decoded_data.update(
-                    decode_data_response_ignore_error(data_responses=responses, list_call_id=filtered_call_id))
+            responses = self.client_querier.sent_batch_to_provider(call_plan.get_rpc_calls(), batch_size=batch_size)
+            # Calls of invalid token ids revert without result and are skipped
+            decoded_data.update(call_plan.decode(data_responses=responses))
         except Exception as ex:
             logger.exception(f"Exception {ex} when query provider")
-        list_rpc_call = []
-        list_call_id = []
+        call_plan = CallPlan()
         for nft in missing_nfts:
             token_id = nft['token_id']
-            block_number = nft['block_number']
             address = nft['contract_address']
-            position = decoded_data.get(f"positions_{address}_{token_id}_latest".lower())
-            wallet = decoded_data.get(f"ownerOf_{address}_{token_id}_latest".lower())
+            position = decoded_data.get(call_key('positions', address, int(token_id), block_number))
+            wallet = decoded_data.get(call_key('ownerOf', address, int(token_id), block_number))
             if not position:
                 continue
             if factory_nft_contracts.get(address) is None:
-                factory = decoded_data.get(f"factory_{address}_latest".lower())
+                factory = decoded_data.get(call_key('factory', address, block_number=block_number))
                 factory_nft_contracts[address] = factory
             factory = factory_nft_contracts[address]
             token0 = position[2]
@@ -428,43 +438,46 @@ class StateQueryService:
             liquidity = position[7]
             # fee_growth_inside0 = position[8]
             # fee_growth_inside1 = position[9]
-            result[token_id] = {
+            result[nft['nft_key']] = {
                 'tick_lower': tick_lower,
                 'tick_upper': tick_upper,
                 'liquidity': float(liquidity),
                 # 'fee_growth_inside0': fee_growth_inside0,
                 # 'fee_growth_inside1': fee_growth_inside1,
-                'last_called_at': block_number,
+                # Events up to a pinned block are already in the position, only later ones are applied on top
+                'last_called_at': block_number if isinstance(block_number, int) else nft['block_number'],
                 'wallet': wallet
             }
-            add_rpc_call(
-                abi=UNISWAP_V3_FACTORY_ABI, contract_address=Web3.to_checksum_address(factory),
-                fn_name="getPool", block_number="latest",
-                fn_paras=[Web3.to_checksum_address(token0), Web3.to_checksum_address(token1), fee],
-                list_call_id=list_call_id, list_rpc_call=list_rpc_call
+            pool = self.pool_address_resolver.get_pool_address(factory, token0, token1, fee)
+            if pool is not None:
+                result[nft['nft_key']]['pool_address'] = pool
+                new_pools.add(pool)
+                continue
+            call_plan.add(
+                abi=UNISWAP_V3_FACTORY_ABI, contract_address=factory, fn_name="getPool", block_number=block_number,
+                fn_paras=[Web3.to_checksum_address(token0), Web3.to_checksum_address(token1), fee]
             )
+        if not call_plan:
+            return result
         try:
-            responses = self.client_querier.sent_batch_to_provider(list_rpc_call, batch_size=batch_size)
-            # filtered_call_id = []
-            # for call_id in list_call_id:
-            #     if decoded_data[call_id].result:
-            #         filtered_call_id.append(call_id)
-            decoded_data.update(decode_data_response(data_responses=responses, list_call_id=list_call_id))
+            responses = self.client_querier.sent_batch_to_provider(call_plan.get_rpc_calls(), batch_size=batch_size)
+            decoded_data.update(call_plan.decode(data_responses=responses, ignore_error=False))
 
             for nft in missing_nfts:
                 token_id = nft['token_id']
                 # block_number = nft['block_number']
                 address = nft['contract_address']
-                position = decoded_data.get(f"positions_{address}_{token_id}_latest".lower())
-                if not position:
+                position = decoded_data.get(call_key('positions', address, int(token_id), block_number))
+                if not position or 'pool_address' in result[nft['nft_key']]:
                     continue
 
                 factory = factory_nft_contracts[address]
                 token0 = position[2]
                 token1 = position[3]
                 fee = position[4]
-                pool = decoded_data.get(f"getPool_{factory}_{[token0, token1, fee]}_latest".lower())
-                result[token_id].update({'pool_address': pool})
+                pool = decoded_data.get(call_key('getPool', factory, [token0, token1, fee], block_number))
+                self.pool_address_resolver.verify(factory, token0, token1, fee, pool)
+                result[nft['nft_key']].update({'pool_address': pool})
                 new_pools.add(pool)
             return result
 
@@ -482,18 +495,12 @@ class StateQueryService:
                                  abi=UNISWAP_V3_NFT_MANAGER_ABI, fn_name='positions', fn_paras=int(nft['tokenId'])
                                  ))
             list_nfts.append(nft)
-        list_call_id, list_rpc_call = [], []
-        add_rpc_multicall(w3_multicall, list_rpc_call=list_rpc_call, list_call_id=list_call_id,
-                          batch_size=batch_size)
-        responses = self.client_querier.sent_batch_to_provider(list_rpc_call, batch_size=1)
-        decoded_data = decode_multical_response(
-            w3_multicall=w3_multicall, data_responses=responses,
-            list_call_id=list_call_id, ignore_error=True, batch_size=batch_size
-        )
+        decoded_data = query_multicall(self.client_querier, w3_multicall, batch_size=batch_size)
         w3_multicall.calls = {}
         for idx, nft in enumerate(list_nfts):
             pool_address = nft['poolAddress']
-            position = decoded_data.get(f'positions_{nft["nftManagerAddress"]}_{nft["tokenId"]}_{block_number}'.lower())
+            position = decoded_data.get(
+                call_key('positions', nft['nftManagerAddress'], int(nft['tokenId']), block_number))
             if not position or position[7] == 0:
                 continue
             pools_in_batch.add(pool_address)
@@ -517,14 +524,8 @@ class StateQueryService:
                                  abi=UNISWAP_V3_POOL_ABI, fn_name='ticks', fn_paras=nft['tickUpper']
                                  ))
 
-        list_call_id, list_rpc_call = [], []
-        add_rpc_multicall(w3_multicall, list_rpc_call=list_rpc_call, list_call_id=list_call_id, batch_size=batch_size)
         try:
-            responses = self.client_querier.sent_batch_to_provider(list_rpc_call, batch_size=1)
-            decoded_data.update(decode_multical_response(
-                w3_multicall=w3_multicall, data_responses=responses,
-                list_call_id=list_call_id, ignore_error=True, batch_size=batch_size
-            ))
+            decoded_data.update(query_multicall(self.client_querier, w3_multicall, batch_size=batch_size))
             return decoded_data, list_nfts, important_nfts, pools_in_batch
 
         except Exception as e:
@@ -544,14 +545,7 @@ class StateQueryService:
                 W3Multicall.Call(address=Web3.to_checksum_address(nft['nftManagerAddress']), block_number=block_number,
                                  abi=UNISWAP_V3_NFT_MANAGER_ABI, fn_name='positions', fn_paras=int(nft['tokenId'])
                                  ))
-        list_call_id, list_rpc_call = [], []
-        add_rpc_multicall(w3_multicall, list_rpc_call=list_rpc_call, list_call_id=list_call_id,
-                          batch_size=batch_size)
-        responses = self.client_querier.sent_batch_to_provider(list_rpc_call, batch_size=1)
-        decoded_data = decode_multical_response(
-            w3_multicall=w3_multicall, data_responses=responses,
-            list_call_id=list_call_id, ignore_error=True, batch_size=batch_size
-        )
+        decoded_data = query_multicall(self.client_querier, w3_multicall, batch_size=batch_size)
         w3_multicall.calls = {}
 
         for idx, nft in enumerate(nfts):
@@ -560,7 +554,8 @@ class StateQueryService:
 
             else:
                 block_number = a_day_ago_block_number
-            position = decoded_data.get(f'positions_{nft["nftManagerAddress"]}_{nft["tokenId"]}_{block_number}'.lower())
+            position = decoded_data.get(
+                call_key('positions', nft['nftManagerAddress'], int(nft['tokenId']), block_number))
             if not position:
                 continue
             pool_address = nft['poolAddress']
@@ -587,19 +582,12 @@ class StateQueryService:
                                  abi=UNISWAP_V3_POOL_ABI, fn_name='ticks', fn_paras=nft['tickUpper']
                                  ))
 
-        list_call_id, list_rpc_call = [], []
-        add_rpc_multicall(w3_multicall, list_rpc_call=list_rpc_call, list_call_id=list_call_id, batch_size=batch_size)
         try:
-            responses = self.client_querier.sent_batch_to_provider(list_rpc_call, batch_size=1)
-            decoded_data.update(decode_multical_response(
-                w3_multicall=w3_multicall, data_responses=responses,
-                list_call_id=list_call_id, ignore_error=True, batch_size=batch_size
-            ))
+            decoded_data.update(query_multicall(self.client_querier, w3_multicall, batch_size=batch_size))
             return decoded_data
 
         except Exception as e:
             logger.error(f"Error while send batch to provider: {e}")
-            time.sleep(120)
             return {}
 
     # def get_batch_nft_fee_with_block_number(self, nfts, pools, list_rpc_call, list_call_id, start_block=None, latest = False):
@@ -696,17 +684,13 @@ class StateQueryService:
                              abi=UNISWAP_V3_POOL_ABI, fn_name='feeGrowthGlobal1X128'
                              ))
 
-        list_call_id, list_rpc_call = [], []
-        add_rpc_multicall(w3_multicall, list_rpc_call=list_rpc_call, list_call_id=list_call_id)
-        responses = self.client_querier.sent_batch_to_provider(list_rpc_call, batch_size=1)
-        decoded_data = decode_multical_response(
-            w3_multicall=w3_multicall, data_responses=responses,
-            list_call_id=list_call_id, ignore_error=True
-        )
-        fee_growth_global_0 = decoded_data.get(f'feeGrowthGlobal0X128_{pool_address}_{end_block}'.lower())
-        fee_growth_global_1 = decoded_data.get(f'feeGrowthGlobal1X128_{pool_address}_{end_block}'.lower())
-        fee_growth_global_0_before = decoded_data.get(f'feeGrowthGlobal0X128_{pool_address}_{start_block}'.lower())
-        fee_growth_global_1_before = decoded_data.get(f'feeGrowthGlobal1X128_{pool_address}_{start_block}'.lower())
+        decoded_data = query_multicall(self.client_querier, w3_multicall)
+        fee_growth_global_0 = decoded_data.get(call_key('feeGrowthGlobal0X128', pool_address, block_number=end_block))
+        fee_growth_global_1 = decoded_data.get(call_key('feeGrowthGlobal1X128', pool_address, block_number=end_block))
+        fee_growth_global_0_before = decoded_data.get(
+            call_key('feeGrowthGlobal0X128', pool_address, block_number=start_block))
+        fee_growth_global_1_before = decoded_data.get(
+            call_key('feeGrowthGlobal1X128', pool_address, block_number=start_block))
         fee_generate0 = (fee_growth_global_0 - fee_growth_global_0_before) / 2 ** 128
         fee_generate1 = (fee_growth_global_1 - fee_growth_global_1_before) / 2 ** 128
         fee = fee_generate0 * 1 + fee_generate1 * 3141
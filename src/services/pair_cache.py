@@ -0,0 +1,94 @@
+import threading
+
+from src.databases.mongodb_dex import MongoDBDex
+from src.utils.logger_utils import get_logger
+from src.utils.lru_cache import LRUCache
+
+logger = get_logger('Pair Cache')
+
+_pair_caches = {}
+_pair_caches_lock = threading.Lock()
+
+
+def get_pair_cache(chain_id, dex_db: MongoDBDex = None, max_size=10000, ttl_seconds=6 * 3600,
+                   missing_ttl_seconds=600):
+    """Return the PairCache of the chain, created once per process and shared by the jobs and streams"""
+    with _pair_caches_lock:
+        if chain_id not in _pair_caches:
+            _pair_caches[chain_id] = PairCache(
+                chain_id, dex_db if dex_db is not None else MongoDBDex(), max_size=max_size, ttl_seconds=ttl_seconds,
+                missing_ttl_seconds=missing_ttl_seconds)
+        return _pair_caches[chain_id]
+
+
+class PairCache:
+    """Pair documents of a chain keyed by pool address, bounded in size and refreshed after ttl_seconds.
+
+    Pools missing from the cache are read with one query per call. A pool already being read by another thread
+    is waited for instead of being read twice. Pools that are not in pairs are remembered for missing_ttl_seconds
+    so they are not queried again for every NFT of the pool.
+    """
+
+    def __init__(self, chain_id, dex_db: MongoDBDex, max_size=10000, ttl_seconds=6 * 3600, missing_ttl_seconds=600):
+        self.chain_id = chain_id
+        self.dex_db = dex_db
+        self._cache = LRUCache(max_size, ttl_seconds=ttl_seconds)
+        self._missing = LRUCache(max_size, ttl_seconds=missing_ttl_seconds)
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, address, default=None):
+        return self.get_many([address]).get(address, default)
+
+    def get_many(self, addresses):
+        """Return {address: pair} of the pools found, loading those that are not cached"""
+        addresses = {address for address in addresses if address}
+        pairs = self._cache.get_many(addresses)
+        unknown_addresses = addresses - pairs.keys()
+        if unknown_addresses:
+            unknown_addresses -= self._missing.get_many(unknown_addresses).keys()
+
+        to_load, waiting = [], []
+        with self._lock:
+            for address in unknown_addresses:
+                if address in self._loading:
+                    waiting.append(self._loading[address])
+                else:
+                    self._loading[address] = threading.Event()
+                    to_load.append(address)
+
+        if to_load:
+            try:
+                loaded_pairs = self._load(to_load)
+                self._cache.put_many(loaded_pairs)
+                self._missing.put_many({address: True for address in to_load if address not in loaded_pairs})
+                pairs.update(loaded_pairs)
+            finally:
+                with self._lock:
+                    for address in to_load:
+                        self._loading.pop(address).set()
+
+        for event in waiting:
+            event.wait()
+        missing = addresses - pairs.keys()
+        if waiting and missing:
+            pairs.update(self._cache.get_many(missing))
+        return pairs
+
+    def warmup(self, addresses):
+        """Load pools of the active NFTs at once, at most max_size of them"""
+        addresses = [address for address in addresses if address][:self._cache.max_size]
+        pairs = self.get_many(addresses)
+        logger.info(f'Warm up {len(pairs)} / {len(addresses)} pairs of chain {self.chain_id}')
+        return len(pairs)
+
+    def clear(self):
+        self._cache.clear()
+        self._missing.clear()
+
+    def _load(self, addresses):
+        cursor = self.dex_db.get_pairs_with_addresses(chain_id=self.chain_id, addresses=addresses)
+        return {doc['address']: doc for doc in cursor}
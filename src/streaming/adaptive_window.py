@@ -0,0 +1,63 @@
+from collections import deque
+
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Adaptive Block Window')
+
+
+class AdaptiveBlockWindow:
+    """Choose the number of blocks per sync cycle and per worker batch from the last cycles.
+
+    The block window aims for ``target_cycle_seconds`` per cycle and the worker batch aims for
+    ``target_events_per_batch`` events, both measured on the ``history`` most recent cycles.
+    """
+
+    def __init__(self, block_batch_size=180, batch_size=30,
+                 min_block_batch_size=10, max_block_batch_size=2000,
+                 min_batch_size=1, max_batch_size=500,
+                 target_cycle_seconds=60, target_events_per_batch=200, history=5):
+        self.min_block_batch_size = min_block_batch_size
+        self.max_block_batch_size = max_block_batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_cycle_seconds = target_cycle_seconds
+        self.target_events_per_batch = target_events_per_batch
+
+        self.block_batch_size = clamp(block_batch_size, min_block_batch_size, max_block_batch_size)
+        self.batch_size = clamp(batch_size, min_batch_size, min(max_batch_size, self.block_batch_size))
+        self.events_per_block = None
+
+        self._cycles = deque(maxlen=history)
+
+    def record(self, number_of_blocks, number_of_events, duration):
+        """Add a finished cycle and recompute the window sizes"""
+        if number_of_blocks <= 0:
+            return
+        self._cycles.append((number_of_blocks, number_of_events, duration))
+
+        blocks = sum(cycle[0] for cycle in self._cycles)
+        events = sum(cycle[1] for cycle in self._cycles)
+        seconds = sum(cycle[2] for cycle in self._cycles)
+        self.events_per_block = events / blocks
+
+        # Never more than double the window in one step, a sparse range is often followed by a busy one
+        if seconds > 0:
+            block_batch_size = int(self.target_cycle_seconds * blocks / seconds)
+        else:
+            block_batch_size = self.block_batch_size * 2
+        block_batch_size = min(block_batch_size, self.block_batch_size * 2)
+        self.block_batch_size = clamp(block_batch_size, self.min_block_batch_size, self.max_block_batch_size)
+
+        if self.events_per_block > 0:
+            batch_size = int(self.target_events_per_batch / self.events_per_block)
+        else:
+            batch_size = self.max_batch_size
+        self.batch_size = clamp(batch_size, self.min_batch_size, min(self.max_batch_size, self.block_batch_size))
+
+        logger.info(f'Events per block {round(self.events_per_block, 3)}, '
+                    f'seconds per block {round(seconds / blocks, 3)} => '
+                    f'block batch size {self.block_batch_size}, batch size {self.batch_size}')
+
+
+def clamp(value, min_value, max_value):
+    return max(min_value, min(value, max_value))
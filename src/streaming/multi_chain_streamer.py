@@ -0,0 +1,94 @@
+import heapq
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict
+
+from src.streaming.streamer import Streamer, write_to_file, delete_file
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Multi Chain Streamer')
+
+
+class MultiChainStreamer:
+    """Run the streamers of several chains in one process.
+
+    Every chain runs at most one sync cycle at a time and goes back to the end of the queue after it, so a busy
+    chain gets one cycle per turn like the others. A chain with nothing to sync waits for new blocks of its
+    collector, at most ``period_seconds``, before its next turn without holding a worker.
+    """
+
+    def __init__(self, streamers: Dict[str, Streamer], max_workers=None, period_seconds=30, pid_file=None):
+        self.streamers = streamers
+        self.max_workers = max_workers or len(streamers)
+        self.period_seconds = period_seconds
+        self.pid_file = pid_file
+
+        self._counter = itertools.count()
+
+    def stream(self):
+        try:
+            if self.pid_file is not None:
+                write_to_file(self.pid_file, str(os.getpid()))
+            self._do_stream()
+        finally:
+            for streamer in self.streamers.values():
+                streamer.close()
+            if self.pid_file is not None:
+                delete_file(self.pid_file)
+
+    def _do_stream(self):
+        logger.info(f"Stream load data of chains: {', '.join(self.streamers)}")
+
+        # Queue of (ready at, order, chain), order keeps chains that are ready at the same time in FIFO
+        queue = [(0, next(self._counter), chain) for chain in self.streamers]
+        heapq.heapify(queue)
+        running = {}
+        # Caught up chains wait for their collector on their own threads, a new block puts them back in the queue
+        waiting = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                ThreadPoolExecutor(max_workers=len(self.streamers)) as wait_executor:
+            while queue or running or waiting:
+                now = time.time()
+                while queue and queue[0][0] <= now and len(running) < self.max_workers:
+                    _, _, chain = heapq.heappop(queue)
+                    running[executor.submit(self.streamers[chain].sync_once)] = chain
+
+                timeout = max(queue[0][0] - now, 0) if queue and len(running) < self.max_workers else None
+                if not running and not waiting:
+                    time.sleep(timeout)
+                    continue
+
+                done, _ = wait(list(running) + list(waiting), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in waiting:
+                        chain = waiting.pop(future)
+                        ready_at = time.time()
+                        if future.exception() is not None:
+                            logger.error(f'Failed to wait for new blocks on chain {chain}: {future.exception()}')
+                            ready_at += self.period_seconds
+                        heapq.heappush(queue, (ready_at, next(self._counter), chain))
+                        continue
+
+                    chain = running.pop(future)
+                    synced_blocks = future.result()
+                    streamer = self.streamers[chain]
+                    if streamer.is_finished():
+                        logger.info(f'Chain {chain} reached its end block {streamer.end_block}')
+                        continue
+
+                    adapter = streamer.blockchain_streamer_adapter
+                    if synced_blocks == 0 and hasattr(adapter, 'wait_for_new_block'):
+                        logger.info(f'Nothing to enrich on chain {chain}. '
+                                    f'Waiting for new blocks at most {self.period_seconds} seconds')
+                        waiting[wait_executor.submit(
+                            adapter.wait_for_new_block, streamer.last_synced_block + streamer.lag,
+                            timeout=self.period_seconds)] = chain
+                        continue
+
+                    ready_at = time.time()
+                    if synced_blocks <= 0:
+                        logger.info(f'Nothing to enrich on chain {chain}. Next turn in {self.period_seconds} seconds')
+                        ready_at += self.period_seconds
+                    heapq.heappush(queue, (ready_at, next(self._counter), chain))
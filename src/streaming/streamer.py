@@ -1,7 +1,11 @@
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from src.utils.file_utils import smart_open
+from src.models.loader import Loader
+from src.streaming.adaptive_window import AdaptiveBlockWindow
+from src.utils.file_utils import smart_open, write_adaptive_window_logs
+from src.utils import stream_metrics
 from src.utils.logger_utils import get_logger
 
 logger = get_logger('Load Streamer')
@@ -12,7 +16,8 @@ class Streamer:
             self, blockchain_streamer_adapter, exporter,
             last_synced_block_file='last_synced_block.txt',
             lag=0, start_block=None, end_block=None, period_seconds=30, block_batch_size=32,
-            retry_errors=True, pid_file=None, stream_id='loader_id'
+            retry_errors=True, pid_file=None, stream_id='loader_id', pipeline=False,
+            adaptive_window: AdaptiveBlockWindow = None
     ):
         self.blockchain_streamer_adapter = blockchain_streamer_adapter
         self.last_synced_block_file = last_synced_block_file
@@ -31,6 +36,17 @@ class Streamer:
         self.stream_id = stream_id
         self.exporter = exporter
 
+        # Pipeline mode: the next window is prefetched by the adapter while the current one is enriched
+        self.pipeline = pipeline
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1) if pipeline else None
+        self._prefetch_future = None
+        self._prefetch_range = None
+
+        self.adaptive_window = adaptive_window
+        if self.adaptive_window is not None:
+            self.block_batch_size = self.adaptive_window.block_batch_size
+            self.blockchain_streamer_adapter.batch_size = self.adaptive_window.batch_size
+
         self._update_start_extract_at()
 
     def _update_start_extract_at(self):
@@ -39,6 +55,19 @@ class Streamer:
             self.collector.start_extracting_block_number = self.last_synced_block
             self.collector.last_updated_at_block_number = self.last_synced_block
             self.exporter.update_loader(self.collector)
+        elif self.start_block is None and (self.collector.last_updated_at_block_number or 0) > self.last_synced_block:
+            # The loader is committed with the NFTs, the file may miss the last window if the process died after it
+            logger.info(f'Resume from loader checkpoint {self.collector.last_updated_at_block_number} '
+                        f'instead of {self.last_synced_block}')
+            self.last_synced_block = self.collector.last_updated_at_block_number
+            write_last_synced_block(self.last_synced_block_file, self.last_synced_block)
+
+    def _next_checkpoint(self, target_block):
+        return Loader(
+            _id=self.collector.id,
+            start_extracting_block_number=self.collector.start_extracting_block_number,
+            last_updated_at_block_number=target_block
+        )
 
     def stream(self):
         try:
@@ -46,39 +75,72 @@ class Streamer:
                 write_to_file(self.pid_file, str(os.getpid()))
             self._do_stream()
         finally:
+            self.close()
             if self.pid_file is not None:
                 delete_file(self.pid_file)
 
     def _do_stream(self):
         logger.info("Stream load data:")
-        while (self.end_block is None) or (self.last_synced_block < self.end_block):
-            synced_blocks = 0
-            try:
-                synced_blocks = self._sync_cycle()
-            except Exception as e:
-                logger.exception(e)
-                logger.error(f'An exception occurred while syncing block data: {e}')
-                self.blockchain_streamer_adapter.switch_provider()
-                if not self.retry_errors:
-                    raise e
-
-            if synced_blocks <= 0:
+        while not self.is_finished():
+            synced_blocks = self.sync_once()
+            if synced_blocks < 0 or not hasattr(self.blockchain_streamer_adapter, 'wait_for_new_block'):
                 logger.info('Nothing to enrich. Sleeping for {} seconds...'.format(self.period_seconds))
                 time.sleep(self.period_seconds)
+            elif synced_blocks == 0:
+                logger.info('Nothing to enrich. Waiting for new blocks at most {} seconds...'.format(self.period_seconds))
+                self.blockchain_streamer_adapter.wait_for_new_block(
+                    self.last_synced_block + self.lag, timeout=self.period_seconds)
+
+    def is_finished(self):
+        return self.end_block is not None and self.last_synced_block >= self.end_block
+
+    def sync_once(self):
+        """Run one sync cycle and return the number of synced blocks, -1 if it failed"""
+        try:
+            return self._sync_cycle()
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'An exception occurred while syncing block data: {e}')
+            self.blockchain_streamer_adapter.switch_provider()
+            if not self.retry_errors:
+                raise e
+        return -1
+
+    def close(self):
+        if self._prefetch_executor is not None:
+            self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
 
     def _sync_cycle(self):
         current_block = self.blockchain_streamer_adapter.get_current_block_number()
         if not current_block:
             return 0
+        chain_id = getattr(self.blockchain_streamer_adapter, 'chain_id', None)
+        stream_metrics.observe_lag(chain_id, current_block - self.lag, self.last_synced_block)
         target_block = self._calculate_target_block(current_block, self.last_synced_block)
+        start_block = self.last_synced_block + 1
+        if self.pipeline and self._prefetch_range and self._prefetch_range[0] == start_block:
+            # Keep the window that was prefetched, the head may have moved since it was scheduled
+            target_block = min(target_block, self._prefetch_range[1])
+
         blocks_to_sync = max(target_block - self.last_synced_block, 0)
         if blocks_to_sync != 0:
-            self.blockchain_streamer_adapter.enrich_all(self.last_synced_block + 1, target_block)
+            start = time.time()
+            if self.pipeline:
+                prefetched = self._take_prefetched(start_block, target_block)
+                self._schedule_prefetch(current_block, target_block)
+                number_of_events = self.blockchain_streamer_adapter.enrich_all(
+                    start_block, target_block, prefetched=prefetched, loader=self._next_checkpoint(target_block))
+            else:
+                number_of_events = self.blockchain_streamer_adapter.enrich_all(
+                    start_block, target_block, loader=self._next_checkpoint(target_block))
+            # The loader checkpoint is already committed with the enriched data
+            self.collector.last_updated_at_block_number = target_block
+            self._adapt_window(blocks_to_sync, number_of_events, time.time() - start)
             write_last_synced_block(self.last_synced_block_file, target_block)
             self.last_synced_block = target_block
 
-            self.collector.last_updated_at_block_number = target_block
-            self.exporter.update_loader(self.collector)
+            stream_metrics.observe_lag(chain_id, current_block - self.lag, self.last_synced_block)
+        stream_metrics.flush()
 
         return blocks_to_sync
 
@@ -88,6 +150,46 @@ class Streamer:
         target_block = min(target_block, self.end_block) if self.end_block is not None else target_block
         return target_block
 
+    def _adapt_window(self, number_of_blocks, number_of_events, duration):
+        if self.adaptive_window is None or number_of_events is None:
+            return
+
+        self.adaptive_window.record(number_of_blocks, number_of_events, duration)
+        self.block_batch_size = self.adaptive_window.block_batch_size
+        self.blockchain_streamer_adapter.batch_size = self.adaptive_window.batch_size
+        write_adaptive_window_logs(
+            stream_name=f'{self.blockchain_streamer_adapter.__class__.__name__}_{self.stream_id}',
+            block_batch_size=self.block_batch_size,
+            batch_size=self.adaptive_window.batch_size,
+            events_per_block=self.adaptive_window.events_per_block
+        )
+
+    def _schedule_prefetch(self, current_block, last_synced_block):
+        next_target_block = self._calculate_target_block(current_block, last_synced_block)
+        if next_target_block <= last_synced_block:
+            return
+
+        self._prefetch_range = (last_synced_block + 1, next_target_block)
+        self._prefetch_future = self._prefetch_executor.submit(
+            self.blockchain_streamer_adapter.prefetch, *self._prefetch_range)
+
+    def _take_prefetched(self, start_block, end_block):
+        future, prefetch_range = self._prefetch_future, self._prefetch_range
+        self._prefetch_future, self._prefetch_range = None, None
+        if future is None:
+            return None
+
+        if prefetch_range != (start_block, end_block):
+            future.cancel()
+            return None
+
+        try:
+            return future.result()
+        except Exception as e:
+            logger.exception(e)
+            logger.warning(f'Prefetch block {start_block} - {end_block} failed. Enrich without prefetched data')
+        return None
+
 
 def delete_file(file):
     try:
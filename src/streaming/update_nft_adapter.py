@@ -1,44 +1,159 @@
 import time
 
+from pymongo.errors import OperationFailure
+
 from src.constants.network_constants import Chains
 from src.constants.time_constants import TimeConstants
 from src.databases.dex_nft_manager_db import NFTMongoDB
+from src.databases.mongodb_dex import MongoDBDex
 from src.exporters.nft_mongodb_exporter import NFTMongoDBExporter
-from src.jobs.update_nft_job import UpdateNftInfoJob
+from src.jobs.update_nft_job import UpdateNftInfoJob, EVENT_TYPES, EVENT_FIELDS, get_nft_key
+from src.models.loader import Loader
+from src.services.blockchain.provider_pool import get_archive_node_uris
+from src.services.blockchain.state_query_service import get_state_query_service
+from src.services.pair_cache import get_pair_cache
 from src.utils.file_utils import write_last_time_running_logs
 from src.utils.logger_utils import get_logger
+from src.utils.lru_cache import LRUCache
+from src.utils.stream_metrics import stage_timer, observe_cycle
 
 logger = get_logger('UPdate NFT Info Adapter')
 
 
+class PrefetchedWindow:
+    """Events, missing NFTs info and factories of a block window, read ahead of its enrichment"""
+    def __init__(self, start_block, end_block, events=None, missing_nfts_info=None, factory_nft_contracts=None):
+        self.start_block = start_block
+        self.end_block = end_block
+        self.events = events or []
+        self.missing_nfts_info = missing_nfts_info or {}
+        # Factories of NFT managers resolved by the prefetch, merged into the job config when the window is enriched
+        self.factory_nft_contracts = factory_nft_contracts or {}
+
+
 class UpdateNftInfoAdapter:
     def __init__(self, importer: NFTMongoDB, exporter: NFTMongoDBExporter, collector_id="streaming_collector",
-                 chain_id=Chains.bsc, batch_size=4, max_workers=8):
+                 chain_id=Chains.bsc, batch_size=4, max_workers=8, dex_db: MongoDBDex = None,
+                 nft_cache_size=100000, pool_cache_size=10000, partition_by_token=False, hedge_after=None):
         self.collector_id = collector_id
 
         self.chain_id = chain_id
 
         self.batch_size = batch_size
         self.max_workers = max_workers
+        # Group the events of a window by NFT, batch_size is then the number of NFTs of a worker batch
+        self.partition_by_token = partition_by_token
 
         self._exporter = exporter
         self._importer = importer
+        # Fallback archive nodes take over when the archive node is slow or failing
+        provider_uri, *fallback_uris = get_archive_node_uris(self.chain_id) or [None]
+        self._state_querier = get_state_query_service(
+            provider_uri, fallback_uris=fallback_uris, hedge_after=hedge_after)
+        self._dex_db = dex_db if dex_db is not None else MongoDBDex()
+
+        # Kept between cycles so hot NFTs and pools are not read again from Mongo every window
+        self.nft_cache = LRUCache(nft_cache_size)
+        self.pair_cache = get_pair_cache(self.chain_id, self._dex_db, max_size=pool_cache_size)
+        self.factory_nft_contracts = None
+        self.number_of_exported_nfts = 0
+
+        self._change_stream_available = True
+        self.min_poll_seconds = 1
 
     def switch_provider(self):
-        # Switch provider
-        pass
+        # Only a provider pool has other archive nodes to switch to
+        switch_provider = getattr(self._state_querier.client_querier, 'switch_provider', None)
+        if switch_provider is not None:
+            switch_provider()
 
     def get_current_block_number(self):
         return self._importer.get_last_block_number(self.collector_id)
 
-    def enrich_all(self, start_block=0, end_block=0):
+    def wait_for_new_block(self, last_block, timeout):
+        """Return as soon as the ETL collector passes last_block, or after timeout seconds"""
+        if self._change_stream_available:
+            try:
+                return self._importer.watch_last_block_number(self.collector_id, last_block, timeout)
+            except OperationFailure as e:
+                logger.warning(f'Change stream is not available, fall back to polling: {e}')
+                self._change_stream_available = False
+
+        # Poll quickly right after the last update then back off while the collector stays behind
+        deadline = time.time() + timeout
+        poll_seconds = self.min_poll_seconds
+        current_block = self.get_current_block_number()
+        while current_block <= last_block and time.time() < deadline:
+            time.sleep(max(min(poll_seconds, deadline - time.time()), 0))
+            poll_seconds = min(poll_seconds * 2, timeout)
+            current_block = self.get_current_block_number()
+        return current_block
+
+    def clear_cache(self):
+        # Pairs are read only metadata shared with the other jobs of the process, they are kept
+        self.nft_cache.clear()
+        self.factory_nft_contracts = None
+
+    def warmup_pair_cache(self):
+        self.pair_cache.warmup(self._importer.get_active_pool_addresses(self.chain_id))
+
+    def prefetch(self, start_block, end_block) -> PrefetchedWindow:
+        """Read dex events of the window and query NFTs that are not in the database yet.
+
+        It does not touch the NFTs state, so it is safe to run while the previous window is exported.
+        """
+        start = time.time()
+        with stage_timer(self.chain_id, 'prefetch_event_read'):
+            events = list(self._importer.get_dex_events_in_block_range(
+                start_block, end_block, event_types=EVENT_TYPES, projection=EVENT_FIELDS))
+
+        missing_nfts_info = {}
+        factory_nft_contracts = {}
+        if events:
+            # First event of every NFT, token ids of different NFT managers are told apart by the NFT key
+            first_events = {}
+            for event in events:
+                first_events.setdefault(get_nft_key(self.chain_id, event), event)
+            existed_keys = {key for key in first_events if key in self.nft_cache}
+            missing_keys = [key for key in first_events if key not in existed_keys]
+            if missing_keys:
+                cursor = self._exporter.get_nfts(missing_keys, projection=['tokenId'])
+                existed_keys.update(doc['_id'] for doc in cursor)
+            missing_nfts = [
+                {
+                    'nft_key': nft_key,
+                    'token_id': event['tokenId'],
+                    'block_number': event['block_number'],
+                    'contract_address': event['contract_address']
+                }
+                for nft_key, event in first_events.items() if nft_key not in existed_keys
+            ]
+            if missing_nfts:
+                factory_nft_contracts = dict(self.factory_nft_contracts or {})
+                if self.factory_nft_contracts is None:
+                    cursor = self._exporter.get_config(f"{self.chain_id}_factory_nft_contract")
+                    factory_nft_contracts = dict(cursor['addresses']) if cursor else {}
+                with stage_timer(self.chain_id, 'prefetch_missing_nft_rpc'):
+                    missing_nfts_info = self._state_querier.get_batch_nft_info_with_block_number(
+                        missing_nfts, factory_nft_contracts=factory_nft_contracts, new_pools=set(),
+                        block_number=end_block)
+
+        logger.info(f"Prefetch block {start_block} - {end_block} ({len(events)} events, "
+                    f"{len(missing_nfts_info)} missing nfts) take {time.time() - start}")
+        return PrefetchedWindow(start_block, end_block, events=events, missing_nfts_info=missing_nfts_info,
+                                factory_nft_contracts=factory_nft_contracts)
+
+    def enrich_all(self, start_block=0, end_block=0, prefetched: PrefetchedWindow = None, loader: Loader = None):
         start = time.time()
         logger.info(f"Start enrich block {start_block} - {end_block} ")
-        self.enrich_data(start_block, end_block)
+        number_of_events = self.enrich_data(start_block, end_block, prefetched=prefetched, loader=loader)
         end = time.time()
-        logger.info(f"Enrich block {start_block} - {end_block} take {end - start}")
+        logger.info(f"Enrich block {start_block} - {end_block} ({number_of_events} events) take {end - start}")
+        observe_cycle(self.chain_id, end_block - start_block + 1, number_of_events, self.number_of_exported_nfts,
+                      end - start)
+        return number_of_events
 
-    def enrich_data(self, start_block, end_block):
+    def enrich_data(self, start_block, end_block, prefetched: PrefetchedWindow = None, loader: Loader = None):
         job = UpdateNftInfoJob(
             start_block=start_block,
             end_block=end_block,
@@ -47,11 +162,32 @@ class UpdateNftInfoAdapter:
             importer=self._importer,
             exporter=self._exporter,
             chain_id=self.chain_id,
+            state_querier=self._state_querier,
+            prefetched=prefetched,
+            dex_db=self._dex_db,
+            loader=loader,
+            nft_cache=self.nft_cache,
+            pair_cache=self.pair_cache,
+            factory_nft_contracts=self.factory_nft_contracts,
+            partition_by_token=self.partition_by_token
         )
-        job.run()
+        try:
+            job.run()
+        except Exception:
+            self.clear_cache()
+            raise
+        if not job.completed:
+            self.clear_cache()
+            if loader is not None:
+                raise Exception(f'Failed to enrich block {start_block} - {end_block}')
+        else:
+            self.factory_nft_contracts = job.updated_factory_nft
+        self.number_of_exported_nfts = job.number_of_exported_nfts
+        logger.info(f'NFT cache: {len(self.nft_cache)} items, {self.nft_cache.hits} hits, {self.nft_cache.misses} misses')
 
         write_last_time_running_logs(
             stream_name=f'{self.__class__.__name__}_{self.chain_id}',
             timestamp=int(time.time()),
             threshold=TimeConstants.MINUTES_15
         )
+        return job.number_of_events
@@ -92,3 +92,25 @@ def write_last_time_running_logs(stream_name, timestamp, threshold=3600):
     g.labels(stream_name, threshold).inc(timestamp)
     _file = monitor_path + 'last_' + stream_name + '.prom'
     write_to_textfile(_file, registry)
+
+
+def write_adaptive_window_logs(stream_name, block_batch_size, batch_size, events_per_block):
+    """
+    The write_adaptive_window_logs function is used to write the window sizes chosen by an adaptive streamer.
+    Args:
+        stream_name: Identify the stream
+        block_batch_size: Number of blocks synced in a cycle
+        batch_size: Number of blocks handled by a worker
+        events_per_block: Measured events per block of the recent cycles
+
+    Returns:
+        Write Prometheus File Log
+    """
+    monitor_path = MonitoringConfig.MONITOR_ROOT_PATH
+    registry = CollectorRegistry()
+    g = Gauge('adaptive_window', 'Adaptive window sizes', ['process', 'size'], registry=registry)
+    g.labels(stream_name, 'block_batch_size').set(block_batch_size)
+    g.labels(stream_name, 'batch_size').set(batch_size)
+    g.labels(stream_name, 'events_per_block').set(events_per_block or 0)
+    _file = monitor_path + 'window_' + stream_name + '.prom'
+    write_to_textfile(_file, registry)
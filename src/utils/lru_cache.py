@@ -0,0 +1,80 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread safe cache that drops the least recently used keys above max_size.
+
+    Values are deep copied in and out so callers can mutate what they get without touching the cache. With
+    ttl_seconds a value older than the ttl is dropped when it is read.
+    """
+
+    def __init__(self, max_size=100000, ttl_seconds=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._get_item(key) is not None
+
+    def _get_item(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if self.ttl_seconds is not None and time.time() - item[0] > self.ttl_seconds:
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._get_item(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return copy.deepcopy(item[1])
+
+    def get_many(self, keys):
+        """Return a dict of the cached keys, missing keys are left out"""
+        result = {}
+        with self._lock:
+            for key in keys:
+                item = self._get_item(key)
+                if item is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                self._data.move_to_end(key)
+                result[key] = copy.deepcopy(item[1])
+        return result
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def put_many(self, items: dict):
+        now = time.time()
+        with self._lock:
+            for key, value in items.items():
+                self._data[key] = (now, copy.deepcopy(value))
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,65 @@
+import pymongo
+from pymongo.collection import Collection
+
+from src.constants.mongo_constants import DexNFTManagerIndexes
+
+
+def get_dex_events_filter(start_block, end_block, event_types=None):
+    filter_ = {
+        'block_number': {'$gte': start_block, '$lte': end_block}
+    }
+    if event_types is not None:
+        filter_["event_type"] = {"$in": event_types}
+    return filter_
+
+
+def create_dex_events_index(collection: Collection):
+    """Compound index of the block range reads, event_type is filtered in the index instead of the documents.
+
+    dex_events of the NFT manager and of the blockchain ETL databases share the same layout, return True when the
+    index was created.
+    """
+    index_name = DexNFTManagerIndexes.dex_events_block_number_event_type
+    if index_name not in collection.index_information():
+        collection.create_index(
+            [('block_number', pymongo.ASCENDING), ('event_type', pymongo.ASCENDING)],
+            name=index_name, background=True
+        )
+        return True
+    return False
+
+
+def explain_dex_events_in_block_range(collection: Collection, start_block, end_block, event_types=None,
+                                      projection=None):
+    filter_ = get_dex_events_filter(start_block, end_block, event_types)
+    return collection.find(filter_, projection=projection).explain()
+
+
+def get_dex_events_last_block_number(collection: Collection):
+    doc = collection.find_one({}, projection={'block_number': True}, sort=[('block_number', pymongo.DESCENDING)])
+    return doc['block_number'] if doc else None
+
+
+def get_winning_plan_stages(explain: dict):
+    """Return the (stage, index name) pairs of the winning plan of a find explain, root stage first"""
+    winning_plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+    # Plans run by the slot based engine are nested in queryPlan
+    winning_plan = winning_plan.get('queryPlan', winning_plan)
+
+    stages = []
+    plans = [winning_plan]
+    while plans:
+        plan = plans.pop(0)
+        stages.append((plan.get('stage'), plan.get('indexName')))
+        if plan.get('inputStage'):
+            plans.append(plan['inputStage'])
+        plans.extend(plan.get('inputStages', []))
+    return stages
+
+
+def is_index_used(explain: dict, index_name):
+    """The plan scans the index and never falls back to a collection scan"""
+    stages = get_winning_plan_stages(explain)
+    if any(stage == 'COLLSCAN' for stage, _ in stages):
+        return False
+    return any(stage == 'IXSCAN' and name == index_name for stage, name in stages)
@@ -0,0 +1,80 @@
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, start_http_server, write_to_textfile
+
+from config import MonitoringConfig
+from src.constants.network_constants import Chains
+from src.utils.logger_utils import get_logger
+
+logger = get_logger('Stream Metrics')
+
+REGISTRY = CollectorRegistry()
+
+STAGE_SECONDS = Histogram(
+    'nft_stream_stage_seconds', 'Duration of a stage of the NFT stream', ['chain_id', 'stage'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300), registry=REGISTRY)
+BLOCKS = Counter('nft_stream_blocks', 'Blocks synced', ['chain_id'], registry=REGISTRY)
+EVENTS = Counter('nft_stream_events', 'Dex events processed', ['chain_id'], registry=REGISTRY)
+EXPORTED_NFTS = Counter('nft_stream_exported_nfts', 'NFTs exported', ['chain_id'], registry=REGISTRY)
+CYCLE_EXPORTED_NFTS = Gauge(
+    'nft_stream_cycle_exported_nfts', 'NFTs exported by the last cycle', ['chain_id'], registry=REGISTRY)
+BLOCKS_PER_SECOND = Gauge(
+    'nft_stream_blocks_per_second', 'Blocks per second of the last cycle', ['chain_id'], registry=REGISTRY)
+EVENTS_PER_SECOND = Gauge(
+    'nft_stream_events_per_second', 'Events per second of the last cycle', ['chain_id'], registry=REGISTRY)
+LAG_BLOCKS = Gauge('nft_stream_lag_blocks', 'Blocks behind the ETL head', ['chain_id'], registry=REGISTRY)
+LAG_SECONDS = Gauge(
+    'nft_stream_lag_seconds', 'Estimated seconds behind the ETL head', ['chain_id'], registry=REGISTRY)
+ETH_CALL_CACHE_LOOKUPS = Counter(
+    'nft_stream_eth_call_cache_lookups', 'Lookups of block pinned eth_call results', ['chain_id', 'result'],
+    registry=REGISTRY)
+
+_textfile = None
+
+
+def setup(port=None, textfile_name=None):
+    """Expose the stream metrics on an HTTP endpoint, or in a textfile of the monitor directory"""
+    global _textfile
+    if port:
+        start_http_server(port, registry=REGISTRY)
+        logger.info(f'Serve stream metrics on port {port}')
+    if textfile_name:
+        _textfile = MonitoringConfig.MONITOR_ROOT_PATH + textfile_name + '.prom'
+
+
+def flush():
+    if _textfile is None:
+        return
+    try:
+        write_to_textfile(_textfile, REGISTRY)
+    except OSError as e:
+        logger.warning(f'Cannot write stream metrics to {_textfile}: {e}')
+
+
+@contextmanager
+def stage_timer(chain_id, stage):
+    with STAGE_SECONDS.labels(chain_id, stage).time():
+        yield
+
+
+def observe_cycle(chain_id, number_of_blocks, number_of_events, number_of_nfts, duration):
+    BLOCKS.labels(chain_id).inc(number_of_blocks)
+    EVENTS.labels(chain_id).inc(number_of_events or 0)
+    EXPORTED_NFTS.labels(chain_id).inc(number_of_nfts or 0)
+    CYCLE_EXPORTED_NFTS.labels(chain_id).set(number_of_nfts or 0)
+    STAGE_SECONDS.labels(chain_id, 'cycle').observe(duration)
+    if duration > 0:
+        BLOCKS_PER_SECOND.labels(chain_id).set(number_of_blocks / duration)
+        EVENTS_PER_SECOND.labels(chain_id).set((number_of_events or 0) / duration)
+
+
+def observe_eth_call_cache(chain_id, hits, misses):
+    ETH_CALL_CACHE_LOOKUPS.labels(chain_id, 'hit').inc(hits)
+    ETH_CALL_CACHE_LOOKUPS.labels(chain_id, 'miss').inc(misses)
+
+
+def observe_lag(chain_id, head_block, synced_block):
+    """Lag in seconds is estimated with the average block time of the chain"""
+    lag = max(head_block - synced_block, 0)
+    LAG_BLOCKS.labels(chain_id).set(lag)
+    LAG_SECONDS.labels(chain_id).set(lag * Chains.block_time.get(chain_id, 0))
@@ -0,0 +1,70 @@
+import time
+
+from query_state_lib.base.utils.decoder import decode_eth_call_data
+from web3 import Web3
+
+from artifacts.abis.dexes.uniswap_v3_nft_manage_abi import UNISWAP_V3_NFT_MANAGER_ABI
+from artifacts.abis.dexes.uniswap_v3_pool_abi import UNISWAP_V3_POOL_ABI
+from artifacts.abis.multicall_v3_abi import MULTICALL_V3_ABI
+from src.services.blockchain.abi_decoder import get_function_decoder
+
+w3 = Web3()
+ADDRESS = '0x46a15b0b27311cedf172ab29e4f4766fbe7f4364'
+
+
+def get_outputs(n_calls):
+    """tryAggregate response of n_calls positions, ticks, slot0 and feeGrowthGlobal0X128 calls"""
+    positions = w3.codec.encode(
+        ['uint96', 'address', 'address', 'address', 'uint24', 'int24', 'int24', 'uint128', 'uint256', 'uint256',
+         'uint128', 'uint128'],
+        [0, ADDRESS, ADDRESS, ADDRESS, 3000, -887220, 887220, 10 ** 20, 2 ** 200, 2 ** 201, 5, 6]
+    )
+    ticks = w3.codec.encode(
+        ['uint128', 'int128', 'uint256', 'uint256', 'int56', 'uint160', 'uint32', 'bool'],
+        [10 ** 18, -10 ** 18, 2 ** 130, 2 ** 131, -10 ** 12, 2 ** 150, 1700000000, True]
+    )
+    slot0 = w3.codec.encode(
+        ['uint160', 'int24', 'uint16', 'uint16', 'uint16', 'uint8', 'bool'], [2 ** 96, -200000, 10, 20, 30, 0, True])
+    fee_growth = w3.codec.encode(['uint256'], [2 ** 255 + 7])
+
+    # Decoders are resolved when the calls are built, as W3Multicall.Call does
+    calls = [
+        (get_function_decoder(UNISWAP_V3_NFT_MANAGER_ABI, 'positions'), positions),
+        (get_function_decoder(UNISWAP_V3_POOL_ABI, 'ticks'), ticks),
+        (get_function_decoder(UNISWAP_V3_POOL_ABI, 'slot0'), slot0),
+        (get_function_decoder(UNISWAP_V3_POOL_ABI, 'feeGrowthGlobal0X128'), fee_growth)
+    ]
+    calls = [calls[idx % len(calls)] for idx in range(n_calls)]
+    aggregated = w3.codec.encode(['(bool,bytes)[]'], [[(True, output) for _, output in calls]])
+    return calls, aggregated
+
+
+def decode_with_eth_abi(calls, aggregated):
+    results = decode_eth_call_data(MULTICALL_V3_ABI, 'tryAggregate', '0x' + aggregated.hex())[0]
+    return [
+        decode_eth_call_data([decoder.fn_abi], decoder.fn_name, '0x' + output.hex())
+        for (decoder, _), (_, output) in zip(calls, results)
+    ]
+
+
+def decode_with_decoder(calls, aggregated):
+    results = get_function_decoder(MULTICALL_V3_ABI, 'tryAggregate').decode(aggregated)[0]
+    return [decoder.decode(output) for (decoder, _), (_, output) in zip(calls, results)]
+
+
+def timeit(fn, *args):
+    start_time = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start_time
+
+
+if __name__ == '__main__':
+    n_calls = 50000
+    calls, aggregated = get_outputs(n_calls)
+
+    old_data, old_duration = timeit(decode_with_eth_abi, calls, aggregated)
+    new_data, new_duration = timeit(decode_with_decoder, calls, aggregated)
+    assert old_data == new_data, 'Decoders disagree'
+    print(f'decode_eth_call_data: {round(old_duration, 3)}s, {round(old_duration / n_calls * 1e6, 1)}us per call')
+    print(f'FunctionDecoder:      {round(new_duration, 3)}s, {round(new_duration / n_calls * 1e6, 1)}us per call')
+    print(f'Speed up: {round(old_duration / new_duration, 1)}x')
@@ -0,0 +1,68 @@
+import time
+
+from web3 import Web3, contract
+
+from artifacts.abis.dexes.uniswap_v3_nft_manage_abi import UNISWAP_V3_NFT_MANAGER_ABI
+from artifacts.abis.dexes.uniswap_v3_pool_abi import UNISWAP_V3_POOL_ABI
+from src.services.blockchain.abi_encoder import get_function_encoder, get_call_args, to_checksum_address
+from src.services.blockchain.multicall import W3Multicall
+
+w3 = Web3()
+NFT_MANAGER = '0x46a15b0b27311cedf172ab29e4f4766fbe7f4364'
+POOL = '0x172fcd41e0913e95784454622d1c3724f546f849'
+
+
+def get_calls(n_calls):
+    calls = []
+    for idx in range(n_calls // 2):
+        calls.append((NFT_MANAGER, UNISWAP_V3_NFT_MANAGER_ABI, 'positions', idx))
+        calls.append((POOL, UNISWAP_V3_POOL_ABI, 'ticks', idx % 2000 - 1000))
+    return calls
+
+
+def encode_with_contract(calls):
+    data = []
+    for address, abi, fn_name, fn_paras in calls:
+        Web3.to_checksum_address(address)
+        c = contract.Contract
+        c.w3 = w3
+        c.abi = abi
+        data.append(c.encodeABI(fn_name=fn_name, args=[fn_paras]))
+    return data
+
+
+def encode_with_encoder(calls):
+    data = []
+    for address, abi, fn_name, fn_paras in calls:
+        to_checksum_address(address)
+        data.append(get_function_encoder(abi, fn_name).encode_hex(get_call_args(fn_paras)))
+    return data
+
+
+def build_multicall(calls):
+    w3_multicall = W3Multicall(w3)
+    for address, abi, fn_name, fn_paras in calls:
+        w3_multicall.add(W3Multicall.Call(address, abi, fn_name, fn_paras, block_number=1))
+    return w3_multicall
+
+
+def timeit(fn, *args):
+    start_time = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start_time
+
+
+if __name__ == '__main__':
+    n_calls = 50000
+    calls = get_calls(n_calls)
+
+    old_data, old_duration = timeit(encode_with_contract, calls)
+    new_data, new_duration = timeit(encode_with_encoder, calls)
+    assert old_data == new_data, 'Encoders disagree'
+    print(f'Contract.encodeABI: {round(old_duration, 3)}s, {round(old_duration / n_calls * 1e6, 1)}us per call')
+    print(f'FunctionEncoder:    {round(new_duration, 3)}s, {round(new_duration / n_calls * 1e6, 1)}us per call')
+    print(f'Speed up: {round(old_duration / new_duration, 1)}x')
+
+    _, multicall_duration = timeit(build_multicall, calls)
+    print(f'W3Multicall.Call:   {round(multicall_duration, 3)}s, '
+          f'{round(multicall_duration / n_calls * 1e6, 1)}us per call')
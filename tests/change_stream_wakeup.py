@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+
+from pymongo import MongoClient
+
+from src.databases.dex_nft_manager_db import NFTMongoDB
+
+# Change streams need a replica set, a single node one is enough:
+#   mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017 && mongosh --eval 'rs.initiate()'
+CONNECTION_URL = os.getenv('REPLICA_SET_CONNECTION_URL', 'mongodb://localhost:27017/?replicaSet=rs0')
+DATABASE = 'change_stream_wakeup_test'
+COLLECTOR_ID = 'streaming_collector'
+
+
+def update_collector_later(db: NFTMongoDB, block_number, delay):
+    time.sleep(delay)
+    db.collector_collection.update_one(
+        {'_id': COLLECTOR_ID}, {'$set': {'last_updated_at_block_number': block_number}}, upsert=True)
+    return time.time()
+
+
+def measure_wakeup(db: NFTMongoDB, last_block, delay=2, timeout=30):
+    """Seconds between the collector update and the return of the watcher"""
+    updated_at = {}
+    thread = threading.Thread(
+        target=lambda: updated_at.setdefault('time', update_collector_later(db, last_block + 1, delay)))
+    thread.start()
+    current_block = db.watch_last_block_number(COLLECTOR_ID, last_block, timeout)
+    woke_up_at = time.time()
+    thread.join()
+    assert current_block == last_block + 1, f'Watcher returned block {current_block}'
+    return woke_up_at - updated_at['time']
+
+
+if __name__ == '__main__':
+    client = MongoClient(CONNECTION_URL)
+    client.drop_database(DATABASE)
+    db = NFTMongoDB(database=DATABASE, client=client)
+    db.collector_collection.insert_one({'_id': COLLECTOR_ID, 'last_updated_at_block_number': 100})
+
+    try:
+        # Already passed, returns without waiting
+        start_time = time.time()
+        assert db.watch_last_block_number(COLLECTOR_ID, 99, timeout=30) == 100
+        assert time.time() - start_time < 1, 'Watcher waited for a block that was already collected'
+
+        latencies = [measure_wakeup(db, 100 + idx) for idx in range(5)]
+        print(f'Wakeup latency: max {round(max(latencies), 3)}s, mean {round(sum(latencies) / len(latencies), 3)}s')
+        # max_await_time_ms is 1 second, a fixed 30 seconds sleep would wait on average 15 seconds
+        assert max(latencies) < 1.5, 'Watcher did not wake up on the collector update'
+
+        # Nothing collected, returns on timeout with the same block
+        start_time = time.time()
+        assert db.watch_last_block_number(COLLECTOR_ID, 105, timeout=2) == 105
+        assert 2 <= time.time() - start_time < 4, 'Watcher did not return on timeout'
+        print('OK')
+    finally:
+        client.drop_database(DATABASE)
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import time
+
+from query_state_lib.base.mappers.eth_call_mapper import EthCall
+from query_state_lib.client.client_querier import generate_json_rpc_from_type
+
+from src.services.blockchain.provider_pool import ProviderPool
+from src.services.blockchain.rpc_stand_in import RPCRecordings, RPCStandIn
+
+TOKEN = '0xdac17f958d2ee523a2206206994597c13d831ec7'
+NUMBER_OF_CALLS = 20
+PINNED_BLOCK = 19000000
+
+
+def get_calls(block_number='latest'):
+    """balanceOf calls whose recorded result is the index of the call"""
+    return [
+        EthCall(to=TOKEN, data=f'0x70a08231{idx:064x}', block_number=block_number, id=idx)
+        for idx in range(NUMBER_OF_CALLS)
+    ]
+
+
+def record_calls(path):
+    recordings = RPCRecordings(path)
+    for block_number in ('latest', hex(PINNED_BLOCK)):
+        calls = get_calls(block_number)
+        items = generate_json_rpc_from_type(calls[0].type, calls)
+        recordings.add_many(items, [{'jsonrpc': '2.0', 'id': item['id'], 'result': f"0x{item['id']:064x}"} for item in items])
+    return recordings
+
+
+def send(pool: ProviderPool, block_number='latest'):
+    start_time = time.time()
+    responses = pool.sent_batch_to_provider(get_calls(block_number), batch_size=NUMBER_OF_CALLS)
+    assert {idx: int(call.result, 16) for idx, call in responses.items()} == {idx: idx for idx in range(NUMBER_OF_CALLS)}
+    return time.time() - start_time
+
+
+def check_failover(recordings):
+    """A primary answering 503 to everything is failed over without losing a call"""
+    primary, fallback = RPCStandIn(recordings, error_rate=1.0), RPCStandIn(recordings)
+    pool = ProviderPool([primary.start(), fallback.start()], cooldown_seconds=60)
+    try:
+        for _ in range(3):
+            send(pool)
+        assert primary.stats['injectedErrors'] >= 1
+        assert fallback.stats['replayed'] == 3 * NUMBER_OF_CALLS
+        print(f'Failover: {pool.get_stats()}')
+    finally:
+        pool.close()
+        primary.close()
+        fallback.close()
+
+
+def check_cooldown(recordings):
+    """A fast primary failing half of its requests sits out cooldown_seconds then takes the traffic back"""
+    primary, fallback = RPCStandIn(recordings), RPCStandIn(recordings, latency=0.2)
+    pool = ProviderPool([primary.start(), fallback.start()], cooldown_seconds=1, error_threshold=0.5)
+    try:
+        send(pool)
+        primary.error_rate = 1.0
+        # The error rate moves by a fifth of each result, the fourth failure goes past the threshold
+        for _ in range(4):
+            send(pool)
+        assert pool.get_stats()[0]['penalized']
+        penalized_requests = primary.stats['requests']
+        for _ in range(3):
+            send(pool)
+        assert primary.stats['requests'] == penalized_requests, 'Penalized primary still got requests'
+
+        time.sleep(1.1)
+        primary.error_rate = 0.0
+        send(pool)
+        assert primary.stats['requests'] == penalized_requests + 1, 'Primary did not take the traffic back'
+        print(f'Cooldown: {pool.get_stats()}')
+    finally:
+        pool.close()
+        primary.close()
+        fallback.close()
+
+
+def check_hedging(recordings):
+    """Calls on 'latest' are sent to the fallback when the primary is slow, pinned calls wait for the primary"""
+    for block_number, expected in (('latest', 'hedged'), (hex(PINNED_BLOCK), 'not hedged')):
+        primary, fallback = RPCStandIn(recordings, latency=1.0), RPCStandIn(recordings)
+        pool = ProviderPool([primary.start(), fallback.start()], hedge_after=0.1)
+        try:
+            duration = send(pool, block_number)
+            if expected == 'hedged':
+                assert duration < 0.5, f'Hedged request took {duration}s'
+                assert fallback.stats['requests'] == 1
+            else:
+                assert duration >= 1.0, f'Pinned request took {duration}s, it was hedged'
+                assert fallback.stats['requests'] == 0
+            print(f'Hedging {block_number}: {expected} in {round(duration, 3)}s')
+        finally:
+            pool.close()
+            primary.close()
+            fallback.close()
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        recordings = record_calls(os.path.join(directory, 'recordings.jsonl'))
+        check_failover(recordings)
+        check_cooldown(recordings)
+        check_hedging(recordings)
+    print('OK')
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import time
+
+import click
+
+from src.constants.network_constants import NATIVE_TOKEN, MulticallContract
+from src.services.blockchain.batch_queries_service import call_key
+from src.services.blockchain.multicall import W3Multicall
+from src.services.blockchain.rpc_stand_in import RPCRecordings, RPCStandIn
+from src.services.blockchain.state_query_service import StateQueryService
+
+# Uniswap V3 positions of Ethereum, read at a pinned block and a day before it like the enricher does
+CHAIN_ID = '0x1'
+NFT_MANAGER = '0xc36442b4a4522e871399cd717abdd847ab11fe88'
+TOKEN_IDS = range(620000, 620100)
+BLOCK_NUMBER = 19000000
+BEFORE_BLOCK_NUMBER = BLOCK_NUMBER - 7200
+
+RECORDINGS = os.path.join(os.path.dirname(__file__), 'fixtures', 'rpc_recordings', 'ethereum_uniswap_v3.jsonl')
+
+
+def run_scenario(state_querier: StateQueryService):
+    """Missing NFT info, current and day before fees, then balances of the owners, as the jobs chain them"""
+    missing_nfts = [
+        {
+            'nft_key': f'{CHAIN_ID}_{NFT_MANAGER}_{token_id}',
+            'token_id': str(token_id),
+            'block_number': BLOCK_NUMBER,
+            'contract_address': NFT_MANAGER
+        }
+        for token_id in TOKEN_IDS
+    ]
+    nft_info = state_querier.get_batch_nft_info_with_block_number(
+        missing_nfts, factory_nft_contracts={}, new_pools=set(), block_number=BLOCK_NUMBER)
+
+    nfts = [
+        {
+            '_id': nft_key,
+            'tokenId': nft_key.split('_')[-1],
+            'nftManagerAddress': NFT_MANAGER,
+            'poolAddress': info['pool_address'],
+            'tickLower': info['tick_lower'],
+            'tickUpper': info['tick_upper'],
+            'lastInteractAt': BLOCK_NUMBER
+        }
+        for nft_key, info in sorted(nft_info.items()) if info.get('pool_address')
+    ]
+    w3_multicall = W3Multicall(state_querier._w3, address=MulticallContract.get_multicall_contract(CHAIN_ID))
+    current_fees, _, important_nfts, _ = state_querier.get_batch_nft_fee_with_current_block(
+        nfts=nfts, pools={}, w3_multicall=w3_multicall, block_number=BLOCK_NUMBER)
+    w3_multicall.calls = {}
+    before_fees = state_querier.get_batch_nft_fee_with_block_number(
+        nfts=important_nfts, pools={}, w3_multicall=w3_multicall, a_day_ago_block_number=BEFORE_BLOCK_NUMBER)
+
+    # Owners hold the tokens of their positions, decimals do not change the requests
+    wallet_tokens = {}
+    for nft_key, info in sorted(nft_info.items()):
+        position = current_fees.get(call_key('positions', NFT_MANAGER, int(nft_key.split('_')[-1]), BLOCK_NUMBER))
+        if info.get('wallet') and position:
+            wallet_tokens.setdefault(info['wallet'], {NATIVE_TOKEN}).update({position[2], position[3]})
+    wallet_tokens = {wallet: sorted(tokens) for wallet, tokens in wallet_tokens.items()}
+    tokens = [{'address': token, 'decimals': 18} for token in sorted(set().union(*wallet_tokens.values()))]
+    balances, _ = state_querier.batch_balance_of_multiple_addresses(
+        wallet_tokens, tokens, block_number=BLOCK_NUMBER)
+    wallet_balances = {
+        wallet: state_querier.batch_balance_of(
+            wallet, [{'address': token, 'decimals': 18} for token in wallet_tokens[wallet]],
+            block_number=BLOCK_NUMBER)
+        for wallet in list(wallet_tokens)[:10]
+    }
+
+    return {
+        'nftInfo': nft_info,
+        'currentFees': current_fees,
+        'beforeFees': before_fees,
+        'balances': balances,
+        'walletBalances': wallet_balances
+    }
+
+
+def replay(recordings_path, max_in_flight, latency, jitter, error_rate, seed):
+    stand_in = RPCStandIn(
+        RPCRecordings(recordings_path), latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+    uri = stand_in.start()
+    try:
+        start_time = time.perf_counter()
+        result = run_scenario(StateQueryService(uri, max_in_flight=max_in_flight))
+        duration = time.perf_counter() - start_time
+    finally:
+        stand_in.close()
+    return result, duration, dict(stand_in.stats)
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('--record', is_flag=True, default=False, help='Record the scenario from --upstream into --recordings')
+@click.option('-u', '--upstream', default=None, type=str, help='Archive node of Ethereum to record from')
+@click.option('-r', '--recordings', default=RECORDINGS, show_default=True, type=str, help='Recordings to replay')
+@click.option('--max-in-flight', default=16, show_default=True, type=int, help='In flight requests of the async run')
+@click.option('--latency', default=0.05, show_default=True, type=float, help='Seconds added to every request')
+@click.option('--jitter', default=0.02, show_default=True, type=float, help='Random seconds added to every request')
+@click.option('--error-rate', default=0.0, show_default=True, type=float,
+              help='Share of requests failing with 503, only retried by the async client')
+@click.option('--seed', default=1, show_default=True, type=int, help='Seed of the injected latency and errors')
+def rpc_replay_benchmark(record, upstream, recordings, max_in_flight, latency, jitter, error_rate, seed):
+    """Replay archive node responses of the NFT enrichment calls through StateQueryService.
+
+    The committed recordings were recorded from a deterministic local node, re-record them from a real archive
+    node with --record --upstream. Every run must get the same results without any request missing.
+    """
+    if record:
+        if not upstream:
+            raise click.BadOptionUsage('--upstream', 'Recording needs an upstream archive node')
+        with tempfile.TemporaryDirectory() as directory:
+            # Recorded in a new file so calls of an older scenario are dropped
+            path = os.path.join(directory, 'recordings.jsonl')
+            stand_in = RPCStandIn(RPCRecordings(path), upstream=upstream)
+            try:
+                run_scenario(StateQueryService(stand_in.start()))
+            finally:
+                stand_in.close()
+            os.makedirs(os.path.dirname(recordings), exist_ok=True)
+            shutil.move(path, recordings)
+        print(f'Recorded {stand_in.stats["forwarded"]} calls into {recordings}')
+        return
+
+    runs = [('ClientQuerier', 0, 0.0), (f'AsyncRPCClient x{max_in_flight}', max_in_flight, error_rate)]
+    results = []
+    for name, in_flight, run_error_rate in runs:
+        result, duration, stats = replay(recordings, in_flight, latency, jitter, run_error_rate, seed)
+        assert stats['missing'] == 0, f'{name}: {stats["missing"]} calls are not recorded'
+        results.append(result)
+        print(f'{name}: {round(duration, 3)}s, {stats["requests"]} requests, {stats["calls"]} calls, '
+              f'{stats["injectedErrors"]} injected errors')
+    assert all(result == results[0] for result in results), 'Replayed results differ between clients'
+    result = results[0]
+    print(f"{len(result['nftInfo'])} nfts, {len(result['currentFees'])} current and "
+          f"{len(result['beforeFees'])} day before calls, {len(result['balances'])} wallets")
+
+
+if __name__ == '__main__':
+    rpc_replay_benchmark()